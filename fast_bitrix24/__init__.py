@@ -1,3 +1,4 @@
 """Высокоуровневый API для доступа к Битрикс24"""
 
 from fast_bitrix24.bitrix import Bitrix, BitrixAsync
+from fast_bitrix24.pool import BitrixPool
@@ -0,0 +1,207 @@
+"""Automatic detection of the portal's leaky bucket limits.
+
+Bitrix24 plans differ in how many requests can be sent at once and how
+fast the bucket leaks afterwards, but the server doesn't report these
+numbers. The autotuner learns them from `QUERY_LIMIT_EXCEEDED` responses:
+it probes higher limits while the client is held back only by its own
+throttler and backs off when the server starts refusing requests.
+"""
+
+import json
+import os
+import time
+
+from .logger import logger
+
+DEFAULT_RATE_LIMITS_FILE = os.path.join(
+    os.path.expanduser("~"), ".fast_bitrix24", "rate_limits.json"
+)
+
+# how many successful requests sent with a full bucket
+# are needed before trying higher limits
+PROBE_AFTER_SATURATED_SUCCESSES = 100
+
+PROBE_FACTOR = 1.25  # how much to raise the limits when probing
+BACKOFF_FACTOR = 0.8  # how much to lower the limits after a refusal
+
+MIN_POOL_SIZE = 1
+MIN_REQUESTS_PER_SECOND = 0.5
+MAX_POOL_SIZE = 1000
+MAX_REQUESTS_PER_SECOND = 50
+
+# after how many seconds the limits refused by the server may be probed again
+CEILING_EXPIRY = 60 * 60
+
+
+class RateLimitAutotuner:
+    """Adjusts `LeakyBucketThrottler` limits to the portal's real ones.
+
+    While requests succeed with the bucket full, the limits are raised
+    by `PROBE_FACTOR`, but never up to the values refused by the server
+    before. When the server refuses a request, the limit that was
+    exceeded is lowered by `BACKOFF_FACTOR` and remembered as a ceiling:
+    - if the bucket was not full yet, the portal's pool is smaller
+    than assumed;
+    - if the bucket was full, the portal leaks slower than assumed.
+
+    A burst of concurrent requests sent under the old limits is refused
+    as a whole, so refusals of requests sent before the last back-off
+    are ignored: the limits are lowered once per refusal episode.
+
+    The ceilings expire after `CEILING_EXPIRY` seconds, so that limits
+    raised by the portal (e.g. after a plan change) are found again.
+
+    The learned limits are saved per portal host to `rate_limits_file`,
+    so that the next runs start at full speed.
+
+    The autotuner only sees the local state of the throttler,
+    so it can't be used with a shared throttler backend.
+    """
+
+    def __init__(self, throttler, portal: str, rate_limits_file: str = None):
+        self.throttler = throttler
+        self.portal = portal
+        self.rate_limits_file = rate_limits_file or DEFAULT_RATE_LIMITS_FILE
+
+        # the lowest limits refused by the server so far
+        self.pool_size_ceiling = MAX_POOL_SIZE
+        self.requests_per_second_ceiling = MAX_REQUESTS_PER_SECOND
+
+        # when a ceiling was last lowered (`time.time()`)
+        self.ceilings_set_at = None
+
+        # when the limits were last lowered (`time.monotonic()`)
+        self.backed_off_at = None
+
+        self.saturated_successes = 0
+
+        self.load()
+
+    def is_saturated(self) -> bool:
+        return self.throttler.level() >= self.throttler.pool_size - 1
+
+    def on_success(self):
+        """Register a request accepted by the server"""
+        if not self.is_saturated():
+            return
+
+        self.saturated_successes += 1
+        if self.saturated_successes < PROBE_AFTER_SATURATED_SUCCESSES:
+            return
+
+        self.saturated_successes = 0
+        self.expire_ceilings()
+
+        pool_size = min(
+            int(self.throttler.pool_size * PROBE_FACTOR) + 1,
+            self.pool_size_ceiling - 1,
+        )
+        requests_per_second = min(
+            self.throttler.requests_per_second * PROBE_FACTOR,
+            self.requests_per_second_ceiling * BACKOFF_FACTOR,
+        )
+
+        self.set_limits(
+            max(pool_size, self.throttler.pool_size),
+            max(requests_per_second, self.throttler.requests_per_second),
+        )
+
+    def expire_ceilings(self):
+        """Forget the refused limits after `CEILING_EXPIRY` seconds"""
+        if (
+            self.ceilings_set_at is not None
+            and time.time() - self.ceilings_set_at > CEILING_EXPIRY
+        ):
+            self.pool_size_ceiling = MAX_POOL_SIZE
+            self.requests_per_second_ceiling = MAX_REQUESTS_PER_SECOND
+            self.ceilings_set_at = None
+
+    def on_rate_limited(self, sent_at: float = None):
+        """Register a request refused with `QUERY_LIMIT_EXCEEDED`.
+
+        `sent_at` is the `time.monotonic()` moment the request was sent.
+        Requests sent before the last back-off belong to the refusal
+        episode that has already been handled."""
+        self.saturated_successes = 0
+
+        if (
+            sent_at is not None
+            and self.backed_off_at is not None
+            and sent_at <= self.backed_off_at
+        ):
+            return
+
+        self.backed_off_at = time.monotonic()
+        self.ceilings_set_at = time.time()
+
+        pool_size = self.throttler.pool_size
+        requests_per_second = self.throttler.requests_per_second
+
+        if self.is_saturated():
+            self.requests_per_second_ceiling = requests_per_second
+            requests_per_second = max(
+                requests_per_second * BACKOFF_FACTOR, MIN_REQUESTS_PER_SECOND
+            )
+
+        else:
+            self.pool_size_ceiling = pool_size
+            pool_size = max(
+                int(self.throttler.level()),
+                int(pool_size * BACKOFF_FACTOR),
+                MIN_POOL_SIZE,
+            )
+
+        self.set_limits(pool_size, requests_per_second)
+
+    def set_limits(self, pool_size: int, requests_per_second: float):
+        if (pool_size, requests_per_second) == (
+            self.throttler.pool_size,
+            self.throttler.requests_per_second,
+        ):
+            return
+
+        logger.info(
+            "Rate limits tuned: {'request_pool_size': %s, 'requests_per_second': %s}",
+            pool_size,
+            round(requests_per_second, 2),
+        )
+
+        self.throttler.set_limits(pool_size, requests_per_second)
+        self.save()
+
+    def load(self):
+        limits = self.read_file().get(self.portal)
+        if not limits:
+            return
+
+        self.pool_size_ceiling = limits["pool_size_ceiling"]
+        self.requests_per_second_ceiling = limits["requests_per_second_ceiling"]
+        self.ceilings_set_at = limits.get("ceilings_set_at")
+        self.expire_ceilings()
+        self.throttler.set_limits(
+            limits["request_pool_size"], limits["requests_per_second"]
+        )
+
+    def save(self):
+        all_limits = self.read_file()
+        all_limits[self.portal] = {
+            "request_pool_size": self.throttler.pool_size,
+            "requests_per_second": self.throttler.requests_per_second,
+            "pool_size_ceiling": self.pool_size_ceiling,
+            "requests_per_second_ceiling": self.requests_per_second_ceiling,
+            "ceilings_set_at": self.ceilings_set_at,
+            "updated_at": time.time(),
+        }
+
+        os.makedirs(os.path.dirname(self.rate_limits_file) or ".", exist_ok=True)
+        tmp_path = f"{self.rate_limits_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(all_limits, f)
+        os.replace(tmp_path, self.rate_limits_file)
+
+    def read_file(self) -> dict:
+        try:
+            with open(self.rate_limits_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
@@ -0,0 +1,264 @@
+"""Storages for throttler state shared between processes and hosts.
+
+By default every `ServerRequestHandler` keeps its throttlers in memory,
+so each process thinks it owns the full request budget of the portal.
+A backend lets all clients working with the same portal draw from one budget.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import time
+import uuid
+from urllib.parse import unquote, urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# пауза между попытками захватить занятую блокировку
+LOCK_POLL_INTERVAL = 0.002
+
+# снимает блокировку, только если она все еще принадлежит этому клиенту
+UNLOCK_SCRIPT = (
+    'if redis.call("GET", KEYS[1]) == ARGV[1] then '
+    'return redis.call("DEL", KEYS[1]) else return 0 end'
+)
+
+
+class BackendError(Exception):
+    pass
+
+
+class ThrottlerBackend:
+    """Base class for shared throttler state storages.
+
+    The state of every throttler is a JSON-serializable dict stored
+    under its own key. It is read and modified only inside `transaction()`,
+    which guarantees that no other client changes it at the same time.
+    """
+
+    def now(self) -> float:
+        """Clock used for all the records in the shared state.
+
+        Unlike `time.monotonic()`, wall clock time is comparable
+        across processes and hosts."""
+        return time.time()
+
+    def transaction(self, key: str):
+        """An async context manager that locks the state under `key`,
+        yields it as a dict and saves it back on exit"""
+        raise NotImplementedError
+
+
+class FileLockBackend(ThrottlerBackend):
+    """Keeps the state in a JSON file guarded by an OS file lock.
+
+    Suitable for several processes on one host.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+
+    @contextlib.asynccontextmanager
+    async def transaction(self, key: str):
+        # file locks and file I/O block, so they run in the default executor
+        # to keep the event loop responsive
+        loop = asyncio.get_running_loop()
+        lock_fd = await loop.run_in_executor(
+            None, os.open, self.lock_path, os.O_RDWR | os.O_CREAT
+        )
+
+        try:
+            while not await loop.run_in_executor(None, self._try_lock, lock_fd):
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+            try:
+                all_states = await loop.run_in_executor(None, self._read)
+                state = all_states.setdefault(key, {})
+                yield state
+                await loop.run_in_executor(None, self._write, all_states)
+
+            finally:
+                await loop.run_in_executor(None, self._unlock, lock_fd)
+
+        finally:
+            await loop.run_in_executor(None, os.close, lock_fd)
+
+    @staticmethod
+    def _try_lock(fd) -> bool:
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _unlock(fd):
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, all_states: dict):
+        # пишем во временный файл и подменяем, чтобы файл
+        # никогда не оказался записанным наполовину
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(all_states, f)
+        os.replace(tmp_path, self.path)
+
+
+class RedisBackend(ThrottlerBackend):
+    """Keeps the state in Redis or any server speaking the Redis protocol.
+
+    Suitable for processes on several hosts. Only the `GET`, `SET` and `EVAL`
+    commands are used, so no Redis client library is required.
+
+    Parameters:
+    - `url: str = "redis://localhost:6379/0"` - address of the server
+    - `prefix: str = "fast_bitrix24:"` - prefix for all the keys
+    - `lock_ttl: float = 5` - seconds after which a lock left by a crashed
+    client expires
+    - `state_ttl: float = 3600` - seconds after which an unused state expires
+    """
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "fast_bitrix24:",
+        lock_ttl: float = 5,
+        state_ttl: float = 3600,
+    ):
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError("Only 'redis://' URLs are supported")
+
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+
+        self.prefix = prefix
+        self.lock_ttl_ms = int(lock_ttl * 1000)
+        self.state_ttl_ms = int(state_ttl * 1000)
+
+        self._reader = self._writer = None
+        self._loop = None
+        self._connection_lock = None
+
+    @contextlib.asynccontextmanager
+    async def transaction(self, key: str):
+        key = self.prefix + key
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+
+        while await self.command(
+            "SET", lock_key, token, "NX", "PX", self.lock_ttl_ms
+        ) is None:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+        try:
+            raw = await self.command("GET", key)
+            state = json.loads(raw) if raw else {}
+            yield state
+            await self.command("SET", key, json.dumps(state), "PX", self.state_ttl_ms)
+
+        finally:
+            # не удаляем блокировку, если она истекла и ее уже захватил другой.
+            # Проверка и удаление выполняются сервером атомарно
+            await self.command("EVAL", UNLOCK_SCRIPT, 1, lock_key, token)
+
+    async def command(self, *args):
+        """Send a command to the server and return its reply"""
+
+        loop = asyncio.get_running_loop()
+
+        # соединение привязано к циклу событий, в котором было открыто
+        if self._loop is not loop:
+            self._loop = loop
+            self._connection_lock = asyncio.Lock()
+            self._reader = self._writer = None
+
+        async with self._connection_lock:
+            try:
+                if self._writer is None or self._writer.is_closing():
+                    await self._connect()
+
+                self._send(args)
+                await self._writer.drain()
+                return await self._read_reply()
+
+            except BaseException:
+                # если команда прервана (в том числе отменой задачи),
+                # ответ на нее может остаться в соединении и достаться
+                # следующей команде, поэтому соединение закрывается
+                await self.close()
+                raise
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = self._reader = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port
+        )
+
+        if self.password:
+            self._send(("AUTH", self.password))
+            await self._read_reply()
+
+        if self.db:
+            self._send(("SELECT", self.db))
+            await self._read_reply()
+
+    def _send(self, args):
+        encoded = [str(arg).encode() for arg in args]
+        self._writer.write(
+            b"*%d\r\n" % len(encoded)
+            + b"".join(b"$%d\r\n%s\r\n" % (len(arg), arg) for arg in encoded)
+        )
+
+    async def _read_reply(self):
+        line = (await self._reader.readuntil(b"\r\n"))[:-2]
+        kind, payload = line[:1], line[1:]
+
+        if kind == b"+":
+            return payload.decode()
+
+        if kind == b"-":
+            raise BackendError(payload.decode())
+
+        if kind == b":":
+            return int(payload)
+
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return (await self._reader.readexactly(length + 2))[:-2]
+
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+
+        raise BackendError(f"Unexpected reply from server: {line!r}")
@@ -1,26 +1,50 @@
 """Высокоуровневый API для доступа к Битрикс24"""
 
-import asyncio
+import concurrent.futures
+import datetime
 import functools as ft
+import weakref
 from contextlib import contextmanager
 from inspect import iscoroutinefunction
-from typing import Iterable, Union
+from typing import AsyncIterator, Iterable, Iterator, Union
 
 import aiohttp
 import icontract
 from beartype import beartype
 
+from .backends import ThrottlerBackend
+from .circuit import CircuitBreakerPolicy
+from .duplicates import NegativeCache
+from .loader import Loader, SyncLoader
 from .logger import log, logger
+from .loop_thread import EventLoopThread
+from .registry import MethodRegistry
+from .retry import RetryPolicy
+from .scheduler import BatchScheduler
 from .server_response import ServerResponseParser
-from .srh import ServerRequestHandler
+from .srh import (
+    ServerRequestHandler,
+    critical_requests,
+    deadline_scope,
+    scope_limiters,
+)
+from .throttle import ConcurrencyThrottler, LeakyBucketThrottler
 from .user_request import (
     CallUserRequest,
-    GetAllUserRequest,
+    FindDuplicatesUserRequest,
+    GetAllAnyUserRequest,
+    GetAllByDateRangeUserRequest,
+    GetByFilterInUserRequest,
     GetByIDUserRequest,
     ListAndGetUserRequest,
     RawCallUserRequest,
+    get_all_request,
 )
 
+# сколько батчей по умолчанию запрашивается впрок при переборе
+# результатов через `iter_all()` и `iter_by_ID()`
+ITER_BUFFER_SIZE = 4
+
 
 class BitrixAsync:
     """Клиент для асинхронных запросов к Битрикс24."""
@@ -38,6 +62,16 @@ class BitrixAsync:
         operating_time_limit: int = 480,
         client: aiohttp.ClientSession = None,
         ssl: bool = True,
+        throttler_backend: ThrottlerBackend = None,
+        state_file: str = None,
+        autotune_rate_limits: bool = False,
+        rate_limits_file: str = None,
+        method_concurrency_limits: dict = None,
+        operating_time_reserve: dict = None,
+        hedge_requests: bool = False,
+        retry_policy: RetryPolicy = None,
+        circuit_breaker: CircuitBreakerPolicy = None,
+        method_registry: MethodRegistry = None,
     ):
         """
         Создает объект для запросов к Битрикс24.
@@ -64,6 +98,48 @@ class BitrixAsync:
         - `client: aiohttp.ClientSession = None` - использовать для HTTP-вызовов
         объект aiohttp.ClientSession, инициализированнный и настроенный
         пользователем. Ожидаеется, что пользователь сам откроет и закроет сессию.
+        - `throttler_backend: ThrottlerBackend = None` - хранилище состояния
+        троттлеров, общее для нескольких процессов или серверов, работающих
+        с одним порталом (`FileLockBackend`, `RedisBackend` из модуля
+        `fast_bitrix24.backends`). Если не задано, то состояние хранится
+        в памяти клиента.
+        - `state_file: str = None` - путь к файлу, в котором сохраняется
+        состояние троттлеров, чтобы после перезапуска процесса не превысить
+        лимиты, выбранные до перезапуска. Состояние загружается при создании
+        клиента и сохраняется по окончании запросов и периодически
+        во время их выполнения.
+        - `autotune_rate_limits: bool = False` - подбирать ли `request_pool_size`
+        и `requests_per_second` автоматически по отказам сервера
+        `503 QUERY_LIMIT_EXCEEDED`. Подобранные значения сохраняются
+        для каждого портала и используются при следующих запусках.
+        - `rate_limits_file: str = None` - файл для сохранения подобранных
+        значений. По умолчанию - `~/.fast_bitrix24/rate_limits.json`.
+        - `method_concurrency_limits: dict = None` - ограничения количества
+        одновременных запросов к отдельным методам, например
+        `{"tasks.*": 5, "crm.item.list": 3}`. Ключ - название метода
+        или префикс, заканчивающийся на `*`. Ограничение по префиксу
+        действует на все подходящие методы вместе.
+        - `operating_time_reserve: dict = None` - доля `operating_time_limit`
+        метода, которую могут использовать только запросы внутри
+        `critical()`, например `{"crm.deal.*": 0.2}`. Ключи - как
+        в `method_concurrency_limits`.
+        - `hedge_requests: bool = False` - дублировать ли запросы к методам
+        чтения (`*.get`, `*.list` и т.п.), ответ на которые задерживается
+        дольше, чем 95% обычных ответов. Дубликат отправляется, только если
+        в пуле запросов есть свободное место, и используется первый
+        полученный ответ.
+        - `retry_policy: RetryPolicy = None` - правила повторных попыток
+        после ошибок сервера и соединения (`fast_bitrix24.retry.RetryPolicy`).
+        По умолчанию - `RetryPolicy()`.
+        - `circuit_breaker: CircuitBreakerPolicy = None` - правила
+        размыкателей цепи (`fast_bitrix24.circuit.CircuitBreakerPolicy`):
+        запросы к методу, который раз за разом завершается ошибкой, на время
+        перестают отправляться и сразу поднимают `CircuitOpenError`.
+        По умолчанию размыкатели не используются.
+        - `method_registry: MethodRegistry = None` - сведения о методах
+        REST API (`fast_bitrix24.registry.MethodRegistry`): как их
+        постранично получать, разбирать их ответы и сколько их команд
+        помещается в батч. По умолчанию - общий `default_registry`.
         """
 
         if token_func is not None and not iscoroutinefunction(token_func):
@@ -78,12 +154,32 @@ class BitrixAsync:
             operating_time_limit=operating_time_limit,
             ssl=ssl,
             client=client,
+            throttler_backend=throttler_backend,
+            state_file=state_file,
+            autotune_rate_limits=autotune_rate_limits,
+            rate_limits_file=rate_limits_file,
+            method_concurrency_limits=method_concurrency_limits,
+            operating_time_reserve=operating_time_reserve,
+            hedge_requests=hedge_requests,
+            retry_policy=retry_policy,
+            circuit_breaker=circuit_breaker,
+            method_registry=method_registry,
         )
+        self.srh.batch_scheduler = BatchScheduler(self.srh, batch_size)
         self.verbose = verbose
         self.batch_size = batch_size
 
     @log
-    async def get_all(self, method: str, params: dict = None) -> Union[list, dict]:
+    async def get_all(
+        self,
+        method: str,
+        params: dict = None,
+        *,
+        select_groups: int = None,
+        expand: dict = None,
+        timeout: float = None,
+        deadline: float = None,
+    ) -> Union[list, dict]:
         """
         Получить полный список сущностей по запросу `method`.
 
@@ -97,12 +193,135 @@ class BitrixAsync:
             именно тот формат, который указан в документации к REST API
             Битрикс24. `get_all()` не поддерживает параметры
             `start`, `limit` и `order`.
+        - `select_groups` - на сколько групп полей разделить `select`
+            (включая `*` и `UF_*`). Группы запрашиваются одновременно
+            и объединяются по ID, что для широких `select` быстрее
+            одного запроса всех полей
+        - `expand` - связанные сущности, которые нужно добавить
+            к результатам: `{поле с ID: ветка методов}`, например
+            `{"COMPANY_ID": "crm.company", "ASSIGNED_BY_ID": "user"}`.
+            Связанные сущности запрашиваются по мере получения страниц,
+            каждая - один раз, и добавляются к сущностям под ключом
+            поля без окончания `_ID` (`"COMPANY"`, `"ASSIGNED_BY"`)
+        - `timeout` - сколько секунд отводится на всю операцию, включая
+            ожидание в троттлерах и повторные попытки
+        - `deadline` - момент по `time.time()`, к которому операция
+            должна завершиться
 
         Возвращает полный список сущностей, имеющихся на сервере,
         согласно заданным методу и параметрам.
+
+        Если срок операции истек, то возвращается `PartialList` -
+        список полученных сущностей, в атрибуте `missing` которого
+        перечислены неполученные страницы вида `{"start": 100}`
+        и, с `expand`, неполученные связанные сущности вида
+        `{"expand": "crm.company", "ID": "5"}`.
+
+        Страницы метода `tasks.elapseditem.getlist` перебираются
+        по `PARAMS[NAV_PARAMS]`, а параметры передаются ему под именами
+        `ORDER`, `FILTER`, `SELECT` и `PARAMS`.
         """
 
-        return await self.srh.run_async(GetAllUserRequest(self, method, params).run())
+        with deadline_scope(timeout, deadline):
+            return await self.srh.run_async(
+                get_all_request(self, method, params, select_groups, expand).run()
+            )
+
+    @log
+    async def get_all_any(
+        self,
+        method: str,
+        filters: Iterable[dict],
+        params: dict = None,
+        *,
+        timeout: float = None,
+        deadline: float = None,
+    ) -> list:
+        """
+        Получить сущности, подходящие хотя бы под один из фильтров `filters`.
+
+        Фильтры REST API Битрикс24 не позволяют объединить через "ИЛИ"
+        условия по разным полям. `get_all_any()` выполняет `get_all()`
+        по каждому фильтру одновременно, через общие батчи, и объединяет
+        результаты без повторов по ID. Фильтры, охват которых доказуемо
+        покрыт другими фильтрами, не запрашиваются. Результат каждого
+        фильтра объединяется с остальными после получения всех его страниц,
+        поэтому сущность, подходящая под несколько фильтров, до этого
+        хранится в памяти в нескольких экземплярах.
+
+        Параметры:
+        - `method` - метод REST API вида `*.list`
+        - `filters` - фильтры, по которым нужно получить сущности
+        - `params` - прочие параметры метода, как в `get_all()`. Если в них
+        задан фильтр, то условия каждого фильтра из `filters` добавляются к нему
+        - `timeout`, `deadline` - ограничение времени операции, как в `get_all()`
+
+        Возвращает список сущностей.
+
+        Если срок операции истек, то возвращается `PartialList`, в атрибуте
+        `missing` которого перечислены неполученные страницы вида
+        `{"filter": {...}, "start": 100}`.
+        """
+
+        with deadline_scope(timeout, deadline):
+            return await self.srh.run_async(
+                GetAllAnyUserRequest(self, method, filters, params).run()
+            )
+
+    @log
+    async def get_all_by_date_range(
+        self,
+        method: str,
+        date_field: str,
+        date_from: Union[datetime.date, str],
+        date_to: Union[datetime.date, str],
+        params: dict = None,
+        *,
+        window_pages: int = 2,
+        timeout: float = None,
+        deadline: float = None,
+    ) -> list:
+        """
+        Получить все сущности по запросу `method`, у которых значение
+        поля `date_field` не раньше `date_from` и раньше `date_to`.
+
+        Предназначен для методов, которые нельзя надежно перебирать
+        постранично, потому что они не принимают сортировку по ID
+        (например, `voximplant.statistic.get` и `crm.address.list`):
+        диапазон дат делится на окна, в каждое из которых попадает
+        не больше `window_pages` страниц, и все окна запрашиваются
+        одновременно. Окна, в которые попало больше страниц, делятся
+        на части по количеству сущностей в них.
+
+        Параметры:
+        - `method` - метод REST API
+        - `date_field` - поле-дата, например `"CALL_START_DATE"`
+        - `date_from`, `date_to` - границы диапазона: `datetime`, `date`
+        или строка в формате ISO
+        - `params` - прочие параметры метода, как в `get_all()`. Фильтр
+        в них не должен содержать условий по `date_field`
+        - `window_pages` - сколько страниц по 50 сущностей может быть в окне
+        - `timeout`, `deadline` - ограничение времени операции, как в `get_all()`
+
+        Возвращает список сущностей.
+
+        Если срок операции истек, то возвращается `PartialList`, в атрибуте
+        `missing` которого перечислены неполученные страницы окон
+        вида `{"from": "...", "to": "...", "start": 0}`.
+        """
+
+        with deadline_scope(timeout, deadline):
+            return await self.srh.run_async(
+                GetAllByDateRangeUserRequest(
+                    self,
+                    method,
+                    date_field,
+                    date_from,
+                    date_to,
+                    params,
+                    window_pages=window_pages,
+                ).run()
+            )
 
     @log
     async def get_by_ID(
@@ -111,6 +330,10 @@ class BitrixAsync:
         ID_list: Iterable,
         ID_field_name: str = "ID",
         params: dict = None,
+        *,
+        strategy: str = "get",
+        timeout: float = None,
+        deadline: float = None,
     ) -> dict:
         """
         Получить список сущностей по запросу `method` и списку ID.
@@ -126,6 +349,12 @@ class BitrixAsync:
         для каждого элемента ID_list
         - `params` - параметры для передачи методу. Используется именно тот
         формат, который указан в документации к REST API Битрикс24
+        - `strategy` - `"get"` (по умолчанию): одна команда `method` на каждый ID;
+        `"list"`: сущности запрашиваются соответствующим методом `.list`
+        с фильтром `@ID` по 50 ID на команду. Для методов, у которых нет
+        такого метода `.list`, и при `ID_field_name`, отличном от `"ID"`,
+        используется `"get"`
+        - `timeout`, `deadline` - ограничение времени операции, как в `get_all()`
 
         Возвращает словарь вида:
         ```
@@ -140,11 +369,161 @@ class BitrixAsync:
         относительно этого ID. Это может быть, например, список связанных
         сущностей или пустой список, если не найдено ни одной привязанной
         сущности.
+
+        Если срок операции истек, то возвращается `PartialDict` с полученными
+        результатами, в атрибуте `missing` которого - неполученные ID.
+        """
+
+        with deadline_scope(timeout, deadline):
+            return await self.srh.run_async(
+                GetByIDUserRequest(
+                    self, method, params, ID_list, ID_field_name, strategy=strategy
+                ).run()
+            )
+
+    @log
+    async def get_by_filter_in(
+        self,
+        method: str,
+        field: str,
+        values: Iterable,
+        params: dict = None,
+        *,
+        group_by_value: bool = False,
+        timeout: float = None,
+        deadline: float = None,
+    ) -> Union[list, dict]:
+        """
+        Получить все сущности по запросу `method`, у которых поле `field`
+        принимает одно из значений `values`.
+
+        Например, все дела по списку сделок. Список значений делится
+        на части по 50 значений, каждая часть подставляется в фильтр
+        по полю `field`, а ответы на каждую часть при необходимости
+        запрашиваются постранично. Все запросы идут батчами параллельно.
+
+        Параметры:
+        - `method` - метод REST API вида `*.list`
+        - `field` - поле фильтра, например `"OWNER_ID"`
+        - `values` - значения поля
+        - `params` - прочие параметры метода, как в `get_all()`
+        - `group_by_value` - если `True`, то результаты раскладываются
+        по значениям поля
+        - `timeout`, `deadline` - ограничение времени операции, как в `get_all()`
+
+        Возвращает список сущностей, а если `group_by_value=True` - словарь
+        `{значение: [сущности]}` со всеми значениями из `values`.
+
+        Если срок операции истек, то возвращается `PartialList`
+        или `PartialDict` с полученными результатами, в атрибуте `missing`
+        которого - значения, сущности по которым получены не полностью.
+        """
+
+        with deadline_scope(timeout, deadline):
+            return await self.srh.run_async(
+                GetByFilterInUserRequest(
+                    self, method, field, values, params, group_by_value=group_by_value
+                ).run()
+            )
+
+    @log
+    async def find_duplicates(
+        self,
+        comm_type: str,
+        values: Iterable,
+        entity_type: str = None,
+        *,
+        negative_cache: NegativeCache = None,
+        timeout: float = None,
+        deadline: float = None,
+    ) -> dict:
+        """
+        Найти сущности CRM с телефонами или адресами e-mail из `values`
+        методом `crm.duplicate.findbycomm`.
+
+        Значения нормализуются (у телефонов остаются только цифры,
+        e-mail приводятся к нижнему регистру), повторы отбрасываются,
+        а остальные значения проверяются частями по 20 - столько
+        принимает метод за один вызов. Все части проверяются батчами
+        параллельно.
+
+        Параметры:
+        - `comm_type` - `"PHONE"` или `"EMAIL"`
+        - `values` - телефоны или адреса e-mail
+        - `entity_type` - `"LEAD"`, `"CONTACT"` или `"COMPANY"`,
+            если искать нужно только среди сущностей этого типа
+        - `negative_cache` - `NegativeCache` из модуля
+            `fast_bitrix24.duplicates`, в котором запоминаются значения,
+            по которым ничего не найдено. Такие значения не проверяются
+            повторно, пока не истечет срок их хранения в кэше
+        - `timeout`, `deadline` - ограничение времени операции, как в `get_all()`
+
+        Возвращает словарь `{значение: {тип сущности: [ID]}}` со всеми
+        значениями из `values`; если дубликатов нет - `{значение: {}}`.
+
+        Если срок операции истек, то возвращается `PartialDict`,
+        в атрибуте `missing` которого - непроверенные значения.
+        """
+
+        with deadline_scope(timeout, deadline):
+            return await self.srh.run_async(
+                FindDuplicatesUserRequest(
+                    self, comm_type, values, entity_type, negative_cache
+                ).run()
+            )
+
+    def iter_all(
+        self,
+        method: str,
+        params: dict = None,
+        *,
+        buffer_size: int = ITER_BUFFER_SIZE,
+    ) -> AsyncIterator:
+        """
+        Перебрать сущности по запросу `method` по мере их получения.
+
+        Параметры - как у `get_all()`, а также:
+        - `buffer_size` - сколько батчей может быть запрошено
+        у сервера впрок, пока обрабатываются уже полученные
+
+        Возвращает асинхронный итератор сущностей. В отличие от `get_all()`,
+        полученные сущности не накапливаются в памяти, а следующие батчи
+        запрашиваются по мере обработки уже полученных. Повторы отсеиваются
+        по ходу перебора, для чего хранятся 16-байтные хэши всех выданных
+        сущностей: этот расход памяти растет с количеством сущностей.
+        """
+
+        pages = self.srh.iterate_async(
+            get_all_request(self, method, params).iter_pages(buffer_size)
+        )
+        return flatten_pages(pages)
+
+    def iter_by_ID(
+        self,
+        method: str,
+        ID_list: Iterable,
+        ID_field_name: str = "ID",
+        params: dict = None,
+        *,
+        buffer_size: int = ITER_BUFFER_SIZE,
+    ) -> AsyncIterator:
+        """
+        Перебрать результаты запросов `method` по списку ID
+        по мере их получения.
+
+        Параметры - как у `get_by_ID()`, а также `buffer_size`,
+        как у `iter_all()`. `ID_list` может быть и генератором:
+        ID берутся из него по мере отправки батчей.
+
+        Возвращает асинхронный итератор пар `(ID, результат)`.
         """
 
-        return await self.srh.run_async(
-            GetByIDUserRequest(self, method, params, ID_list, ID_field_name).run()
+        pages = self.srh.iterate_async(
+            GetByIDUserRequest(
+                self, method, params, ID_list, ID_field_name, mute=True
+            ).iter_pages(buffer_size)
         )
+        return flatten_pages(pages)
 
     @log
     async def list_and_get(self, method_branch: str, ID_field_name="ID") -> dict:
@@ -179,7 +558,13 @@ class BitrixAsync:
 
     @log
     async def call(
-        self, method: str, items: Union[dict, Iterable] = None, *, raw=False
+        self,
+        method: str,
+        items: Union[dict, Iterable] = None,
+        *,
+        raw=False,
+        timeout: float = None,
+        deadline: float = None,
     ):
         """
         Вызвать метод REST API по списку элементов.
@@ -192,13 +577,20 @@ class BitrixAsync:
         - `raw` - если True, то items отправляются на сервер в виде json
             в первозданном виде, без обычных преобразований.
             По умолчанию False.
+        - `timeout`, `deadline` - ограничение времени операции, как в `get_all()`
 
         Возвращает список ответов сервера для каждого из элементов `items`
         либо просто результат для единичного вызова.
+
+        Если срок операции истек, то для списка `items` возвращается
+        `PartialTuple` с полученными ответами, в атрибуте `missing`
+        которого - необработанные элементы `items`. Для единичного вызова
+        поднимается `DeadlineExceeded`.
         """
 
         request_cls = RawCallUserRequest if raw else CallUserRequest
-        return await self.srh.run_async(request_cls(self, method, items).run())
+        with deadline_scope(timeout, deadline):
+            return await self.srh.run_async(request_cls(self, method, items).run())
 
     @log
     async def call_batch(self, params: dict) -> dict:
@@ -220,54 +612,237 @@ class BitrixAsync:
 
         return response.result["result"]
 
+    @beartype
+    @icontract.require(lambda linger: linger >= 0)
+    def loader(
+        self,
+        method: str,
+        ID_field_name: str = "ID",
+        params: dict = None,
+        *,
+        linger: float = 0,
+        cache: bool = False,
+    ) -> Loader:
+        """
+        Создать загрузчик, объединяющий одиночные запросы `method`
+        по ID в батчи.
+
+        Параметры:
+        - `method` - метод REST API вида `*.get`
+        - `ID_field_name` - название параметра, в котором передается ID
+        - `params` - прочие параметры метода, общие для всех ID
+        - `linger` - сколько секунд после первого вызова `load()` собирать
+            следующие вызовы. По умолчанию собираются вызовы, сделанные
+            в течение одного шага цикла событий
+        - `cache` - запоминать ли полученные сущности
+
+        Возвращает `Loader`, метод `load(ID)` которого возвращает
+        результат `method` для одного ID. Вызовы `load()` из разных
+        задач, сделанные почти одновременно, уходят на сервер одним
+        батчем, а повторяющиеся ID запрашиваются один раз.
+        """
+
+        return Loader(self, method, ID_field_name, params, linger, cache)
+
     @contextmanager
     @beartype
     @icontract.require(lambda max_concurrent_requests: max_concurrent_requests >= 1)
-    def slow(self, max_concurrent_requests: int = 1):
+    @icontract.require(
+        lambda requests_per_second: requests_per_second is None
+        or requests_per_second > 0
+    )
+    def slow(
+        self, max_concurrent_requests: int = 1, requests_per_second: float = None
+    ):
         """Временно ограничивает количество одновременно выполняемых запросов
-        к Битрикс24."""
+        к Битрикс24 и, если задано `requests_per_second`, их скорость.
+
+        Как и `critical()`, действует только на запросы, запущенные
+        в текущем контексте (потоке или asyncio-задаче): параллельные
+        запросы того же клиента выполняются с прежней скоростью.
+        Вложенные блоки `slow()` действуют совместно."""
 
         logger.info(
-            "Slow mode enabled: {'max_concurrent_requests': %s}",
+            "Slow mode enabled: {'max_concurrent_requests': %s, "
+            "'requests_per_second': %s}",
             max_concurrent_requests,
+            requests_per_second,
         )
 
-        mcr_max_backup, self.srh.mcr_max = self.srh.mcr_max, max_concurrent_requests
-        self.srh.mcr_cur_limit = min(self.srh.mcr_max, self.srh.mcr_cur_limit)
+        limiters = (ConcurrencyThrottler(max_concurrent_requests),)
+        if requests_per_second is not None:
+            limiters += (LeakyBucketThrottler(1, requests_per_second),)
 
-        yield True
+        token = scope_limiters.set(scope_limiters.get() + limiters)
 
-        logger.info(
-            "Slow mode disabled: {'max_concurrent_requests': %s}",
-            mcr_max_backup,
-        )
+        try:
+            yield True
+        finally:
+            scope_limiters.reset(token)
+            logger.info("Slow mode disabled")
+
+    @contextmanager
+    def critical(self):
+        """Запросы внутри этого блока могут использовать резерв времени
+        отработки методов, заданный параметром `operating_time_reserve`.
+
+        Действует только на запросы, запущенные в текущем контексте
+        (потоке или asyncio-задаче), и не затрагивает параллельные запросы."""
+
+        token = critical_requests.set(True)
 
-        self.srh.mcr_max = mcr_max_backup
-        self.srh.mcr_cur_limit = min(self.srh.mcr_max, self.srh.mcr_cur_limit)
+        try:
+            yield True
+        finally:
+            critical_requests.reset(token)
 
 
 class Bitrix(BitrixAsync):
     """Клиент для неасинхронных запросов к серверу Битрикс24.
 
     Имплементируется путем обертки всех методов родителя в неасинхронные методы.
+
+    Все вызовы выполняются в одном цикле событий, работающем в фоновом
+    потоке клиента, поэтому HTTP-соединения и состояние троттлеров
+    используются повторно, а одного клиента могут использовать
+    несколько потоков приложения.
     """
 
-    def sync_decorator(coroutine):
-        ft.wraps(coroutine)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
 
-        def sync_wrapper(*args, **kwargs):
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                return asyncio.run(coroutine(*args, **kwargs))
+        self.loop_thread = EventLoopThread(f"fast_bitrix24:{self.srh.throttler_key_prefix}")
 
-            if loop.is_running():
-                return loop.create_task(coroutine(*args, **kwargs))
+        # сессия живет в цикле событий клиента до вызова `close()`,
+        # а если он не был вызван - до удаления клиента или выхода из программы
+        self.srh.keep_session = True
+        self.finalizer = weakref.finalize(
+            self, stop_loop_thread, self.loop_thread, self.srh
+        )
 
-            return loop.run_until_complete(coroutine(*args, **kwargs))
+    def sync_decorator(coroutine):
+        @ft.wraps(coroutine)
+        def sync_wrapper(self, *args, **kwargs):
+            return self.loop_thread.run(coroutine(self, *args, **kwargs))
 
+        sync_wrapper.coroutine = coroutine
         return sync_wrapper
 
     for method in dir(BitrixAsync):
-        if not method.startswith("__") and method != "slow":
+        if not method.startswith("__") and method not in (
+            "slow",
+            "critical",
+            "loader",
+            "iter_all",
+            "iter_by_ID",
+        ):
             locals()[method] = sync_decorator(getattr(BitrixAsync, method))
+
+    def iter_all(
+        self,
+        method: str,
+        params: dict = None,
+        *,
+        buffer_size: int = ITER_BUFFER_SIZE,
+    ) -> Iterator:
+        """
+        Перебрать сущности по запросу `method` по мере их получения.
+
+        Параметры - как у `get_all()`, а также:
+        - `buffer_size` - сколько полученных батчей может ждать обработки
+        и сколько батчей может быть запрошено у сервера впрок
+
+        Возвращает генератор сущностей. Запросы выполняются в фоновом
+        потоке клиента, а полученные батчи передаются через очередь
+        размером `buffer_size`: пока она заполнена, новые батчи
+        не запрашиваются, поэтому в памяти находится не больше
+        `buffer_size` батчей. Для отсева повторов хранятся только
+        16-байтные хэши выданных сущностей - этот расход памяти
+        растет с количеством сущностей.
+        """
+
+        pages = self.srh.iterate_async(
+            get_all_request(self, method, params).iter_pages(buffer_size)
+        )
+        return (
+            item
+            for page in self.loop_thread.iterate(pages, buffer_size)
+            for item in page
+        )
+
+    def iter_by_ID(
+        self,
+        method: str,
+        ID_list: Iterable,
+        ID_field_name: str = "ID",
+        params: dict = None,
+        *,
+        buffer_size: int = ITER_BUFFER_SIZE,
+    ) -> Iterator:
+        """
+        Перебрать результаты запросов `method` по списку ID
+        по мере их получения.
+
+        Параметры - как у `get_by_ID()`, а также `buffer_size`,
+        как у `iter_all()`.
+
+        Возвращает генератор пар `(ID, результат)`.
+        """
+
+        pages = self.srh.iterate_async(
+            GetByIDUserRequest(
+                self, method, params, ID_list, ID_field_name, mute=True
+            ).iter_pages(buffer_size)
+        )
+        return (
+            item
+            for page in self.loop_thread.iterate(pages, buffer_size)
+            for item in page
+        )
+
+    def loader(self, *args, **kwargs) -> SyncLoader:
+        """Как `BitrixAsync.loader()`, но метод `load(ID)` загрузчика
+        синхронный. Вызовы `load()` из разных потоков объединяются
+        в батчи так же, как вызовы из разных задач `asyncio`."""
+
+        return SyncLoader(BitrixAsync.loader(self, *args, **kwargs), self.loop_thread)
+
+    def submit(self, method, *args, **kwargs) -> concurrent.futures.Future:
+        """Запускает метод клиента в фоне и сразу возвращает
+        `concurrent.futures.Future` его результата.
+
+        Параметры:
+        - `method` - метод этого клиента, например `b.get_all`
+        - `*args`, `**kwargs` - параметры метода
+
+        Позволяет запустить несколько запросов параллельно и собрать
+        их результаты, не используя `asyncio`.
+        """
+
+        coroutine = getattr(method, "coroutine", None)
+        if coroutine is None or getattr(method, "__self__", None) is not self:
+            raise ValueError("`method` should be a method of this client, e.g. `b.get_all`")
+
+        return self.loop_thread.submit(coroutine(self, *args, **kwargs))
+
+    def close(self):
+        """Закрывает HTTP-сессию, сохраняет состояние троттлеров
+        (если задан `state_file`) и останавливает поток клиента."""
+
+        self.finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def stop_loop_thread(loop_thread: EventLoopThread, srh: ServerRequestHandler):
+    loop_thread.stop(srh.close())
+
+
+async def flatten_pages(pages: AsyncIterator) -> AsyncIterator:
+    async for page in pages:
+        for item in page:
+            yield item
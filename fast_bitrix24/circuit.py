@@ -0,0 +1,135 @@
+"""Размыкатели цепи (circuit breakers) для отдельных методов REST API"""
+
+import collections
+import time
+
+from .logger import logger
+
+# состояния размыкателя
+CLOSED = "closed"  # запросы отправляются как обычно
+OPEN = "open"  # запросы сразу завершаются ошибкой
+HALF_OPEN = "half_open"  # отправляется пробный запрос
+
+
+class CircuitOpenError(Exception):
+    """Запросы к методу временно не отправляются, потому что
+    он раз за разом завершается ошибкой."""
+
+
+class CircuitBreakerPolicy:
+    """Правила размыкателей цепи для методов.
+
+    Параметры:
+    - `failure_threshold: int = 5` - сколько неудачных запросов к методу
+    подряд размыкает цепь
+    - `window: float = 60` - неудачи старше стольких секунд не учитываются
+    - `cooldown: float = 30` - через сколько секунд после размыкания
+    к методу отправляется пробный запрос
+    """
+
+    def __init__(
+        self, failure_threshold: int = 5, window: float = 60, cooldown: float = 30
+    ):
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.cooldown = cooldown
+
+    def create_breaker(self, method: str) -> "CircuitBreaker":
+        return CircuitBreaker(self, method)
+
+
+class CircuitBreaker:
+    """Размыкатель цепи одного метода.
+
+    После `failure_threshold` неудач подряд в пределах `window` секунд
+    цепь размыкается, и запросы к методу сразу завершаются исключением
+    `CircuitOpenError`. Через `cooldown` секунд цепь переходит в полуоткрытое
+    состояние, и к методу отправляется один пробный запрос: если он удачен,
+    то цепь замыкается, если нет - снова размыкается.
+    """
+
+    def __init__(self, policy: CircuitBreakerPolicy, method: str):
+        self.policy = policy
+        self.method = method
+
+        # моменты неудач по `time.monotonic()`, с самой ранней
+        self.failures = collections.deque()
+
+        # момент размыкания цепи (`None` - цепь замкнута)
+        self.opened_at = None
+
+        # отправлен ли пробный запрос, результат которого еще неизвестен
+        self.probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+
+        if time.monotonic() - self.opened_at < self.policy.cooldown:
+            return OPEN
+
+        return HALF_OPEN
+
+    def before_request(self):
+        """Пропускает запрос к методу или поднимает `CircuitOpenError`.
+
+        В полуоткрытом состоянии пропускается только один пробный запрос."""
+
+        state = self.state
+
+        if state == OPEN or (state == HALF_OPEN and self.probe_in_flight):
+            raise CircuitOpenError(
+                f"Requests to {self.method} are suspended after repeated failures"
+            )
+
+        if state == HALF_OPEN:
+            logger.debug("Probing method: {'method': %s}", self.method)
+            self.probe_in_flight = True
+
+    def release(self):
+        """Запрос, пропущенный `before_request()`, завершился без ответа,
+        который говорил бы о состоянии метода (отменен, отказ по лимиту)."""
+
+        self.probe_in_flight = False
+
+    def record_success(self):
+        # ответы на запросы, отправленные до размыкания, не учитываются
+        if self.state == OPEN:
+            return
+
+        if self.opened_at is not None:
+            logger.debug("Circuit closed: {'method': %s}", self.method)
+
+        self.failures.clear()
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        state = self.state
+        if state == OPEN:
+            return
+
+        now = time.monotonic()
+
+        if state == HALF_OPEN:
+            self.open(now)
+            return
+
+        self.failures.append(now)
+        while self.failures and self.failures[0] < now - self.policy.window:
+            self.failures.popleft()
+
+        if len(self.failures) >= self.policy.failure_threshold:
+            self.open(now)
+
+    def open(self, now: float):
+        logger.debug(
+            "Circuit opened: {'method': %s, 'cooldown': %s}",
+            self.method,
+            self.policy.cooldown,
+        )
+
+        self.failures.clear()
+        self.opened_at = now
+        self.probe_in_flight = False
@@ -0,0 +1,71 @@
+"""Поиск дубликатов по телефонам и адресам e-mail"""
+
+import collections
+import re
+import time
+
+# сколько значений принимает `crm.duplicate.findbycomm` за один вызов
+FINDBYCOMM_MAX_VALUES = 20
+
+# типы средств связи, по которым ищутся дубликаты
+COMMUNICATION_TYPES = ("PHONE", "EMAIL")
+
+
+def normalize_communication(comm_type: str, value) -> str:
+    """Приводит телефон или e-mail к виду, в котором одинаковые значения,
+    записанные по-разному, совпадают. Пустая строка - значение,
+    по которому искать нечего."""
+
+    if value is None:
+        return ""
+
+    if comm_type == "PHONE":
+        # сервер сравнивает телефоны по цифрам
+        return re.sub(r"\D", "", str(value))
+
+    return str(value).strip().lower()
+
+
+class NegativeCache:
+    """Значения, по которым не найдено дубликатов.
+
+    Запоминаются на `ttl` секунд: за это время в CRM может появиться
+    сущность с тем же телефоном или e-mail. Если запомнено больше
+    `max_size` значений, то забываются самые старые.
+
+    Один кэш можно передавать в несколько вызовов `find_duplicates()`.
+    """
+
+    def __init__(self, ttl: float = 3600, max_size: int = 1_000_000):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        # ключ -> момент истечения по `time.monotonic()`
+        self.expires = collections.OrderedDict()
+
+    def __contains__(self, key) -> bool:
+        expires = self.expires.get(key)
+        if expires is None:
+            return False
+
+        if expires <= time.monotonic():
+            del self.expires[key]
+            return False
+
+        return True
+
+    def __len__(self) -> int:
+        return len(self.expires)
+
+    def add(self, key):
+        self.expires.pop(key, None)
+        self.expires[key] = time.monotonic() + self.ttl
+
+        while len(self.expires) > self.max_size:
+            self.expires.popitem(last=False)
+
+    def discard(self, key):
+        self.expires.pop(key, None)
+
+    def clear(self):
+        self.expires.clear()
@@ -0,0 +1,132 @@
+"""Сравнение фильтров REST API по охвату"""
+
+import re
+
+# операторы фильтра, которые учитываются при сравнении; условия
+# с остальными операторами (`!`, `%` и т. п.) совпадают только сами с собой
+FILTER_KEY = re.compile(r"^(>=|<=|>|<|=|@)?([^=!<>@%?*].*)$")
+
+
+def filter_covers(broad: dict, narrow: dict) -> bool:
+    """Доказуемо ли, что все сущности, подходящие под `narrow`,
+    подходят и под `broad`.
+
+    Это так, если каждое условие `broad` следует из условий `narrow`.
+    Сравниваются точные значения, списки значений и числовые границы;
+    если следование не удалось доказать, то возвращается `False`."""
+
+    return all(condition_implied(key, value, narrow) for key, value in broad.items())
+
+
+def condition_implied(key: str, value, conditions: dict) -> bool:
+    """Следует ли условие `key: value` из условий `conditions`."""
+
+    if key in conditions and conditions[key] == value:
+        return True
+
+    parsed = parse_condition(key, value)
+    if parsed is None:
+        return False
+
+    field, op, bound = parsed
+
+    for other_key, other_value in conditions.items():
+        other = parse_condition(other_key, other_value)
+        if other is None or other[0] != field:
+            continue
+
+        if implies(other[1], other[2], op, bound):
+            return True
+
+    return False
+
+
+def parse_condition(key: str, value):
+    """Разбирает условие на (поле, оператор, значение).
+
+    Оператор `"in"` означает список допустимых значений, а `"="` - одно
+    значение. Возвращает `None` для условий, которые не сравниваются."""
+
+    match = FILTER_KEY.match(key.strip())
+    if not match:
+        return None
+
+    op, field = match.group(1) or "=", match.group(2).upper()
+
+    if isinstance(value, (list, tuple, set)):
+        if op not in ("=", "@"):
+            return None
+        return field, "in", {str(item) for item in value}
+
+    if op == "@":
+        return None
+
+    if op == "=":
+        return field, "=", str(value)
+
+    number = as_number(value)
+    if number is None:
+        return None
+
+    return field, op, number
+
+
+def implies(op: str, value, broad_op: str, broad_value) -> bool:
+    """Следует ли условие `broad_op broad_value` из `op value`
+    по одному и тому же полю."""
+
+    if broad_op == "in":
+        if op == "=":
+            return value in broad_value
+        return op == "in" and value <= broad_value
+
+    if broad_op == "=":
+        if op == "=":
+            return value == broad_value
+        return op == "in" and value == {broad_value}
+
+    # числовые границы: точное значение или более строгая граница
+    if op == "=":
+        value = as_number(value)
+        if value is None:
+            return False
+        return compare(value, broad_op, broad_value)
+
+    if op == "in":
+        numbers = [as_number(item) for item in value]
+        return bool(numbers) and all(
+            number is not None and compare(number, broad_op, broad_value)
+            for number in numbers
+        )
+
+    if broad_op[0] != op[0]:
+        return False
+
+    if op == broad_op or len(broad_op) == 2:
+        # `> 5` следует из `> 7` и `> 5`, `>= 5` - из `>= 5` и `> 5`
+        return compare(value, broad_op[0] + "=", broad_value)
+
+    # `> 5` следует из `>= 6`
+    return compare(value, broad_op, broad_value)
+
+
+def compare(value, op: str, bound) -> bool:
+    return {
+        ">": value > bound,
+        ">=": value >= bound,
+        "<": value < bound,
+        "<=": value <= bound,
+    }[op]
+
+
+def as_number(value):
+    if isinstance(value, bool):
+        return None
+
+    if isinstance(value, (int, float)):
+        return value
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,79 @@
+"""Tracking of observed request latencies."""
+
+import collections
+import math
+
+# how many latest latencies are kept per key
+LATENCY_WINDOW = 200
+
+# how many latencies are needed before percentiles are reported
+MIN_LATENCY_SAMPLES = 20
+
+
+class LatencyTracker:
+    """Keeps the latest request latencies per key and reports their percentiles.
+
+    A percentile is only reported once at least `min_samples` latencies
+    have been observed for the key, so that a few early requests
+    don't define it.
+    """
+
+    def __init__(
+        self, window: int = LATENCY_WINDOW, min_samples: int = MIN_LATENCY_SAMPLES
+    ):
+        self._window = window
+        self._min_samples = min_samples
+        self._samples = {}  # key -> deque of latencies
+
+    def add(self, key: str, latency: float):
+        """Register how long a request has taken"""
+        self._samples.setdefault(
+            key, collections.deque(maxlen=self._window)
+        ).append(latency)
+
+    def percentile(self, key: str, q: float):
+        """The `q`-th percentile of the latencies of `key`
+        or `None` if there are not enough of them yet"""
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self._min_samples:
+            return None
+
+        ordered = sorted(samples)
+        rank = max(math.ceil(q / 100 * len(ordered)), 1)
+        return ordered[rank - 1]
+
+
+# weight of the latest observation in a smoothed field cost
+FIELD_COST_SMOOTHING = 0.3
+
+
+class FieldCostTracker:
+    """Keeps smoothed estimates of the server time that each selected field
+    costs in a list method.
+
+    The processing time of a page fetched with a narrow select is spread
+    evenly over the fields of that select. Estimates are per method,
+    since the same field may be cheap in one entity and expensive in another.
+    """
+
+    def __init__(self, smoothing: float = FIELD_COST_SMOOTHING):
+        self._smoothing = smoothing
+        self._costs = {}  # (method, field) -> seconds
+
+    def add(self, method: str, fields: list, seconds: float):
+        """Register how long a page with `fields` selected has taken"""
+        if not fields:
+            return
+
+        share = seconds / len(fields)
+        for field in fields:
+            previous = self._costs.get((method, field))
+            self._costs[(method, field)] = (
+                share
+                if previous is None
+                else previous + self._smoothing * (share - previous)
+            )
+
+    def cost(self, method: str, field: str):
+        """The estimated cost of `field` or `None` if it hasn't been measured"""
+        return self._costs.get((method, field))
@@ -0,0 +1,199 @@
+"""Объединение одиночных запросов сущностей в батчи"""
+
+import asyncio
+import contextvars
+import functools as ft
+
+from .mult_request import MultipleServerRequestHandlerPreserveIDs
+from .server_response import ErrorInServerResponseException
+from .srh import DeadlineExceeded, deadline_remaining
+
+
+class Loader:
+    """Получает сущности методом вида `*.get` по одной, объединяя
+    запросы, сделанные почти одновременно, в общие батчи
+    (по образцу DataLoader).
+
+    Вызовы `load()`, сделанные в течение одного шага цикла событий
+    (или в течение `linger` секунд после первого из них), собираются
+    вместе: повторяющиеся ID запрашиваются один раз, и все ID уходят
+    одним батчем. Результат каждого ID возвращается своему вызову,
+    а ошибка по одному ID не затрагивает остальные.
+
+    Если `cache=True`, то полученные сущности запоминаются, и повторные
+    вызовы `load()` с тем же ID не обращаются к серверу до вызова
+    `clear()`. Ошибки не запоминаются.
+    """
+
+    def __init__(
+        self,
+        bitrix,
+        method: str,
+        ID_field_name: str = "ID",
+        params: dict = None,
+        linger: float = 0,
+        cache: bool = False,
+    ):
+        self.bitrix = bitrix
+        self.method = method
+        self.ID_field_name = ID_field_name
+        self.params = params or {}
+        self.linger = linger
+        self.cache = cache
+
+        # str(ID) -> future результата: запрошенные ID, а при `cache=True` -
+        # и полученные сущности
+        self.futures = {}
+
+        # str(ID) -> ID, которые ждут отправки
+        self.pending = {}
+        self.flush_handle = None
+
+        # задачи отправленных батчей
+        self.sending = set()
+
+    async def load(self, ID):
+        """Возвращает результат метода для `ID`."""
+
+        key = str(ID)
+
+        future = self.futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self.futures[key] = loop.create_future()
+            future.add_done_callback(ft.partial(self.forget, key))
+
+            self.pending[key] = ID
+            self.schedule_flush(loop)
+
+        # future общий для всех вызовов с этим ID,
+        # поэтому отмена одного вызова не должна его отменять
+        remaining = deadline_remaining()
+        if remaining is None:
+            return await asyncio.shield(future)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(remaining, 0))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Deadline exceeded while waiting for a loader")
+
+    async def load_many(self, ID_list) -> list:
+        """Возвращает список результатов метода для ID из `ID_list`."""
+
+        return list(await asyncio.gather(*(self.load(ID) for ID in ID_list)))
+
+    def clear(self, ID=None):
+        """Удаляет из кэша сущность `ID` или, если `ID` не задан,
+        все полученные сущности."""
+
+        keys = [str(ID)] if ID is not None else list(self.futures)
+        for key in keys:
+            future = self.futures.get(key)
+            if future is not None and future.done():
+                del self.futures[key]
+
+    def forget(self, key: str, future):
+        if self.futures.get(key) is not future:
+            return
+
+        if not self.cache or future.cancelled() or future.exception():
+            del self.futures[key]
+
+    def schedule_flush(self, loop):
+        # батчи отправляются без `critical()`, `slow()` и сроков
+        # того вызова, который оказался первым
+        if len(self.pending) >= self.bitrix.batch_size:
+            contextvars.Context().run(self.flush)
+
+        elif self.flush_handle is None:
+            if self.linger:
+                self.flush_handle = loop.call_later(
+                    self.linger, self.flush, context=contextvars.Context()
+                )
+            else:
+                self.flush_handle = loop.call_soon(
+                    self.flush, context=contextvars.Context()
+                )
+
+    def flush(self):
+        """Отправляет ID, ожидающие отправки."""
+
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+
+        task = asyncio.ensure_future(self.send(pending))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    async def send(self, pending: dict):
+        futures = {key: self.futures.get(key) for key in pending}
+
+        try:
+            await self.bitrix.srh.run_async(self.fetch(pending, futures))
+
+        except Exception as error:
+            for future in futures.values():
+                if future is not None and not future.done():
+                    future.set_exception(error)
+
+        else:
+            for key, future in futures.items():
+                if future is not None and not future.done():
+                    future.set_exception(
+                        ErrorInServerResponseException(f"No result for ID {key}")
+                    )
+
+    async def fetch(self, pending: dict, futures: dict):
+        handler = MultipleServerRequestHandlerPreserveIDs(
+            self.bitrix,
+            self.method,
+            [{**self.params, self.ID_field_name: ID} for ID in pending.values()],
+            ID_field=self.ID_field_name,
+            get_by_ID=True,
+        )
+
+        async for response in handler.iter_responses():
+            # ответы разбираются по меткам команд, чтобы ошибка
+            # по одному ID не затронула остальные
+            batch = response["result"]
+
+            for label, error in (batch.get("result_error") or {}).items():
+                future = futures.get(str(label))
+                if future is not None and not future.done():
+                    future.set_exception(ErrorInServerResponseException({label: error}))
+
+            for label, result in (batch.get("result") or {}).items():
+                future = futures.get(str(label))
+                if future is not None and not future.done():
+                    future.set_result(result)
+
+
+class SyncLoader:
+    """`Loader` для синхронного клиента `Bitrix`.
+
+    Вызовы `load()` из разных потоков выполняются в одном цикле
+    событий клиента и объединяются в батчи так же, как в `Loader`.
+    """
+
+    def __init__(self, loader: Loader, loop_thread):
+        self.loader = loader
+        self.loop_thread = loop_thread
+
+    def load(self, ID):
+        return self.loop_thread.run(self.loader.load(ID))
+
+    def load_many(self, ID_list) -> list:
+        return self.loop_thread.run(self.loader.load_many(ID_list))
+
+    def clear(self, ID=None):
+        self.loop_thread.run(clear_loader(self.loader, ID))
+
+
+async def clear_loader(loader: Loader, ID=None):
+    # кэш загрузчика изменяется только в цикле событий клиента
+    loader.clear(ID)
@@ -0,0 +1,143 @@
+"""Цикл событий в фоновом потоке для синхронного клиента"""
+
+import asyncio
+import concurrent.futures
+import threading
+
+
+class EventLoopThread:
+    """Цикл событий, работающий в отдельном потоке-демоне.
+
+    Корутины можно запускать в нем из любых потоков: все они выполняются
+    в одном цикле, поэтому HTTP-сессия и состояние троттлеров клиента
+    используются всеми вызовами, а не создаются заново для каждого.
+
+    Переменные контекста (например, `critical()` и сроки операций)
+    передаются корутине из потока, который ее запустил.
+    """
+
+    def __init__(self, name: str = "fast_bitrix24"):
+        self.name = name
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Запускает поток с циклом событий, если он еще не запущен,
+        и возвращает цикл."""
+
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(
+                    target=self.run_loop, args=(self.loop,), name=self.name, daemon=True
+                )
+                self.thread.start()
+
+            return self.loop
+
+    @staticmethod
+    def run_loop(loop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def submit(self, coroutine) -> concurrent.futures.Future:
+        """Запускает `coroutine` в цикле событий потока
+        и возвращает future ее результата."""
+
+        loop = self.start()
+
+        if threading.current_thread() is self.thread:
+            coroutine.close()
+            raise RuntimeError(
+                "Synchronous methods can't be called from the client's event loop, "
+                "use `BitrixAsync` in asynchronous code"
+            )
+
+        # задача создается с копией контекста текущего потока
+        return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+    def run(self, coroutine):
+        """Выполняет `coroutine` в цикле событий потока и возвращает результат."""
+
+        return self.submit(coroutine).result()
+
+    def iterate(self, async_iterator, buffer_size: int = 1):
+        """Перебирает `async_iterator` в цикле событий потока, отдавая
+        его элементы текущему потоку через очередь из `buffer_size` элементов.
+
+        Когда очередь заполнена, перебор `async_iterator` приостанавливается
+        до тех пор, пока текущий поток не заберет очередной элемент.
+        Если текущий поток прекратил перебор, то он прекращается
+        и в цикле событий."""
+
+        queue = self.run(create_queue(buffer_size))
+        pump = self.submit(pump_to_queue(async_iterator, queue))
+
+        try:
+            while True:
+                item, error = self.run(queue.get())
+                if error is not None:
+                    raise error
+                if item is QUEUE_END:
+                    return
+                yield item
+
+        finally:
+            pump.cancel()
+
+    def stop(self, coroutine=None):
+        """Выполняет напоследок `coroutine` (если задана)
+        и останавливает поток."""
+
+        if self.thread is not None and threading.current_thread() is self.thread:
+            raise RuntimeError("The event loop thread can't stop itself")
+
+        with self.lock:
+            loop, thread = self.loop, self.thread
+            self.loop = self.thread = None
+
+        if loop is None:
+            if coroutine is not None:
+                coroutine.close()
+            return
+
+        try:
+            if coroutine is not None:
+                asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+
+
+# признак конца перебора в `EventLoopThread.iterate()`
+QUEUE_END = object()
+
+
+async def create_queue(maxsize: int) -> asyncio.Queue:
+    # очередь создается в том цикле событий, в котором будет использоваться
+    return asyncio.Queue(maxsize)
+
+
+async def pump_to_queue(async_iterator, queue: asyncio.Queue):
+    """Перекладывает элементы `async_iterator` в `queue` парами
+    (элемент, исключение)."""
+
+    try:
+        async for item in async_iterator:
+            await queue.put((item, None))
+
+    except Exception as error:
+        await queue.put((None, error))
+
+    else:
+        await queue.put((QUEUE_END, None))
+
+    finally:
+        # при отмене перебора асинхронный генератор закрывается сразу,
+        # а не когда до него дойдет сборщик мусора
+        if hasattr(async_iterator, "aclose"):
+            await async_iterator.aclose()
@@ -1,11 +1,12 @@
-from asyncio import FIRST_COMPLETED, ensure_future, wait
+from asyncio import FIRST_COMPLETED, wait
 from beartype.typing import Dict, List, Union
 
 from more_itertools import chunked
 from tqdm.auto import tqdm
 
 from .server_response import ServerResponseParser
-from .srh import ServerRequestHandler
+from .srh import DeadlineExceeded, ServerRequestHandler
+from .task_group import TaskGroup
 from .utils import http_build_query
 
 
@@ -19,6 +20,7 @@ class MultipleServerRequestHandler:
         real_start=0,
         mute=False,
         get_by_ID=False,
+        max_tasks=None,
     ):
         self.bitrix = bitrix
         self.srh: ServerRequestHandler = bitrix.srh
@@ -29,20 +31,35 @@ class MultipleServerRequestHandler:
         self.mute = mute
         self.get_by_ID = get_by_ID
 
+        # сколько батчей может обрабатываться одновременно
+        # (`None` - сколько позволяет `self.srh`)
+        self.max_tasks = max_tasks
+
         self.results = None
+        self.chunks = chunked(self.item_list, self.bitrix.batch_size)
         self.task_iterator = self.generate_tasks()
         self.tasks = set()
 
+        # группа, в которой запускаются задачи батчей: при ошибке или отмене
+        # незавершенные батчи отменяются, а не расходуют лимиты впустую
+        self.task_group = None
+
+        # элементы `item_list` каждой задачи
+        self.task_chunks = {}
+
+        # элементы, которые не успели обработать до истечения срока операции
+        self.missing = []
+        self.deadline_exceeded = False
+
     def generate_tasks(self):
         """Group items in batches and create asyncio tasks for each batch"""
 
-        batches = (
-            self.package_batch(chunk)
-            for chunk in chunked(self.item_list, self.bitrix.batch_size)
-        )
-
-        for batch in batches:
-            yield ensure_future(self.srh.single_request("batch", batch))
+        for chunk in self.chunks:
+            task = self.task_group.create_task(
+                self.srh.schedule_batch(self.package_batch(chunk))
+            )
+            self.task_chunks[task] = chunk
+            yield task
 
     def package_batch(self, chunk):
         return {
@@ -59,14 +76,22 @@ class MultipleServerRequestHandler:
         return f"cmd{i:010}"
 
     async def run(self) -> Union[Dict, List]:
-        self.top_up_tasks()
+        async with TaskGroup() as self.task_group:
+            self.top_up_tasks()
 
-        with self.get_pbar() as pbar:
-            while self.tasks:
-                done, self.tasks = await wait(self.tasks, return_when=FIRST_COMPLETED)
-                extracted_len = self.process_done_tasks(done)
-                pbar.update(extracted_len)
-                self.top_up_tasks()
+            with self.get_pbar() as pbar:
+                while self.tasks:
+                    done, self.tasks = await wait(
+                        self.tasks, return_when=FIRST_COMPLETED
+                    )
+                    extracted_len = self.process_done_tasks(done)
+                    pbar.update(extracted_len)
+
+                    if self.deadline_exceeded:
+                        self.abandon_remaining_tasks()
+                        break
+
+                    self.top_up_tasks()
 
         #            self.pbar.set_postfix({
         #                'max. requests': self.srh.mcr_cur_limit,
@@ -75,11 +100,35 @@ class MultipleServerRequestHandler:
 
         return self.results
 
+    async def iter_responses(self):
+        """Как `run()`, но отдает ответы сервера на каждый батч
+        по мере получения.
+
+        Новые батчи отправляются, только когда запрошены следующие
+        результаты, поэтому медленный получатель сдерживает отправку
+        запросов. Если получатель прекратил перебор, то оставшиеся
+        задачи отменяются."""
+
+        async with TaskGroup() as self.task_group:
+            self.top_up_tasks()
+
+            while self.tasks:
+                done, self.tasks = await wait(self.tasks, return_when=FIRST_COMPLETED)
+
+                for done_task in done:
+                    self.task_chunks.pop(done_task)
+                    yield done_task.result()
+
+                self.top_up_tasks()
+
     def top_up_tasks(self) -> None:
         """Добавляем в self.tasks столько задач, сколько свободных слотов для
         запросов есть сейчас в self.srh."""
 
         to_add = max(int(self.srh.mcr_cur_limit) - self.srh.concurrent_requests, 0)
+        if self.max_tasks is not None:
+            to_add = min(to_add, self.max_tasks - len(self.tasks))
+
         for _ in range(to_add):
             try:
                 self.tasks.add(next(self.task_iterator))
@@ -92,8 +141,17 @@ class MultipleServerRequestHandler:
 
         extracted_len = 0
         for done_task in done:
+            chunk = self.task_chunks.pop(done_task)
+
+            if isinstance(done_task.exception(), DeadlineExceeded):
+                self.deadline_exceeded = True
+                self.missing.extend(chunk)
+                continue
+
             extracted = ServerResponseParser(
-                done_task.result(), self.get_by_ID
+                done_task.result(),
+                self.get_by_ID,
+                self.srh.method_registry.get(self.method).result_key,
             ).extract_results()
 
             if self.results is None:
@@ -122,6 +180,19 @@ class MultipleServerRequestHandler:
 
         return extracted_len
 
+    def abandon_remaining_tasks(self):
+        """Отменяет задачи, оставшиеся после истечения срока операции,
+        и записывает их элементы в `self.missing`."""
+
+        for task in self.tasks:
+            task.cancel()
+            self.missing.extend(self.task_chunks.pop(task))
+
+        self.tasks = set()
+
+        for chunk in self.chunks:
+            self.missing.extend(chunk)
+
     def get_pbar(self):
         """Возвращает прогресс бар `tqdm()` или пустышку,
         если `self.bitrix.verbose is False`."""
@@ -146,8 +217,10 @@ class MutePBar:
 
 
 class MultipleServerRequestHandlerPreserveIDs(MultipleServerRequestHandler):
-    def __init__(self, bitrix, method, item_list, ID_field, get_by_ID):
-        super().__init__(bitrix, method, item_list, get_by_ID=get_by_ID)
+    def __init__(self, bitrix, method, item_list, ID_field, get_by_ID, max_tasks=None):
+        super().__init__(
+            bitrix, method, item_list, get_by_ID=get_by_ID, max_tasks=max_tasks
+        )
         self.ID_field = ID_field
 
     def batch_command_label(self, i, item):
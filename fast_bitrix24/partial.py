@@ -0,0 +1,41 @@
+"""Неполные результаты операций, прерванных по истечении срока"""
+
+
+class PartialList(list):
+    """Список результатов, полученных до истечения срока операции.
+
+    В атрибуте `missing` - то, что получить не успели."""
+
+    def __init__(self, iterable=(), missing=()):
+        super().__init__(iterable)
+        self.missing = list(missing)
+
+
+class PartialDict(dict):
+    """Словарь результатов, полученных до истечения срока операции.
+
+    В атрибуте `missing` - то, что получить не успели."""
+
+    def __init__(self, mapping=(), missing=()):
+        super().__init__(mapping)
+        self.missing = list(missing)
+
+
+class PartialTuple(tuple):
+    """Кортеж результатов, полученных до истечения срока операции.
+
+    В атрибуте `missing` - то, что получить не успели."""
+
+    def __new__(cls, iterable=(), missing=()):
+        result = super().__new__(cls, iterable)
+        result.missing = list(missing)
+        return result
+
+
+def make_partial(results, missing: list):
+    """Заворачивает `results` в неполный результат того же вида."""
+
+    if isinstance(results, dict):
+        return PartialDict(results, missing)
+
+    return PartialList(results or [], missing)
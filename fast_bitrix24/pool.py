@@ -0,0 +1,231 @@
+"""Менеджер клиентов для работы с множеством порталов из одного процесса"""
+
+import asyncio
+import collections
+import contextlib
+
+import aiohttp
+
+from .bitrix import BitrixAsync
+from .logger import logger
+
+
+class FairConcurrencyLimiter:
+    """Ограничивает общее количество одновременных запросов ко всем порталам.
+
+    Когда свободных слотов нет, освобождающиеся слоты раздаются ожидающим
+    порталам по очереди (round-robin), чтобы портал с большим количеством
+    запросов не вытеснял остальные.
+    """
+
+    def __init__(self, max_concurrent_requests: int):
+        self.max_concurrent_requests = max_concurrent_requests
+        self.active = 0
+
+        # портал -> очередь ожидающих его запросов.
+        # Порядок ключей - очередность обслуживания порталов
+        self.waiters = collections.OrderedDict()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, tenant: str):
+        if self.active < self.max_concurrent_requests and not self.waiters:
+            self.active += 1
+
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.setdefault(tenant, collections.deque()).append(waiter)
+
+            try:
+                await waiter
+
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # слот уже был передан нам - отдаем его следующему
+                    self.release()
+                else:
+                    self.remove_waiter(tenant, waiter)
+                raise
+
+        try:
+            yield
+        finally:
+            self.release()
+
+    def release(self):
+        """Передает слот следующему порталу в очереди или освобождает его."""
+
+        while self.waiters:
+            tenant, queue = self.waiters.popitem(last=False)
+            waiter = queue.popleft()
+
+            # портал, который только что обслужили, встает в конец очереди
+            if queue:
+                self.waiters[tenant] = queue
+
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.active -= 1
+
+    def remove_waiter(self, tenant, waiter):
+        queue = self.waiters.get(tenant)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self.waiters[tenant]
+
+
+class BitrixPool:
+    """Хранит клиентов `BitrixAsync` для множества порталов.
+
+    У каждого портала свое состояние троттлеров, но все клиенты используют
+    одну HTTP-сессию (и пул соединений) и общее ограничение количества
+    одновременных запросов. Клиенты, не использовавшиеся дольше других,
+    вытесняются из пула, когда количество порталов превышает `max_portals`.
+    """
+
+    def __init__(
+        self,
+        max_portals: int = 100,
+        max_concurrent_requests: int = 100,
+        **client_kwargs,
+    ):
+        """
+        Параметры:
+        - `max_portals: int = 100` - сколько клиентов хранить в пуле
+        - `max_concurrent_requests: int = 100` - максимальное количество
+        одновременных запросов ко всем порталам вместе
+        - `client_kwargs` - параметры, передаваемые конструктору `BitrixAsync`
+        каждого портала (например, `request_pool_size` или `state_file`)
+        """
+
+        if "client" in client_kwargs:
+            raise ValueError("BitrixPool manages the HTTP session by itself")
+
+        self.max_portals = max_portals
+        self.client_kwargs = client_kwargs
+        self.limiter = FairConcurrencyLimiter(max_concurrent_requests)
+
+        self.session = None
+        self.clients = collections.OrderedDict()  # webhook -> BitrixAsync
+
+        # сколько раз каждый клиент сейчас используется через `use()`
+        self.leases = collections.Counter()  # webhook -> количество
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def get(self, webhook: str, token_func=None) -> BitrixAsync:
+        """Возвращает клиента для портала `webhook`, создавая его при необходимости.
+
+        Должен вызываться изнутри корутины, т.к. при первом вызове
+        открывает общую HTTP-сессию."""
+
+        if not self.session or self.session.closed:
+            # статус ответа проверяется в `request_attempt()` клиентов
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limiter.max_concurrent_requests
+                ),
+            )
+
+        if webhook in self.clients:
+            self.clients.move_to_end(webhook)
+            return self.clients[webhook]
+
+        client = BitrixAsync(
+            webhook, token_func=token_func, client=self.session, **self.client_kwargs
+        )
+        client.srh.concurrency_limiter = self.limiter
+
+        self.clients[webhook] = client
+        self.evict(keep=webhook)
+
+        return client
+
+    @contextlib.asynccontextmanager
+    async def use(self, webhook: str, token_func=None):
+        """Возвращает клиента для портала `webhook`, как `get()`, и не дает
+        вытеснить его из пула, пока не закончится блок `async with`.
+
+        Клиента, полученного через `get()`, пул считает занятым только
+        во время выполнения его запросов, поэтому между запросами
+        он может быть вытеснен. Если после этого снова вызвать `get()`,
+        будет создан новый клиент со свежими троттлерами."""
+
+        client = self.get(webhook, token_func)
+        self.leases[webhook] += 1
+
+        try:
+            yield client
+        finally:
+            self.leases[webhook] -= 1
+            if not self.leases[webhook]:
+                del self.leases[webhook]
+
+    def in_use(self, webhook: str) -> bool:
+        srh = self.clients[webhook].srh
+        return bool(
+            self.leases[webhook] or srh.active_runs or srh.concurrent_requests
+        )
+
+    def evict(self, keep: str = None):
+        """Вытесняет из пула давно не использовавшихся клиентов,
+        которые сейчас не используются.
+
+        Клиент `keep` не вытесняется никогда."""
+
+        for webhook, client in list(self.clients.items()):
+            if len(self.clients) <= self.max_portals:
+                break
+
+            if webhook == keep or self.in_use(webhook):
+                continue
+
+            if client.srh.state_file:
+                client.srh.save_state()
+
+            del self.clients[webhook]
+            logger.debug("Portal evicted from pool: {'portal': %s}", webhook)
+
+    async def fan_out(self, func, webhooks=None) -> dict:
+        """Выполняет `await func(client)` для каждого портала параллельно.
+
+        Запросы разных порталов обслуживаются по очереди, поэтому порталы
+        с большими объемами данных не задерживают остальные.
+
+        Параметры:
+        - `func` - асинхронная функция, принимающая клиента `BitrixAsync`,
+        например `lambda b: b.get_all("crm.deal.list")`
+        - `webhooks` - список порталов. По умолчанию - все порталы в пуле.
+
+        Возвращает словарь вида `{webhook: результат}`. Если для портала
+        возникло исключение, оно будет значением в словаре.
+        """
+
+        webhooks = list(self.clients) if webhooks is None else list(webhooks)
+
+        async def run(webhook):
+            async with self.use(webhook) as client:
+                return await func(client)
+
+        results = await asyncio.gather(
+            *(run(webhook) for webhook in webhooks),
+            return_exceptions=True,
+        )
+
+        return dict(zip(webhooks, results))
+
+    async def close(self):
+        """Сохраняет состояние троттлеров и закрывает общую HTTP-сессию."""
+
+        for client in self.clients.values():
+            if client.srh.state_file:
+                client.srh.save_state()
+
+        if self.session and not self.session.closed:
+            await self.session.close()
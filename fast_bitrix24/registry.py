@@ -0,0 +1,200 @@
+"""Реестр сведений о методах REST API"""
+
+import fnmatch
+
+# методы, которые можно получить методом `.list` с фильтром по списку ID
+# и без подсчета общего количества (`start=-1`)
+ID_FILTERED_LISTS = (
+    "crm.activity.list",
+    "crm.company.list",
+    "crm.contact.list",
+    "crm.deal.list",
+    "crm.lead.list",
+    "crm.product.list",
+    "crm.quote.list",
+    "crm.requisite.list",
+)
+
+# методы, которые не принимают параметра `order`
+UNORDERED_METHODS = (
+    "crm.address.list",
+    "crm.deal.userfield.list",
+    "documentgenerator.template.list",
+    "task.elapseditem.getlist",
+    "tasks.elapseditem.getlist",
+    "userfieldconfig.list",
+    "voximplant.statistic.get",
+)
+
+# множественные поля (телефоны, e-mail и т.п.), которые методы `.list`
+# возвращают, только если они явно указаны в `select`
+MULTIFIELD_LISTS = ("crm.company.list", "crm.contact.list", "crm.lead.list")
+MULTIFIELDS = ("PHONE", "EMAIL", "WEB", "IM")
+
+# ключи, под которыми методы возвращают списки сущностей
+RESULT_KEYS = {
+    "crm.item.fields": "fields",
+    "crm.item.list": "items",
+    "crm.item.productrow.list": "productRows",
+    "crm.stagehistory.list": "items",
+    "crm.type.list": "types",
+    "tasks.task.list": "tasks",
+}
+
+
+class MethodInfo:
+    """Сведения о методе REST API, по которым выбирается способ
+    получения и разбора его результатов.
+
+    Параметры:
+    - `returns_list: bool = False` - возвращает ли метод список сущностей
+    (`True`), одну сущность или другой результат (`False`) или,
+    в зависимости от параметров, и то и другое (`None`)
+    - `read_only: bool = False` - только ли читает данные метод
+    (такие запросы можно безопасно дублировать)
+    - `id_field: str = "ID"` - поле ID в сущностях
+    - `supports_order: bool = True` - принимает ли метод параметр `order`
+    - `supports_id_filter: bool = False` - можно ли отфильтровать сущности
+    по списку ID (`filter[@ID]`)
+    - `supports_start_minus_one: bool = False` - можно ли отключить подсчет
+    общего количества сущностей параметром `start=-1`
+    - `result_key: str = None` - ключ, под которым метод возвращает список
+    сущностей (например, `"tasks"` у `tasks.task.list`)
+    - `page_size: int = 50` - сколько сущностей возвращается на одной странице
+    - `cost: float = 1` - относительная стоимость команды для сервера:
+    в батч помещается `batch_size / cost` таких команд
+    - `full_select: tuple = ("*", "UF_*")` - `select`, при котором метод
+    `.list` возвращает те же поля, что и соответствующий метод `.get`
+    """
+
+    FIELDS = (
+        "returns_list",
+        "read_only",
+        "id_field",
+        "supports_order",
+        "supports_id_filter",
+        "supports_start_minus_one",
+        "result_key",
+        "page_size",
+        "cost",
+        "full_select",
+    )
+
+    def __init__(
+        self,
+        returns_list: bool = False,
+        read_only: bool = False,
+        id_field: str = "ID",
+        supports_order: bool = True,
+        supports_id_filter: bool = False,
+        supports_start_minus_one: bool = False,
+        result_key: str = None,
+        page_size: int = 50,
+        cost: float = 1,
+        full_select: tuple = ("*", "UF_*"),
+    ):
+        self.returns_list = returns_list
+        self.read_only = read_only
+        self.id_field = id_field
+        self.supports_order = supports_order
+        self.supports_id_filter = supports_id_filter
+        self.supports_start_minus_one = supports_start_minus_one
+        self.result_key = result_key
+        self.page_size = page_size
+        self.cost = cost
+        self.full_select = full_select
+
+
+class MethodRegistry:
+    """Сведения о методах REST API по шаблонам названий методов.
+
+    Шаблон - название метода или шаблон с `*` (например, `*.list`
+    или `crm.item.*`). Сведения о методе собираются из всех подходящих
+    шаблонов: более точные шаблоны (без `*` или с более длинной
+    постоянной частью) уточняют менее точные.
+    """
+
+    def __init__(self, entries: dict = None):
+        self.entries = {}  # шаблон -> {поле MethodInfo: значение}
+        self.cache = {}  # метод -> MethodInfo
+
+        for pattern, fields in (entries or {}).items():
+            self.register(pattern, **fields)
+
+    def register(self, pattern: str, **fields):
+        """Добавляет или уточняет сведения о методах, подходящих под `pattern`,
+        например `registry.register("crm.item.list", result_key="items")`."""
+
+        unknown = set(fields) - set(MethodInfo.FIELDS)
+        if unknown:
+            raise TypeError(f"Unknown method properties: {sorted(unknown)}")
+
+        self.entries.setdefault(pattern.lower().strip(), {}).update(fields)
+        self.cache.clear()
+
+    def get(self, method: str) -> MethodInfo:
+        """Сведения о методе `method`."""
+
+        method = method.lower().strip()
+
+        info = self.cache.get(method)
+        if info is None:
+            fields = {}
+            patterns = [
+                pattern
+                for pattern in self.entries
+                if fnmatch.fnmatchcase(method, pattern)
+            ]
+            for pattern in sorted(patterns, key=specificity):
+                fields.update(self.entries[pattern])
+
+            info = self.cache[method] = MethodInfo(**fields)
+
+        return info
+
+    def copy(self) -> "MethodRegistry":
+        return MethodRegistry(self.entries)
+
+
+def specificity(pattern: str) -> tuple:
+    return "*" not in pattern, len(pattern.replace("*", ""))
+
+
+def default_entries() -> dict:
+    entries = {
+        "*.list": {"returns_list": True, "read_only": True},
+        "*.getlist": {"returns_list": True, "read_only": True},
+        "*.fields": {"returns_list": True, "read_only": True},
+        "*.types": {"returns_list": True, "read_only": True},
+        "*.getavaliableforpayment": {"returns_list": True, "read_only": True},
+        "*.get": {"returns_list": None, "read_only": True},
+        "tasks.task.list": {"id_field": "id"},
+        "crm.item.list": {"id_field": "id"},
+        "crm.duplicate.findbycomm": {"read_only": True},
+    }
+
+    for method in ID_FILTERED_LISTS:
+        entries.setdefault(method, {}).update(
+            supports_id_filter=True, supports_start_minus_one=True
+        )
+
+    for method in MULTIFIELD_LISTS:
+        entries.setdefault(method, {})["full_select"] = ("*", "UF_*") + MULTIFIELDS
+
+    for method in UNORDERED_METHODS:
+        entries.setdefault(method, {})["supports_order"] = False
+
+    for method, key in RESULT_KEYS.items():
+        entries.setdefault(method, {})["result_key"] = key
+
+    return entries
+
+
+# реестр, который используют клиенты, если им не передан свой
+default_registry = MethodRegistry(default_entries())
+
+
+def register_method(pattern: str, **fields):
+    """Добавляет или уточняет сведения о методах в `default_registry`."""
+
+    default_registry.register(pattern, **fields)
@@ -0,0 +1,119 @@
+"""Правила повторных попыток запросов к серверу"""
+
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+# виды ошибок, после которых запрос повторяется
+RATE_LIMIT = "rate_limit"  # QUERY_LIMIT_EXCEEDED и OPERATION_TIME_LIMIT
+SERVER_ERROR = "server_error"  # остальные ошибки 5XX
+CONNECTION_ERROR = "connection_error"  # обрывы соединения и таймауты
+
+MAX_RETRIES = 10
+
+
+class RetryBudgetExhausted(RuntimeError):
+    """Повторные попытки превысили долю от общего количества запросов,
+    разрешенную `RetryPolicy`."""
+
+
+class RetryPolicy:
+    """Правила повторных попыток запросов к серверу.
+
+    Пауза перед повтором выбирается случайно от нуля до экспоненциально
+    растущего предела ("full jitter"), поэтому одновременно упавшие запросы
+    повторяются вразнобой, а не одной волной. Если сервер прислал
+    заголовок `Retry-After`, то пауза не меньше указанной в нем.
+
+    Параметры:
+    - `max_attempts: int = 10` - сколько раз подряд может не удаться
+    один запрос, прежде чем будет поднято исключение
+    - `base_delay: float = 0.5` - предел паузы после первой ошибки 5XX
+    или ошибки соединения, в секундах
+    - `rate_limit_delay: float = 1` - предел паузы после первого отказа
+    `QUERY_LIMIT_EXCEEDED` или `OPERATION_TIME_LIMIT`, в секундах
+    - `max_delay: float = 30` - максимальный предел паузы, в секундах
+    - `budget_ratio: float = 0.2` - какую долю от количества запросов
+    клиента могут составлять повторы после ошибок 5XX и ошибок соединения
+    - `budget_burst: int = 10` - сколько таких повторов можно сделать
+    сразу, не дожидаясь накопления бюджета
+
+    Повторы после отказов по лимитам бюджет не расходуют:
+    их темп и так ограничен троттлерами клиента.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = MAX_RETRIES,
+        base_delay: float = 0.5,
+        rate_limit_delay: float = 1,
+        max_delay: float = 30,
+        budget_ratio: float = 0.2,
+        budget_burst: int = 10,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.rate_limit_delay = rate_limit_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+
+    def delay(self, kind: str, attempt: int, retry_after: float = None) -> float:
+        """Пауза перед повтором номер `attempt` (начиная с 1)
+        после ошибки вида `kind`."""
+
+        base = self.rate_limit_delay if kind == RATE_LIMIT else self.base_delay
+        delay = random.uniform(0, min(self.max_delay, base * 2 ** (attempt - 1)))
+
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        return delay
+
+    def uses_budget(self, kind: str) -> bool:
+        return kind != RATE_LIMIT
+
+    def create_budget(self) -> "RetryBudget":
+        return RetryBudget(self.budget_ratio, self.budget_burst)
+
+
+class RetryBudget:
+    """Бюджет повторных попыток клиента.
+
+    Каждый новый запрос добавляет в бюджет `ratio` жетона, каждый повтор
+    забирает один. Когда жетонов нет, повторы не делаются, и при массовых
+    сбоях повторы не могут превысить заданную долю трафика.
+    """
+
+    def __init__(self, ratio: float, burst: int):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+
+    def on_request(self):
+        self.tokens = min(self.tokens + self.ratio, self.burst)
+
+    def try_withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+def parse_retry_after(value) -> float:
+    """Переводит значение заголовка `Retry-After` в секунды
+    (`None`, если заголовка нет или он не распознан)."""
+
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
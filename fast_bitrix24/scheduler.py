@@ -0,0 +1,457 @@
+"""Общий планировщик команд батчей для всех запросов пользователя"""
+
+import asyncio
+import collections
+import itertools
+
+from .circuit import HALF_OPEN, OPEN, CircuitOpenError
+from .logger import logger
+from .throttle import ConcurrencyThrottler
+from .srh import (
+    DeadlineExceeded,
+    critical_requests,
+    deadline_remaining,
+    request_deadline,
+    scope_limiters,
+)
+
+# части ответа на батч, которые относятся к отдельным командам
+BATCH_RESPONSE_PARTS = (
+    "result",
+    "result_error",
+    "result_total",
+    "result_next",
+    "result_time",
+)
+
+# как часто перепроверять готовность методов, если все ожидающие
+# команды упираются в ограничения, время снятия которых неизвестно
+IDLE_RECHECK_INTERVAL = 1
+
+
+class Submission:
+    """Батч, переданный планировщику одним пользовательским запросом."""
+
+    def __init__(
+        self,
+        batch: dict,
+        future,
+        critical: bool,
+        deadline: float = None,
+        limiters: tuple = (),
+    ):
+        self.batch = batch
+        self.future = future
+        self.critical = critical
+        self.deadline = deadline
+
+        # ограничители `slow()`, действовавшие при передаче батча
+        self.limiters = limiters
+
+        self.labels = list(batch["cmd"])
+        self.remaining = len(self.labels)
+
+        # label -> {часть ответа: значение}
+        self.parts = {}
+        self.time = None
+
+    def add_command_response(self, label, parts: dict, time):
+        self.parts[label] = parts
+        self.time = time
+        self.remaining -= 1
+
+        if not self.remaining and not self.future.done():
+            self.future.set_result(self.assemble_response())
+
+    def assemble_response(self) -> dict:
+        """Собирает ответы на команды, пришедшие в разных батчах,
+        в ответ того же вида, что и на исходный батч."""
+
+        result = {}
+        for part in BATCH_RESPONSE_PARTS:
+            result[part] = {
+                str(label): self.parts[label][part]
+                for label in self.labels
+                if part in self.parts.get(label, {})
+            } or []
+
+        return {"result": result, "time": self.time}
+
+
+Command = collections.namedtuple("Command", "seq, submission, label, method, url")
+
+
+class BatchScheduler:
+    """Собирает команды батчей от всех запросов пользователя и сам решает,
+    какие из них и в каком составе отправить на сервер.
+
+    В очередной батч попадают только команды тех методов, у которых
+    сейчас есть бюджет времени отработки и свободные слоты в ограничениях
+    одновременных запросов. Команды остальных методов ждут в очереди,
+    не задерживая работу с другими методами. В одном батче могут
+    оказаться команды разных методов и разных запросов пользователя.
+
+    Так же ждут команды запросов, запущенных внутри `BitrixAsync.slow()`,
+    пока ограничители их блока заняты. Ограничители блока действуют только
+    на батчи, в которых есть команды его запросов, и занимаются планировщиком
+    в момент составления батча.
+
+    Если все запросы, чьи команды есть в отправленном батче, отменены
+    (в том числе по истечении срока), то отменяется и отправка батча,
+    чтобы он не расходовал лимиты впустую.
+
+    Запросы с командами методов с разомкнутой цепью сразу завершаются
+    исключением `CircuitOpenError`. Пока цепь метода полуоткрыта, на сервер
+    уходит одна его команда, а остальные ждут ее результата.
+    """
+
+    def __init__(self, srh, batch_size: int):
+        self.srh = srh
+        self.batch_size = batch_size
+
+        # (метод, critical, ограничители slow()) -> очередь команд
+        self.queues = collections.OrderedDict()
+
+        self.seq = itertools.count()
+        self.in_flight = 0
+
+        # задача отправки батча -> запросы, чьи команды в нем
+        self.sending = {}
+
+        # метод с полуоткрытой цепью -> номер отправленной пробной команды
+        self.probing = {}
+
+        self.loop = None
+        self.wakeup = None
+        self.dispatcher = None
+
+    async def submit(self, batch: dict) -> dict:
+        """Ставит команды батча в очередь и возвращает ответ на них
+        в том же виде, в каком сервер ответил бы на сам батч."""
+
+        loop = asyncio.get_running_loop()
+
+        # очередь и события привязаны к циклу событий, в котором работают
+        if self.loop is not loop:
+            self.loop = loop
+            self.wakeup = asyncio.Event()
+            self.queues.clear()
+            self.in_flight = 0
+            self.sending.clear()
+            self.probing.clear()
+            self.dispatcher = None
+
+        submission = Submission(
+            batch,
+            loop.create_future(),
+            critical_requests.get(),
+            request_deadline.get(),
+            scope_limiters.get(),
+        )
+        submission.future.add_done_callback(self.submission_done)
+
+        for label, url in batch["cmd"].items():
+            method = self.srh.standardize_method(url.split("?")[0])
+            self.queues.setdefault(
+                (method, submission.critical, submission.limiters), collections.deque()
+            ).append(Command(next(self.seq), submission, label, method, url))
+
+        if not self.dispatcher or self.dispatcher.done():
+            self.dispatcher = asyncio.ensure_future(self.dispatch())
+        self.wakeup.set()
+
+        remaining = deadline_remaining()
+        if remaining is None:
+            return await submission.future
+
+        # по истечении срока future отменяется, и команды запроса,
+        # еще не отправленные на сервер, пропускаются
+        try:
+            return await asyncio.wait_for(submission.future, max(remaining, 0))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Deadline exceeded while waiting in the queue")
+
+    def has_pending(self) -> bool:
+        return any(self.queues.values())
+
+    async def dispatch(self):
+        """Отправляет батчи, пока в очереди есть команды.
+
+        Если сам диспетчер упал, то ожидающие запросы получают
+        его исключение, а не ждут ответа вечно."""
+
+        try:
+            await self.dispatch_pending()
+
+        except BaseException as error:
+            self.fail_pending(error)
+            raise
+
+    async def dispatch_pending(self):
+        while self.has_pending():
+            if self.in_flight < max(int(self.srh.mcr_cur_limit), 1):
+                commands = self.next_batch()
+
+                if commands:
+                    self.in_flight += 1
+                    limiters = self.reserve_limiters(commands)
+                    task = asyncio.ensure_future(self.send(commands, limiters))
+                    self.sending[task] = {command.submission for command in commands}
+                    task.add_done_callback(self.send_done)
+                    continue
+
+                timeout = self.time_until_ready()
+
+            else:
+                # ждем, пока освободится слот для запроса
+                timeout = None
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    def reserve_limiters(commands: list) -> tuple:
+        """Занимает ограничители slow() запросов, чьи команды попали в батч.
+
+        Ограничители занимаются сразу, а не при отправке батча, чтобы
+        следующий батч составлялся уже с учетом этого."""
+
+        limiters = tuple(
+            {
+                limiter: None
+                for command in commands
+                for limiter in command.submission.limiters
+            }
+        )
+
+        for limiter in limiters:
+            if isinstance(limiter, ConcurrencyThrottler):
+                limiter.reserve()
+            else:
+                limiter.add_request_record()
+
+        return limiters
+
+    @staticmethod
+    def release_limiters(limiters: tuple):
+        for limiter in limiters:
+            if isinstance(limiter, ConcurrencyThrottler):
+                limiter.release()
+
+    def submission_done(self, future):
+        """Отменяет отправку батчей, все запросы которых отменены."""
+
+        if not future.cancelled():
+            return
+
+        for task, submissions in list(self.sending.items()):
+            if all(submission.future.done() for submission in submissions):
+                task.cancel()
+
+    def send_done(self, task):
+        self.sending.pop(task, None)
+
+    def fail_pending(self, error: BaseException):
+        """Завершает с ошибкой `error` все запросы, команды которых
+        остались в очереди."""
+
+        for queue in self.queues.values():
+            for command in queue:
+                future = command.submission.future
+                if future.done():
+                    continue
+                if not isinstance(error, Exception):
+                    future.cancel()
+                else:
+                    future.set_exception(error)
+
+        self.queues.clear()
+
+    @staticmethod
+    def fail_queue(queue, error: Exception):
+        """Завершает с ошибкой `error` запросы, команды которых есть в `queue`."""
+
+        while queue:
+            future = queue.popleft().submission.future
+            if not future.done():
+                future.set_exception(error)
+
+    def next_batch(self) -> list:
+        """Выбирает команды для следующего батча в порядке поступления,
+        пропуская методы, упершиеся в ограничения."""
+
+        # [очередь, сколько ее команд можно взять в батч (`None` - сколько угодно)]
+        ready_queues = []
+        for (method, critical, limiters), queue in self.queues.items():
+            # команды отмененных запросов отправлять незачем
+            while queue and queue[0].submission.future.done():
+                queue.popleft()
+
+            if not queue:
+                continue
+
+            circuit_state = self.srh.circuit_state(method)
+            if circuit_state == OPEN:
+                self.fail_queue(
+                    queue,
+                    CircuitOpenError(
+                        f"Requests to {method} are suspended after repeated failures"
+                    ),
+                )
+                continue
+
+            if not self.srh.method_ready(
+                method, critical
+            ) or not self.srh.scope_ready(limiters):
+                continue
+
+            if circuit_state != HALF_OPEN:
+                ready_queues.append([queue, None])
+            elif method not in self.probing:
+                ready_queues.append([queue, 1])
+
+        # суммарная стоимость команд батча (см. `MethodInfo.cost`)
+        # не превышает `batch_size`; первая команда берется в любом случае
+        commands, cost = [], 0
+        while len(commands) < self.batch_size:
+            ready_queues = [
+                ready for ready in ready_queues if ready[0] and ready[1] != 0
+            ]
+            if not ready_queues:
+                break
+
+            ready = min(ready_queues, key=lambda r: r[0][0].seq)
+            command_cost = self.srh.method_registry.get(ready[0][0].method).cost
+            if commands and cost + command_cost > self.batch_size:
+                break
+
+            command = ready[0].popleft()
+            if not command.submission.future.done():
+                cost += command_cost
+                commands.append(command)
+                if ready[1] is not None:
+                    ready[1] -= 1
+                    self.probing[command.method] = command.seq
+
+        for key in [key for key, queue in self.queues.items() if not queue]:
+            del self.queues[key]
+
+        return commands
+
+    def time_until_ready(self) -> float:
+        """Через сколько секунд освободится хотя бы один из ожидающих методов."""
+
+        wait_times = [
+            max(
+                self.srh.method_wait_time(method, critical),
+                self.srh.scope_wait_time(limiters),
+            )
+            for (method, critical, limiters), queue in self.queues.items()
+            if queue
+        ]
+
+        return max(min(wait_times, default=0), 0) or IDLE_RECHECK_INTERVAL
+
+    async def send(self, commands: list, limiters: tuple = ()):
+        try:
+            await self.send_commands(commands)
+        finally:
+            self.release_limiters(limiters)
+
+            for command in commands:
+                if self.probing.get(command.method) == command.seq:
+                    del self.probing[command.method]
+
+    async def send_commands(self, commands: list):
+        submissions = {command.submission for command in commands}
+
+        # если батч - это в точности один переданный батч, то отправляем
+        # и возвращаем его как есть
+        if len(submissions) == 1:
+            submission = next(iter(submissions))
+            if len(commands) == len(submission.labels):
+                await self.send_whole(submission)
+                return
+
+        # метки команд разных запросов могут совпадать,
+        # поэтому в сборном батче у каждой команды своя метка
+        labelled = {f"c{command.seq}": command for command in commands}
+        batch = {
+            "halt": 0,
+            "cmd": {label: command.url for label, command in labelled.items()},
+        }
+
+        logger.debug(
+            "Scheduled batch: {'commands': %s, 'requests': %s}",
+            len(commands),
+            len(submissions),
+        )
+
+        # батч отправляется как критичный, если в нем есть критичные команды
+        critical_requests.set(any(s.critical for s in submissions))
+
+        # и ограничен самым поздним из сроков запросов, чьи команды в нем есть
+        deadlines = [s.deadline for s in submissions]
+        request_deadline.set(None if None in deadlines else max(deadlines))
+
+        # ограничители slow() этих запросов уже заняты планировщиком
+        scope_limiters.set(())
+
+        try:
+            response = await self.srh.single_request("batch", batch)
+
+        except asyncio.CancelledError:
+            for submission in submissions:
+                submission.future.cancel()
+            raise
+
+        except Exception as error:
+            for submission in submissions:
+                if not submission.future.done():
+                    submission.future.set_exception(error)
+
+        else:
+            result = response.get("result") or {}
+            for label, command in labelled.items():
+                command.submission.add_command_response(
+                    command.label,
+                    {
+                        part: result[part][label]
+                        for part in BATCH_RESPONSE_PARTS
+                        if isinstance(result.get(part), dict) and label in result[part]
+                    },
+                    response.get("time"),
+                )
+
+        finally:
+            self.command_batch_done()
+
+    async def send_whole(self, submission):
+        critical_requests.set(submission.critical)
+        request_deadline.set(submission.deadline)
+        scope_limiters.set(())
+
+        try:
+            response = await self.srh.single_request("batch", submission.batch)
+
+        except asyncio.CancelledError:
+            submission.future.cancel()
+            raise
+
+        except Exception as error:
+            if not submission.future.done():
+                submission.future.set_exception(error)
+
+        else:
+            if not submission.future.done():
+                submission.future.set_result(response)
+
+        finally:
+            self.command_batch_done()
+
+    def command_batch_done(self):
+        self.in_flight -= 1
+        self.wakeup.set()
@@ -8,10 +8,13 @@ class ErrorInServerResponseException(Exception):
 
 
 class ServerResponseParser:
-    def __init__(self, response: dict, get_by_ID: bool = False):
+    def __init__(self, response: dict, get_by_ID: bool = False, result_key: str = None):
         self.response = response
         self.get_by_ID = get_by_ID
 
+        # ключ, под которым метод возвращает список сущностей (из реестра методов)
+        self.result_key = result_key
+
     def more_results_expected(self) -> bool:
         return (
             self.total and self.total > 50 and self.total != len(self.extract_results())
@@ -80,6 +83,9 @@ class ServerResponseParser:
         if isinstance(result, list):
             return result
 
+        if self.result_key and isinstance(result, dict) and self.result_key in result:
+            return result[self.result_key]
+
         # если результат вызова содержит только словарь из одного элемента {ключ: содержимое},
         # то вернуть это содержимое.
         # См. https://github.com/leshchenko1979/fast_bitrix24/issues/132
@@ -96,6 +102,14 @@ class ServerResponseParser:
         if not result:
             return []
 
+        if self.result_key:
+            elements = [
+                self.extract_from_single_response(element)
+                for element in result.values()
+            ]
+            if all(isinstance(element, list) for element in elements):
+                return list(chain(*elements))
+
         # если результат вызова содержит только словарь c одним ключом
         # и списком у него внутри, то вернуть этот список.
         # См. https://github.com/leshchenko1979/fast_bitrix24/issues/132
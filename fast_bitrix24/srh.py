@@ -1,5 +1,18 @@
-from asyncio import Event, TimeoutError, sleep
-from contextlib import asynccontextmanager
+import json
+import os
+import time
+from asyncio import (
+    FIRST_COMPLETED,
+    Event,
+    TimeoutError,
+    ensure_future,
+    sleep,
+    wait,
+    wait_for,
+)
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlparse
 
 import aiohttp
 from aiohttp.client_exceptions import (
@@ -8,32 +21,128 @@ from aiohttp.client_exceptions import (
     ClientResponseError,
 )
 
-from .throttle import SlidingWindowThrottler, LeakyBucketThrottler
+from .autotune import RateLimitAutotuner
+from .circuit import CLOSED, CircuitBreakerPolicy
+from .latency import FieldCostTracker, LatencyTracker
+from .retry import (
+    CONNECTION_ERROR,
+    RATE_LIMIT,
+    SERVER_ERROR,
+    RetryBudgetExhausted,
+    RetryPolicy,
+    parse_retry_after,
+)
+from .throttle import (
+    ConcurrencyThrottler,
+    LeakyBucketThrottler,
+    SlidingWindowThrottler,
+)
 from .logger import logger
-from .utils import _url_valid
+from .registry import MethodRegistry, default_registry
+from .utils import LoopBoundEvent, _url_valid, method_matches
 
 BITRIX_MAX_CONCURRENT_REQUESTS = 50
 
 BITRIX_MEASUREMENT_PERIOD = 10 * 60
 
-MAX_RETRIES = 10
-
 RESTORE_CONNECTIONS_FACTOR = 1.3  # скорость восстановления количества запросов
 DECREASE_CONNECTIONS_FACTOR = 3  # скорость уменьшения количества запросов
-INITIAL_TIMEOUT = 0.5  # начальный таймаут в секундах
-BACKOFF_FACTOR = 1.5  # основа расчета таймаута
-# количество ошибок, до достижения котрого таймауты не делаются
-NUM_FAILURES_NO_TIMEOUT = 3
+
+# как часто сохранять состояние троттлеров в файл, в секундах
+STATE_SAVE_INTERVAL = 60
+
+# после какого перцентиля времени ответа отправляется дубликат запроса
+HEDGE_PERCENTILE = 95
+
+# таймаут HTTP-запроса - это перцентиль времени ответа метода,
+# умноженный на множитель, но не меньше минимального
+ATTEMPT_TIMEOUT_PERCENTILE = 99
+ATTEMPT_TIMEOUT_FACTOR = 3
+MIN_ATTEMPT_TIMEOUT = 10
+
+
+# запросы, запущенные внутри `BitrixAsync.critical()`, могут использовать
+# резерв времени отработки методов, заданный `operating_time_reserve`
+critical_requests = ContextVar("critical_requests", default=False)
+
+# ограничители (`ConcurrencyThrottler`, `LeakyBucketThrottler`), заданные
+# `BitrixAsync.slow()` для запросов, запущенных внутри блока
+scope_limiters = ContextVar("scope_limiters", default=())
+
+# момент по `time.monotonic()`, к которому должна завершиться операция,
+# в рамках которой делаются запросы (задается через `deadline_scope()`)
+request_deadline = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(timeout: float = None, deadline: float = None):
+    """Ограничивает время выполнения запросов, запущенных внутри блока.
+
+    `timeout` - в секундах от текущего момента, `deadline` - момент
+    по `time.time()`. Если блок вложен в другой, то действует
+    более ранний срок."""
+
+    now = time.monotonic()
+    deadlines = [
+        d
+        for d in (
+            request_deadline.get(),
+            None if timeout is None else now + timeout,
+            None if deadline is None else now + deadline - time.time(),
+        )
+        if d is not None
+    ]
+
+    token = request_deadline.set(min(deadlines) if deadlines else None)
+
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
+
+
+def deadline_remaining():
+    """Сколько секунд осталось до срока текущей операции (`None` - срока нет)."""
+
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+async def read_json(response) -> dict:
+    """Тело ответа сервера. Тело ответа с ошибкой может быть не в JSON
+    (например, страница балансировщика) - тогда возвращается `{}`."""
+
+    if response.status < 400:
+        return await response.json(encoding="utf-8")
+
+    try:
+        return await response.json(encoding="utf-8", content_type=None)
+    except ValueError:
+        return {}
 
 
 class ServerError(Exception):
-    pass
+    def __init__(self, *args, retry_after: float = None):
+        super().__init__(*args)
+
+        # через сколько секунд сервер предложил повторить запрос
+        self.retry_after = retry_after
+
+
+class RateLimitError(ServerError):
+    """Сервер отказал в запросе из-за превышения лимита запросов
+    (`QUERY_LIMIT_EXCEEDED`) или времени отработки метода
+    (`OPERATION_TIME_LIMIT`)."""
 
 
 class TokenRejectedError(Exception):
     pass
 
 
+class DeadlineExceeded(Exception):
+    """Истек срок, заданный для операции параметрами `timeout` или `deadline`."""
+
+
 RETRIED_ERRORS = (
     ClientPayloadError,
     ClientConnectionError,
@@ -50,6 +159,12 @@ class ServerRequestHandler:
     серверу Битрикс без получения ошибки `5XX`.
     """
 
+    # планировщик команд батчей (устанавливается `BitrixAsync`)
+    batch_scheduler = None
+
+    # сведения о методах: пагинация, разбор ответов, стоимость команд
+    method_registry = default_registry
+
     def __init__(
         self,
         webhook: str,
@@ -60,6 +175,16 @@ class ServerRequestHandler:
         operating_time_limit: int,
         client,
         ssl: bool = True,
+        throttler_backend=None,
+        state_file: str = None,
+        autotune_rate_limits: bool = False,
+        rate_limits_file: str = None,
+        method_concurrency_limits: dict = None,
+        operating_time_reserve: dict = None,
+        hedge_requests: bool = False,
+        retry_policy: RetryPolicy = None,
+        circuit_breaker: CircuitBreakerPolicy = None,
+        method_registry: MethodRegistry = None,
     ):
         self.webhook = self.standardize_webhook(webhook)
 
@@ -67,8 +192,7 @@ class ServerRequestHandler:
         self.token = None
 
         # token_received - флаг, что получение токена начало и не закончено
-        self.token_received = Event()
-        self.token_received.set()
+        self.token_received = LoopBoundEvent(is_set=True)
 
         self.respect_velocity_policy = respect_velocity_policy
 
@@ -82,6 +206,11 @@ class ServerRequestHandler:
         self.session = client
         self.ssl = ssl
 
+        # не закрывать сессию библиотеки между запросами
+        # (устанавливается синхронным клиентом `Bitrix`, у которого
+        # все запросы выполняются в одном цикле событий)
+        self.keep_session = False
+
         # лимит количества одновременных запросов,
         # установленный конструктором или пользователем
         self.mcr_max = BITRIX_MAX_CONCURRENT_REQUESTS
@@ -91,19 +220,89 @@ class ServerRequestHandler:
         self.mcr_cur_limit = BITRIX_MAX_CONCURRENT_REQUESTS
 
         self.concurrent_requests = 0
-        self.request_complete = Event()
+        self.request_complete = LoopBoundEvent()
+
+        # ограничитель одновременных запросов, общий для нескольких клиентов
+        # (устанавливается `BitrixPool`)
+        self.concurrency_limiter = None
 
         # если положительное - количество последовательных удачных запросов
         # если отрицательное - количество последовательно полученных ошибок
         self.successive_results = 0
 
+        # правила повторных попыток и общий для всех запросов клиента
+        # бюджет повторов
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_budget = self.retry_policy.create_budget()
+
+        # правила размыкателей цепи и сами размыкатели по методам
+        # (`None` - размыкатели не используются)
+        self.circuit_breaker_policy = circuit_breaker
+        self.circuit_breakers = {}  # dict[str, CircuitBreaker]
+
         # rate throttlers by method
-        self.method_throttlers = {}  # dict[str, LeakyBucketLimiter]
+        self.method_throttlers = {}  # dict[str, SlidingWindowThrottler]
+
+        # ограничения количества одновременных запросов по шаблонам методов
+        # (название метода или префикс вида "tasks.*")
+        self.method_concurrency_throttlers = {
+            pattern: ConcurrencyThrottler(limit)
+            for pattern, limit in (method_concurrency_limits or {}).items()
+        }
+
+        # доля времени отработки метода, которая резервируется
+        # для запросов внутри `BitrixAsync.critical()`, по шаблонам методов
+        self.operating_time_reserve = operating_time_reserve or {}
+
+        if method_registry is not None:
+            self.method_registry = method_registry
+
+        # время ответа сервера по методам запросов
+        self.latency_tracker = LatencyTracker()
+
+        # время обработки сервером отдельных полей `select` по методам
+        self.field_costs = FieldCostTracker()
+
+        # дублировать ли запросы на чтение, ответ на которые задерживается
+        self.hedge_requests = hedge_requests
+
+        # хранилище состояния троттлеров, общее для нескольких процессов.
+        # Бюджет запросов у Битрикса - на портал, поэтому ключи состояния
+        # строятся по адресу портала (без секретной части вебхука)
+        self.throttler_backend = throttler_backend
+        self.throttler_key_prefix = urlparse(self.webhook).netloc
 
         self.leaky_bucket_throttler = LeakyBucketThrottler(
-            request_pool_size, requests_per_second
+            request_pool_size,
+            requests_per_second,
+            backend=throttler_backend,
+            key=f"{self.throttler_key_prefix}:leaky_bucket",
+        )
+
+        # подбор размера пула и скорости запросов по ответам сервера.
+        # Автоподбор видит только локальное состояние leaky bucket,
+        # поэтому с общим хранилищем состояния он бы ошибался
+        if autotune_rate_limits and throttler_backend:
+            raise ValueError(
+                "`autotune_rate_limits` can't be used together with `throttler_backend`"
+            )
+
+        self.rate_limits_autotuner = (
+            RateLimitAutotuner(
+                self.leaky_bucket_throttler,
+                self.throttler_key_prefix,
+                rate_limits_file,
+            )
+            if autotune_rate_limits
+            else None
         )
 
+        # файл, в котором состояние троттлеров переживает перезапуск процесса
+        self.state_file = state_file
+        self.state_saved_at = time.monotonic()
+        if state_file:
+            self.load_state()
+
     @staticmethod
     def standardize_webhook(webhook):
         """Приводит `webhook` к стандартному виду."""
@@ -128,6 +327,14 @@ class ServerRequestHandler:
         async with self.handle_sessions():
             return await coroutine
 
+    async def iterate_async(self, async_iterator):
+        """Перебирает `async_iterator`, создавая и прекращая сессию
+        при необходимости."""
+
+        async with self.handle_sessions():
+            async for item in async_iterator:
+                yield item
+
     @asynccontextmanager
     async def handle_sessions(self):
         """Открывает и закрывает сессию в зависимости от наличия
@@ -135,13 +342,16 @@ class ServerRequestHandler:
 
         # если клиент был задан пользователем, то ожидаем,
         # что пользователь сам откроет и закроет сессию
-
-        if self.client_provided_by_user:
-            yield
-            return
-
-        if not self.active_runs and (not self.session or self.session.closed):
-            self.session = aiohttp.ClientSession(raise_for_status=True)
+        manage_session = not self.client_provided_by_user
+
+        if (
+            manage_session
+            and not self.active_runs
+            and (not self.session or self.session.closed)
+        ):
+            # статус ответа проверяется в `request_attempt()`,
+            # чтобы причину отказа можно было прочитать из тела ответа
+            self.session = aiohttp.ClientSession()
         self.active_runs += 1
 
         try:
@@ -149,8 +359,28 @@ class ServerRequestHandler:
 
         finally:
             self.active_runs -= 1
-            if not self.active_runs and self.session and not self.session.closed:
-                await self.session.close()
+            if not self.active_runs:
+                if (
+                    manage_session
+                    and not self.keep_session
+                    and self.session
+                    and not self.session.closed
+                ):
+                    await self.session.close()
+
+                # состояние сохраняется после последнего запроса
+                # независимо от того, чья это сессия
+                if self.state_file:
+                    self.save_state()
+
+    async def close(self):
+        """Закрывает сессию, созданную библиотекой, и сохраняет состояние."""
+
+        if not self.client_provided_by_user and self.session and not self.session.closed:
+            await self.session.close()
+
+        if self.state_file:
+            self.save_state()
 
     async def single_request(self, method: str, params=None) -> dict:
         """Делает единичный запрос к серверу,
@@ -160,10 +390,17 @@ class ServerRequestHandler:
         if self.token_func and not self.token:
             await self.ensure_new_token()
 
+        self.retry_budget.on_request()
+        failed_attempts = 0
+
         while True:
 
             try:
-                result = await self.request_attempt(method.strip().lower(), params)
+                with self.circuit_guard(method, params) as breakers:
+                    result = await self.timed_request_attempt(
+                        method.strip().lower(), params
+                    )
+                self.record_circuit_results(breakers, method, params, result)
                 self.success()
                 return result
 
@@ -171,36 +408,274 @@ class ServerRequestHandler:
                 await self.ensure_new_token()
 
             except RETRIED_ERRORS as err:
-                self.failure(err)
+                # при размыкателях ошибки одного метода не снижают
+                # количество одновременных запросов к остальным
+                if not self.circuit_breaker_policy or isinstance(err, RateLimitError):
+                    self.failure(err)
+                failed_attempts += 1
+                await self.wait_before_retry(err, failed_attempts)
 
             # all other exceptions will propagate
 
-    async def request_attempt(self, method, params=None) -> dict:
-        """Делает попытку запроса к серверу, ожидая при необходимости."""
+    async def wait_before_retry(self, err: Exception, failed_attempts: int):
+        """Решает по `self.retry_policy`, можно ли повторить запрос после
+        ошибки `err`, и выжидает паузу перед повтором.
+
+        Если повторять нельзя, поднимает исключение."""
+
+        policy = self.retry_policy
+        kind = self.error_kind(err)
+
+        if failed_attempts >= policy.max_attempts:
+            raise RuntimeError("All attempts to get data from server exhausted") from err
+
+        if policy.uses_budget(kind) and not self.retry_budget.try_withdraw():
+            raise RetryBudgetExhausted(
+                "Too many retries compared to the number of requests"
+            ) from err
+
+        delay = policy.delay(
+            kind, failed_attempts, getattr(err, "retry_after", None)
+        )
+
+        # ждать дольше срока операции бессмысленно
+        remaining = deadline_remaining()
+        if remaining is not None:
+            delay = min(delay, max(remaining, 0))
+
+        logger.debug(
+            "Retrying request: {'error': %s, 'attempt': %s, 'delay': %s}",
+            kind,
+            failed_attempts,
+            round(delay, 3),
+        )
+
+        await sleep(delay)
+
+    def circuit_breaker(self, method: str):
+        """Размыкатель цепи `method` (`None`, если размыкатели не используются)."""
+
+        if not self.circuit_breaker_policy:
+            return None
+
+        method = self.standardize_method(method)
+        if method not in self.circuit_breakers:
+            self.circuit_breakers[
+                method
+            ] = self.circuit_breaker_policy.create_breaker(method)
+
+        return self.circuit_breakers[method]
+
+    def circuit_state(self, method: str) -> str:
+        breaker = self.circuit_breaker(method)
+        return breaker.state if breaker else CLOSED
+
+    @contextmanager
+    def circuit_guard(self, method: str, params: dict = None):
+        """Пропускает запрос через размыкатели цепи методов, к которым
+        он обращается, и учитывает в них неудачу запроса.
+
+        Возвращает словарь {метод: размыкатель} для учета удачного ответа
+        в `record_circuit_results()`."""
+
+        breakers = {}
+        if self.circuit_breaker_policy:
+            try:
+                for item_method in self.request_methods(
+                    self.standardize_method(method), params
+                ):
+                    breaker = self.circuit_breaker(item_method)
+                    breaker.before_request()
+                    breakers[item_method] = breaker
+
+            except BaseException:
+                for breaker in breakers.values():
+                    breaker.release()
+                raise
+
+        try:
+            yield breakers
+
+        except (RateLimitError, TokenRejectedError, DeadlineExceeded):
+            # отказ по лимиту, токену или сроку ничего не говорит о методе
+            for breaker in breakers.values():
+                breaker.release()
+            raise
+
+        except Exception:
+            for breaker in breakers.values():
+                breaker.record_failure()
+            raise
+
+        except BaseException:
+            for breaker in breakers.values():
+                breaker.release()
+            raise
+
+    def record_circuit_results(
+        self, breakers: dict, method: str, params: dict, json: dict
+    ):
+        """Учитывает удачный ответ в размыкателях цепи. Команды батча,
+        завершившиеся ошибкой (`result_error`), считаются неудачами
+        своих методов."""
+
+        if not breakers:
+            return
+
+        failed = set()
+        result = json.get("result")
+        if (
+            self.standardize_method(method) == "batch"
+            and isinstance(result, dict)
+            and isinstance(result.get("result_error"), dict)
+        ):
+            commands = {str(label): url for label, url in params["cmd"].items()}
+            failed = {
+                self.standardize_method(commands[label].split("?")[0])
+                for label in result["result_error"]
+                if label in commands
+            }
+
+        for item_method, breaker in breakers.items():
+            if item_method in failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+    @staticmethod
+    def error_kind(err: Exception) -> str:
+        if isinstance(err, RateLimitError):
+            return RATE_LIMIT
+
+        if isinstance(err, ServerError):
+            return SERVER_ERROR
+
+        return CONNECTION_ERROR
+
+    async def timed_request_attempt(self, method, params=None) -> dict:
+        """Делает попытку запроса, прерывая ее по истечении срока операции,
+        включая ожидание в троттлерах."""
+
+        remaining = deadline_remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Deadline exceeded before requesting {method}")
+
+        if self.hedge_requests:
+            attempt = self.hedged_request_attempt(method, params)
+        else:
+            attempt = self.request_attempt(method, params)
+
+        if remaining is None:
+            return await attempt
+
+        try:
+            return await wait_for(attempt, remaining)
+
+        except TimeoutError:
+            if deadline_remaining() <= 0:
+                raise DeadlineExceeded(
+                    f"Deadline exceeded while requesting {method}"
+                ) from None
+            raise
+
+    def attempt_timeout(self, method, params=None):
+        """Таймаут HTTP-запроса по наблюдаемому времени ответа метода
+        (`None` - пока недостаточно наблюдений)."""
+
+        percentile = self.latency_tracker.percentile(
+            self.latency_key(method, params), ATTEMPT_TIMEOUT_PERCENTILE
+        )
+        if percentile is None:
+            return None
+
+        return max(percentile * ATTEMPT_TIMEOUT_FACTOR, MIN_ATTEMPT_TIMEOUT)
+
+    async def request_attempt(self, method, params=None, sent: Event = None) -> dict:
+        """Делает попытку запроса к серверу, ожидая при необходимости.
+
+        Если задано `sent`, то оно устанавливается в момент отправки запроса."""
+
+        # момент отправки запроса - по нему автоподбор лимитов
+        # отличает отказы, полученные до и после смены лимитов
+        sent_at = None
 
         try:
-            async with self.acquire(method):
+            async with self.acquire(method, params):
                 logger.debug(f"Requesting {{'method': {method}, 'params': {params}}}")
+                sent_at = time.monotonic()
+                if sent is not None:
+                    sent.set()
 
                 params_with_auth = params.copy() if params else {}
                 if self.token:
                     params_with_auth["auth"] = self.token
 
+                post_kwargs = {}
+                timeout = self.attempt_timeout(method, params)
+                if timeout is not None:
+                    post_kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
                 async with self.session.post(
-                    url=self.webhook + method, json=params_with_auth, ssl=self.ssl
+                    url=self.webhook + method,
+                    json=params_with_auth,
+                    ssl=self.ssl,
+                    **post_kwargs,
                 ) as response:
-                    json = await response.json(encoding="utf-8")
+                    json = await read_json(response)
 
                     logger.debug("Response: %s", json)
 
+                    # отказ по лимиту отличается от прочих ошибок
+                    # (в т.ч. с тем же статусом 503) только кодом в теле ответа
+                    error_code = json.get("error") if isinstance(json, dict) else None
+                    retry_after = parse_retry_after(
+                        (response.headers or {}).get("Retry-After")
+                    )
+
+                    if error_code == "QUERY_LIMIT_EXCEEDED":
+                        self.rate_limited(sent_at)
+                        raise RateLimitError(
+                            "Too many requests", retry_after=retry_after
+                        )
+
+                    if error_code == "OPERATION_TIME_LIMIT":
+                        raise RateLimitError(
+                            "Method is blocked due to operation time limit",
+                            retry_after=self.operation_time_limited(
+                                self.request_methods(method, params),
+                                json.get("time"),
+                                retry_after,
+                            ),
+                        )
+
+                    if response.status >= 400:
+                        response.raise_for_status()
+
+                    if self.rate_limits_autotuner:
+                        self.rate_limits_autotuner.on_success()
+
                     self.add_throttler_records(method, params, json)
+                    self.latency_tracker.add(
+                        self.latency_key(method, params), time.monotonic() - sent_at
+                    )
+
+                    if (
+                        self.state_file
+                        and time.monotonic() - self.state_saved_at > STATE_SAVE_INTERVAL
+                    ):
+                        self.save_state()
 
                     return json
 
         except ClientResponseError as error:
+            retry_after = parse_retry_after(
+                (error.headers or {}).get("Retry-After")
+            )
 
             if error.status // 100 == 5:  # ошибки вида 5XX
-                raise ServerError("The server returned an error") from error
+                raise ServerError(
+                    "The server returned an error", retry_after=retry_after
+                ) from error
 
             elif error.status == 401 and self.token_func:
                 raise TokenRejectedError(
@@ -209,17 +684,269 @@ class ServerRequestHandler:
 
             raise  # иначе повторяем полученное исключение
 
+    async def hedged_request_attempt(self, method, params=None) -> dict:
+        """Делает попытку запроса, а если ответ задерживается дольше,
+        чем `HEDGE_PERCENTILE` обычных ответов, то отправляет дубликат
+        и возвращает первый полученный ответ.
+
+        Дубликаты отправляются только для методов чтения и только
+        при наличии свободного места в leaky bucket. Проигравший запрос
+        отменяется, а если он уже был отправлен, то его стоимость
+        учитывается в троттлерах методов по ответу победителя."""
+
+        delay = self.latency_tracker.percentile(
+            self.latency_key(method, params), HEDGE_PERCENTILE
+        )
+        if delay is None or not self.is_idempotent(method, params):
+            return await self.request_attempt(method, params)
+
+        attempts = {}  # задача -> событие отправки запроса
+
+        def start_attempt():
+            sent = Event()
+            attempts[ensure_future(self.request_attempt(method, params, sent))] = sent
+
+        start_attempt()
+
+        try:
+            done, pending = await wait(set(attempts), timeout=delay)
+            if done or not self.hedge_budget_available():
+                return await next(iter(attempts))
+
+            logger.debug(
+                "Hedging request: {'method': %s, 'delay': %s}", method, round(delay, 3)
+            )
+            start_attempt()
+
+            pending = set(attempts)
+            winner = None
+            while pending and not winner:
+                done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+                winner = next((task for task in done if not task.exception()), None)
+
+            if not winner:
+                # обе попытки неудачны - поднимаем ошибку первой из них
+                return await next(iter(attempts))
+
+            result = winner.result()
+
+            for task in pending:
+                if attempts[task].is_set():
+                    self.add_throttler_records(method, params, result)
+
+            return result
+
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def is_idempotent(self, method: str, params: dict = None) -> bool:
+        """Только ли читает данные запрос к `method`."""
+
+        return all(
+            self.method_registry.get(item_method).read_only
+            for item_method in self.request_methods(method, params)
+        )
+
+    def hedge_budget_available(self) -> bool:
+        """Есть ли в leaky bucket место для дубликата запроса.
+
+        Заполненность общего хранилища состояния неизвестна локально,
+        поэтому с `throttler_backend` дубликаты не отправляются."""
+
+        throttler = self.leaky_bucket_throttler
+        return (
+            not self.throttler_backend
+            and throttler.level() < throttler.pool_size - 1
+        )
+
+    def latency_key(self, method: str, params: dict = None) -> str:
+        return ",".join(self.request_methods(method, params))
+
+    def rate_limited(self, sent_at: float = None):
+        """Учесть отказ сервера по превышению лимита запросов,
+        отправленного в момент `sent_at` (по `time.monotonic()`)."""
+
+        logger.debug("Server refused the request: QUERY_LIMIT_EXCEEDED")
+
+        if self.rate_limits_autotuner:
+            self.rate_limits_autotuner.on_rate_limited(sent_at)
+
+    def operation_time_limited(
+        self, methods: list, time_info: dict = None, retry_after: float = None
+    ) -> float:
+        """Учесть отказ сервера по превышению времени отработки `methods`.
+
+        Методы блокируются до момента `operating_reset_at` из `time_info`
+        (а если сервер его не сообщил - на `retry_after` секунд).
+        Возвращает, через сколько секунд можно повторить запрос.
+        Ограничения leaky bucket при этом не меняются: исчерпан бюджет
+        метода, а не общий лимит запросов."""
+
+        logger.debug("Server refused the request: OPERATION_TIME_LIMIT")
+
+        reset_at = (time_info or {}).get("operating_reset_at")
+        blocked_for = reset_at - time.time() if reset_at else retry_after
+        if blocked_for is None or blocked_for <= 0:
+            return retry_after
+
+        for item_method in methods:
+            if item_method not in self.method_throttlers:
+                self.method_throttlers[item_method] = self.create_method_throttler(
+                    item_method
+                )
+            self.method_throttlers[item_method].block(blocked_for)
+
+        return blocked_for
+
     def add_throttler_records(self, method, params: dict, json: dict):
-        if "result_time" in json:
+        result = json.get("result")
+
+        if method == "batch" and isinstance(result, dict) and result.get("result_time"):
+            # в батче время отработки учитывается по каждой команде
+            errors = result.get("result_error") or {}
+            if not isinstance(errors, dict):
+                errors = {}
+
             for cmd_name, cmd_url in params["cmd"].items():
-                item_method = cmd_url.split("?")[0]
-                item_time = json["result_time"][cmd_name]
-                self.method_throttlers[item_method].add_request_record(item_time)
+                item_method = self.standardize_method(cmd_url.split("?")[0])
+                item_time = result["result_time"].get(str(cmd_name))
+                item_error = errors.get(str(cmd_name))
+
+                if (
+                    isinstance(item_error, dict)
+                    and item_error.get("error") == "OPERATION_TIME_LIMIT"
+                ):
+                    self.operation_time_limited([item_method], item_time)
+
+                if item_time and "operating" in item_time:
+                    self.add_method_record(item_method, item_time)
+
         elif "time" in json and "operating" in json["time"]:
-            request_run_time = json["time"]["operating"]
-            self.method_throttlers[method].add_request_record(request_run_time)
+            self.add_method_record(method, json["time"])
 
-        self.leaky_bucket_throttler.add_request_record()
+    def add_method_record(self, method: str, time_info: dict):
+        """Учесть время отработки запроса к `method` по полям
+        `operating` и `operating_reset_at` из ответа сервера."""
+
+        throttler = self.method_throttlers.get(method)
+        if not throttler:
+            return
+
+        reset_at = time_info.get("operating_reset_at")
+        throttler.add_request_record(
+            time_info["operating"],
+            released_in=reset_at - time.time() if reset_at else None,
+        )
+
+    @staticmethod
+    def standardize_method(method: str) -> str:
+        return method.strip().lower()
+
+    def request_methods(self, method: str, params: dict = None) -> list:
+        """Методы REST API, к которым обращается запрос:
+        для батча - методы его команд, иначе - сам `method`."""
+
+        if method == "batch" and params and isinstance(params.get("cmd"), dict):
+            return sorted(
+                {
+                    self.standardize_method(str(cmd_url).split("?")[0])
+                    for cmd_url in params["cmd"].values()
+                }
+            )
+
+        return [method]
+
+    def reserved_share(self, method: str, critical: bool = None) -> float:
+        """Доля времени отработки `method`, недоступная для обычных запросов."""
+
+        if critical is None:
+            critical = critical_requests.get()
+
+        if critical:
+            return 0
+
+        matching = [
+            pattern
+            for pattern in self.operating_time_reserve
+            if method_matches(method, pattern)
+        ]
+
+        # самый точный шаблон - самый длинный
+        return (
+            self.operating_time_reserve[max(matching, key=len)] if matching else 0
+        )
+
+    def create_method_throttler(self, method: str) -> SlidingWindowThrottler:
+        return SlidingWindowThrottler(
+            self.operating_time_limit,
+            BITRIX_MEASUREMENT_PERIOD,
+            backend=self.throttler_backend,
+            key=f"{self.throttler_key_prefix}:method:{method}",
+        )
+
+    def save_state(self):
+        """Сохраняет состояние троттлеров и autothrottling в `self.state_file`.
+
+        Если задан `throttler_backend`, то состояние троттлеров и так
+        хранится вне процесса, поэтому сохраняется только autothrottling."""
+
+        state = {
+            "saved_at": time.time(),
+            "autothrottle": {
+                "mcr_cur_limit": self.mcr_cur_limit,
+                "successive_results": self.successive_results,
+            },
+        }
+
+        if not self.throttler_backend:
+            state["leaky_bucket"] = self.leaky_bucket_throttler.dump_state()
+            state["method_throttlers"] = {
+                method: throttler.dump_state()
+                for method, throttler in self.method_throttlers.items()
+            }
+
+        # в одном файле могут храниться состояния нескольких порталов
+        all_states = self.read_state_file()
+        all_states[self.throttler_key_prefix] = state
+
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(all_states, f)
+        os.replace(tmp_path, self.state_file)
+
+        self.state_saved_at = time.monotonic()
+        logger.debug("Throttler state saved: {'state_file': %s}", self.state_file)
+
+    def load_state(self):
+        """Восстанавливает состояние, сохраненное `save_state()`."""
+
+        state = self.read_state_file().get(self.throttler_key_prefix)
+        if not state:
+            return
+
+        elapsed = max(time.time() - state["saved_at"], 0)
+
+        autothrottle = state["autothrottle"]
+        self.mcr_cur_limit = min(autothrottle["mcr_cur_limit"], self.mcr_max)
+        self.successive_results = autothrottle["successive_results"]
+
+        if not self.throttler_backend:
+            if "leaky_bucket" in state:
+                self.leaky_bucket_throttler.load_state(state["leaky_bucket"], elapsed)
+
+            for method, method_state in state.get("method_throttlers", {}).items():
+                self.method_throttlers[method] = self.create_method_throttler(method)
+                self.method_throttlers[method].load_state(method_state, elapsed)
+
+        logger.debug("Throttler state loaded: {'state_file': %s}", self.state_file)
+
+    def read_state_file(self) -> dict:
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
 
     def success(self):
         """Увеличить счетчик удачных попыток."""
@@ -227,38 +954,123 @@ class ServerRequestHandler:
         self.successive_results = max(self.successive_results + 1, 1)
 
     def failure(self, err: Exception):
-        """Увеличить счетчик неудачных попыток и поднять исключение,
-        если попытки исчерпаны."""
+        """Увеличить счетчик неудачных попыток."""
 
         self.successive_results = min(self.successive_results - 1, -1)
 
-        if self.successive_results < -MAX_RETRIES:
-            raise RuntimeError(
-                "All attempts to get data from server exhausted"
-            ) from err
+    def method_wait_time(self, method: str, critical: bool = False) -> float:
+        """Сколько секунд осталось до освобождения бюджета времени
+        отработки `method`."""
+
+        throttler = self.method_throttlers.get(method)
+        if not self.respect_velocity_policy or not throttler:
+            return 0
+
+        return throttler._calculate_needed_sleep_time(
+            self.reserved_share(method, critical)
+        )
+
+    @staticmethod
+    def scope_ready(limiters: tuple) -> bool:
+        """Можно ли прямо сейчас отправить запрос, не упираясь
+        в ограничители `limiters` из `scope_limiters`."""
+
+        return not any(limiter.saturated() for limiter in limiters)
+
+    @staticmethod
+    def scope_wait_time(limiters: tuple) -> float:
+        """Сколько секунд осталось до освобождения ограничителей скорости
+        из `limiters`. Освобождение ограничителей количества одновременных
+        запросов заранее неизвестно."""
+
+        return max(
+            (
+                limiter.wait_time()
+                for limiter in limiters
+                if isinstance(limiter, LeakyBucketThrottler)
+            ),
+            default=0,
+        )
+
+    def method_ready(self, method: str, critical: bool = False) -> bool:
+        """Можно ли прямо сейчас отправить запрос к `method`, не упираясь
+        в лимит времени отработки и ограничения одновременных запросов."""
+
+        if self.method_wait_time(method, critical) > 0:
+            return False
+
+        return not any(
+            throttler.saturated()
+            for pattern, throttler in self.method_concurrency_throttlers.items()
+            if method_matches(method, pattern)
+        )
+
+    async def schedule_batch(self, batch: dict) -> dict:
+        """Отправляет батч через планировщик, если он есть, или напрямую."""
+
+        if self.batch_scheduler is None:
+            return await self.single_request("batch", batch)
+
+        return await self.batch_scheduler.submit(batch)
 
     @asynccontextmanager
-    async def acquire(self, method: str):
+    async def acquire(self, method: str, params: dict = None):
         """Ожидает, пока не станет безопасно делать запрос к серверу."""
 
         await self.autothrottle()
 
-        async with self.limit_concurrent_requests(), self.leaky_bucket_throttler.acquire():
+        methods = self.request_methods(method, params)
+
+        # ограничения отдельных методов проходятся до занятия общего слота,
+        # чтобы запросы, ждущие своего метода, не держали слоты других методов
+        async with AsyncExitStack() as stack:
             if self.respect_velocity_policy:
-                if method not in self.method_throttlers:
-                    self.method_throttlers[method] = SlidingWindowThrottler(
-                        self.operating_time_limit, BITRIX_MEASUREMENT_PERIOD
+                for item_method in methods:
+                    if item_method not in self.method_throttlers:
+                        self.method_throttlers[
+                            item_method
+                        ] = self.create_method_throttler(item_method)
+
+                    await stack.enter_async_context(
+                        self.method_throttlers[item_method].acquire(
+                            self.reserved_share(item_method)
+                        )
                     )
 
-                async with self.method_throttlers[method].acquire():
+            for pattern, throttler in self.method_concurrency_throttlers.items():
+                if any(method_matches(item_method, pattern) for item_method in methods):
+                    await stack.enter_async_context(throttler.acquire())
+
+            for limiter in scope_limiters.get():
+                await stack.enter_async_context(limiter.acquire())
+
+            async with self.limit_concurrent_requests(), self.send_slot():
+                yield
+
+    @asynccontextmanager
+    async def send_slot(self):
+        """Занимает место в leaky bucket, а затем слот в общем ограничителе
+        запросов (если он есть) непосредственно перед отправкой запроса.
+
+        Слот общего ограничителя занимается последним, чтобы портал
+        не держал его, пока ждет освобождения своего leaky bucket."""
+
+        async with self.leaky_bucket_throttler.acquire():
+            if self.concurrency_limiter:
+                async with self.concurrency_limiter.acquire(
+                    self.throttler_key_prefix
+                ):
                     yield
 
             else:
                 yield
 
     async def autothrottle(self):
-        """Если было несколько неудач, делаем таймаут и уменьшаем скорость
-        и количество одновременных запросов, и наоборот."""
+        """Если было несколько неудач, уменьшаем количество одновременных
+        запросов, и наоборот.
+
+        Паузы перед повторами выбирает `self.retry_policy`
+        для каждого запроса отдельно."""
 
         if self.successive_results < 0:
             self.mcr_cur_limit = max(
@@ -269,14 +1081,6 @@ class ServerRequestHandler:
                 f"Concurrent requests decreased: {{'mcr_cur_limit': {self.mcr_cur_limit}}}"
             )
 
-            if self.successive_results < NUM_FAILURES_NO_TIMEOUT:
-                power = -self.successive_results - NUM_FAILURES_NO_TIMEOUT - 1
-                delay = INITIAL_TIMEOUT * BACKOFF_FACTOR**power
-
-                logger.debug(f"Delaying request: {{'delay': {delay}}}")
-
-                await sleep(delay)
-
         elif self.successive_results > 0:
 
             self.mcr_cur_limit = min(
@@ -0,0 +1,59 @@
+"""Группа задач asyncio с общей отменой"""
+
+import asyncio
+
+
+class TaskGroup:
+    """Асинхронный контекстный менеджер, отвечающий за запущенные в нем задачи
+    (упрощенный аналог `asyncio.TaskGroup`, которого нет в Python < 3.11).
+
+    Если блок `async with` завершился исключением или был отменен,
+    то все незавершенные задачи группы отменяются, и выход из блока
+    происходит только после их завершения - так задачи не продолжают
+    занимать лимиты запросов и сессию после того, как их результаты
+    стали никому не нужны. При обычном выходе из блока группа дожидается
+    оставшихся задач.
+
+    Результаты и исключения задач забирает тот, кто их создал:
+    группа их не собирает.
+    """
+
+    def __init__(self):
+        self.tasks = set()
+
+    def create_task(self, coroutine) -> asyncio.Future:
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.task_done)
+        return task
+
+    def task_done(self, task):
+        self.tasks.discard(task)
+
+        # исключение обрабатывает владелец задачи, а если задача
+        # стала не нужна, то и исключение - тоже
+        if not task.cancelled():
+            task.exception()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            await self.cancel()
+            return False
+
+        if self.tasks:
+            await asyncio.wait(set(self.tasks))
+
+        return False
+
+    async def cancel(self):
+        """Отменяет незавершенные задачи группы и дожидается их завершения."""
+
+        tasks = set(self.tasks)
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            await asyncio.wait(tasks)
@@ -3,6 +3,8 @@ import collections
 import contextlib
 import time
 
+from .utils import LoopBoundEvent
+
 RequestRecord = collections.namedtuple("RequestRecord", "when, duration")
 
 
@@ -13,9 +15,18 @@ class SlidingWindowThrottler:
     of request running time in total during a period of Y seconds.
 
     When the consumer has hit the limit, he will have to wait.
+
+    If a `backend` is given, the request history is shared through it
+    with all the other throttlers using the same `key`.
     """
 
-    def __init__(self, max_request_running_time: float, measurement_period: float):
+    def __init__(
+        self,
+        max_request_running_time: float,
+        measurement_period: float,
+        backend=None,
+        key: str = "sliding_window",
+    ):
         # how much time fits into the bucket before it starts failing
         self._max_request_running_time = max_request_running_time
 
@@ -25,36 +36,132 @@ class SlidingWindowThrottler:
         # request history. left - most recent, right - least recent
         self._request_history = collections.deque()
 
+        # shared state storage and the key of this throttler in it
+        self._backend = backend
+        self._key = key
+
+        # records not yet written to the backend. left - most recent
+        self._unsynced_records = []
+
+        # until when the server has blocked the requests, in `self._now()` time
+        self._blocked_until = 0
+
     @contextlib.asynccontextmanager
-    async def acquire(self):
-        """A context manager that will wait until it's safe to make the next request"""
-        await asyncio.sleep(self._calculate_needed_sleep_time())
+    async def acquire(self, reserve: float = 0):
+        """A context manager that will wait until it's safe to make the next request.
+
+        `reserve` is the share of the running time that the consumer
+        must leave unused for more important consumers."""
+        if self._backend:
+            await self._sync()
+
+        await asyncio.sleep(self._calculate_needed_sleep_time(reserve))
 
         try:
             yield
         finally:
-            self._remove_stale_records()
+            if self._backend:
+                await self._sync()
+            else:
+                self._remove_stale_records()
+
+    def _now(self) -> float:
+        return self._backend.now() if self._backend else time.monotonic()
 
-    def _calculate_needed_sleep_time(self) -> float:
+    def _calculate_needed_sleep_time(self, reserve: float = 0) -> float:
         """How much time to sleep before it's safe to make a request"""
+        max_request_running_time = self._max_request_running_time * (1 - reserve)
+        now = self._now()
+        blocked = max(self._blocked_until - now, 0)
         acc = 0
         for record in self._request_history:
             acc += record.duration
-            if acc >= self._max_request_running_time:
-                return record.when + self._measurement_period - time.monotonic()
-        return 0
+            if acc >= max_request_running_time:
+                return max(record.when + self._measurement_period - now, blocked)
+        return blocked
 
     def _remove_stale_records(self):
         """Remove all stale records from the record register"""
-        cut_off = time.monotonic() - self._measurement_period
+        cut_off = self._now() - self._measurement_period
         while self._request_history and self._request_history[-1].when < cut_off:
             self._request_history.pop()
 
-    def add_request_record(self, request_duration: float):
-        """Register how long the last request has taken"""
-        self._request_history.appendleft(
-            RequestRecord(time.monotonic(), request_duration)
+    def add_request_record(self, request_duration: float, released_in: float = None):
+        """Register how long the last request has taken.
+
+        `released_in` is how many seconds later the server will stop
+        counting this running time, if the server has reported it.
+        The record then expires together with the server's one
+        instead of a full measurement period later."""
+        now = self._now()
+        when = now
+        if released_in is not None:
+            when += min(max(released_in, 0), self._measurement_period)
+            when -= self._measurement_period
+
+        record = RequestRecord(when, request_duration)
+
+        # keep the history ordered from the most recent record
+        position = 0
+        while (
+            position < len(self._request_history)
+            and self._request_history[position].when > when
+        ):
+            position += 1
+        self._request_history.insert(position, record)
+
+        if self._backend:
+            self._unsynced_records.insert(0, record)
+
+    def block(self, duration: float):
+        """Stop the requests for `duration` seconds, e.g. because
+        the server has reported that the running time is used up"""
+        self._blocked_until = max(self._blocked_until, self._now() + duration)
+
+    def dump_state(self) -> dict:
+        """Snapshot of the request history with times relative to now,
+        so that it can be restored in another process"""
+        self._remove_stale_records()
+        now = self._now()
+        return {
+            "history": [
+                [now - record.when, record.duration]
+                for record in self._request_history
+            ],
+            "blocked_for": max(self._blocked_until - now, 0),
+        }
+
+    def load_state(self, state: dict, elapsed: float = 0):
+        """Restore the request history from `dump_state()` taken
+        `elapsed` seconds ago"""
+        now = self._now()
+        self._request_history = collections.deque(
+            RequestRecord(now - age - elapsed, duration)
+            for age, duration in state.get("history", [])
         )
+        self._blocked_until = now + state.get("blocked_for", 0) - elapsed
+        self._remove_stale_records()
+
+    async def _sync(self):
+        """Merge local records into the shared history and load it back"""
+        async with self._backend.transaction(self._key) as state:
+            cut_off = self._backend.now() - self._measurement_period
+            state["history"] = sorted(
+                (
+                    list(record)
+                    for record in self._unsynced_records + state.get("history", [])
+                    if record[0] >= cut_off
+                ),
+                reverse=True,
+            )
+            state["blocked_until"] = max(
+                state.get("blocked_until", 0), self._blocked_until
+            )
+            self._unsynced_records = []
+            self._request_history = collections.deque(
+                RequestRecord(*record) for record in state["history"]
+            )
+            self._blocked_until = state["blocked_until"]
 
 
 class LeakyBucketThrottler:
@@ -64,45 +171,178 @@ class LeakyBucketThrottler:
     after which the rate of Y requests per second will be applied.
 
     When the consumer has hit the limit, he will have to wait.
+
+    The bucket is kept as a virtual schedule: every `acquire()` reserves
+    a departure time for its caller right away, so that concurrent callers
+    are released one by one at the configured rate instead of waking up
+    together and bursting past it.
+
+    If a `backend` is given, the schedule is shared through it
+    with all the other throttlers using the same `key`.
     """
 
-    def __init__(self, pool_size: int, requests_per_second: float):
+    def __init__(
+        self,
+        pool_size: int,
+        requests_per_second: float,
+        backend=None,
+        key: str = "leaky_bucket",
+    ):
         # how many requests can be in the bucket at once
         self._pool_size = pool_size
 
         # how many requests are removed from the bucket per second
         self._requests_per_second = requests_per_second
 
-        # request history. left - most recent, right - least recent
-        self._request_history = collections.deque()
+        # shared state storage and the key of this throttler in it
+        self._backend = backend
+        self._key = key
+
+        # local state, used when there is no backend. "empty_at" is
+        # the moment when the bucket will have leaked empty, given all
+        # the reservations made so far
+        self._state = {"empty_at": 0.0}
+
+        # requests registered with add_request_record(),
+        # not yet written to the backend
+        self._unsynced_records = 0
+
+    @property
+    def _emission_interval(self) -> float:
+        """How long it takes for one request to leak out of the bucket"""
+        return 1 / self._requests_per_second
+
+    @property
+    def pool_size(self) -> int:
+        return self._pool_size
+
+    @property
+    def requests_per_second(self) -> float:
+        return self._requests_per_second
+
+    def level(self) -> float:
+        """How many requests are in the local bucket right now"""
+        now = time.monotonic()
+        return max(self._state["empty_at"] - now, 0) / self._emission_interval
+
+    def wait_time(self) -> float:
+        """How long the next request would have to wait,
+        judging by the local bucket"""
+        return max(self.level() - (self._pool_size - 1), 0) * self._emission_interval
+
+    def saturated(self) -> bool:
+        """Whether the next request will have to wait"""
+        return self.wait_time() > 0
+
+    def set_limits(self, pool_size: int, requests_per_second: float):
+        """Change the bucket size and the leak rate, keeping
+        the requests that are already in the bucket"""
+        level = self.level()
+        self._pool_size = pool_size
+        self._requests_per_second = requests_per_second
+
+        if level:
+            self._state["empty_at"] = time.monotonic() + level * self._emission_interval
 
     @contextlib.asynccontextmanager
     async def acquire(self):
         """A context manager that will wait until it's safe to make the next request"""
-        await asyncio.sleep(self._calculate_needed_sleep_time())
+        sleep_time = await self._update_state(self._reserve)
 
         try:
-            yield
-        finally:
-            self._remove_stale_records()
+            await asyncio.sleep(sleep_time)
+        except asyncio.CancelledError:
+            # the request has not been sent, so its place in the bucket
+            # can be given away to the next consumer
+            await self._update_state(self._refund)
+            raise
 
-    def _calculate_needed_sleep_time(self) -> float:
-        """How much time to sleep before it's safe to make a request"""
-        while len(self._request_history) >= self._pool_size:
-            time_from_last_request = time.monotonic() - self._request_history[0]
-            time_to_wait = 1 / self._requests_per_second - time_from_last_request
-            if time_to_wait > 0:
-                return time_to_wait
-            else:
-                break
-        return 0
+        yield
+
+    async def _update_state(self, func):
+        """Apply `func(state, now)` to the local or shared state"""
+        if not self._backend:
+            return func(self._state, time.monotonic())
+
+        async with self._backend.transaction(self._key) as state:
+            now = self._backend.now()
+            for _ in range(self._unsynced_records):
+                self._reserve(state, now)
+            self._unsynced_records = 0
+
+            return func(state, now)
+
+    def _reserve(self, state: dict, now: float) -> float:
+        """Put a request into the bucket and return how much time to sleep
+        before it's safe to send it"""
+        empty_at = max(state.get("empty_at", 0.0), now)
+        state["empty_at"] = empty_at + self._emission_interval
+
+        departure = empty_at - (self._pool_size - 1) * self._emission_interval
+        return max(departure - now, 0)
+
+    def _refund(self, state: dict, now: float):
+        """Take back a request that was reserved but never sent"""
+        state["empty_at"] = state.get("empty_at", 0.0) - self._emission_interval
+
+    def dump_state(self) -> dict:
+        """Snapshot of the bucket with times relative to now,
+        so that it can be restored in another process"""
+        now = time.monotonic()
+        return {"empty_in": max(self._state["empty_at"] - now, 0)}
+
+    def load_state(self, state: dict, elapsed: float = 0):
+        """Restore the bucket from `dump_state()` taken `elapsed` seconds ago"""
+        empty_in = max(state.get("empty_in", 0) - elapsed, 0)
+        self._state["empty_at"] = time.monotonic() + empty_in if empty_in else 0.0
 
     def add_request_record(self):
-        """Register when the last request was made"""
-        self._request_history.appendleft(time.monotonic())
+        """Register a request that was made without calling `acquire()`,
+        e.g. by code that talks to the portal directly.
 
-    def _remove_stale_records(self):
-        """Remove all stale records from the record register"""
-        cut_off = time.monotonic() - self._pool_size / self._requests_per_second
-        while self._request_history and self._request_history[-1] < cut_off:
-            self._request_history.pop()
+        With a backend, the request is written to the shared state
+        on the next `acquire()` of this throttler."""
+        if self._backend:
+            self._unsynced_records += 1
+        else:
+            self._reserve(self._state, time.monotonic())
+
+
+class ConcurrencyThrottler:
+    """The class limits how many requests may run at the same time.
+
+    When the consumer has hit the limit, he will have to wait
+    until one of the running requests is complete.
+    """
+
+    def __init__(self, max_concurrent_requests: int):
+        self._max_concurrent_requests = max_concurrent_requests
+        self._running = 0
+        self._request_complete = LoopBoundEvent()
+
+    def saturated(self) -> bool:
+        """Whether the next request will have to wait"""
+        return self._running >= self._max_concurrent_requests
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """A context manager that will wait until it's safe to make the next request"""
+        while self.saturated():
+            self._request_complete.clear()
+            await self._request_complete.wait()
+
+        self.reserve()
+
+        try:
+            yield
+        finally:
+            self.release()
+
+    def reserve(self):
+        """Occupy a slot right away, e.g. after checking `saturated()`.
+        The slot must be given back with `release()`"""
+        self._running += 1
+
+    def release(self):
+        self._running -= 1
+        self._request_complete.set()
@@ -1,3 +1,7 @@
+import asyncio
+import datetime
+import hashlib
+import math
 import pickle
 import re
 import warnings
@@ -6,13 +10,24 @@ from collections import ChainMap
 import icontract
 from beartype import beartype
 from beartype.typing import Any, Dict, Iterable, Union
+from more_itertools import chunked
 
+from .duplicates import (
+    COMMUNICATION_TYPES,
+    FINDBYCOMM_MAX_VALUES,
+    NegativeCache,
+    normalize_communication,
+)
+from .filters import filter_covers
+from .logger import logger
 from .mult_request import (
     MultipleServerRequestHandler,
     MultipleServerRequestHandlerPreserveIDs,
 )
+from .partial import PartialList, PartialTuple, make_partial
 from .server_response import ServerResponseParser
-from .srh import ServerRequestHandler
+from .srh import DeadlineExceeded, ServerRequestHandler
+from .task_group import TaskGroup
 from .utils import get_warning_stack_level
 
 
@@ -25,13 +40,51 @@ TOP_MOST_LIBRARY_MODULES = [
     "fast_bitrix24/logger",
 ]
 
-# методы, возвращающие только списки
-GET_ALL_ENDINGS = (".list", ".getlist", ".fields", ".getavaliableforpayment", ".types")
+# метод, страницы которого перебираются по `NAV_PARAMS`, а не по `start`
+ELAPSED_ITEMS_METHOD = "tasks.elapseditem.getlist"
+
+# способы получения сущностей в `get_by_ID()`
+GET_BY_ID_STRATEGIES = ("get", "list")
+
+# метод поиска дубликатов по средствам связи
+FINDBYCOMM_METHOD = "crm.duplicate.findbycomm"
+
 
-# методы, возвращающие как списки, так и отдельные сущности
-AMBIGUOUS_ENDINGS = (".get",)
+def warning_stack_level() -> int:
+    """`stacklevel` для предупреждения, выдаваемого вызвавшей функцией,
+    указывающий на код пользователя.
 
-ALL_ENDINGS = (*GET_ALL_ENDINGS, *AMBIGUOUS_ENDINGS)
+    Запросы, которые клиент выполняет в отдельных задачах (группы полей
+    `select_groups`, фильтры `get_all_any()` и т.п.), вызваны не из модулей
+    клиента - тогда предупреждение указывает на саму вызвавшую функцию."""
+
+    try:
+        # без кадра этой функции
+        return get_warning_stack_level(TOP_MOST_LIBRARY_MODULES) - 1
+    except ValueError:
+        return 1
+
+
+def warn_partial_results(missing: list):
+    warnings.warn(
+        f"Deadline exceeded: returning partial results, {len(missing)} items "
+        "are missing. See the 'missing' attribute of the results.",
+        RuntimeWarning,
+        stacklevel=warning_stack_level(),
+    )
+
+
+def as_datetime(value: Union[datetime.date, str]) -> datetime.datetime:
+    """Переводит дату, дату и время или строку в формате ISO
+    в `datetime.datetime`."""
+
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.strip())
+
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+
+    return value
 
 
 class UserRequestAbstract:
@@ -50,6 +103,9 @@ class UserRequestAbstract:
         self.method = method
         self.st_method = self.standardized_method(method)
 
+        # сведения о методе из реестра методов клиента
+        self.info = self.srh.method_registry.get(self.st_method)
+
         # st_params будет использоваться для проверки параметров,
         # но на сервер должны уходить параметры без изменения регистра
         self.params = params.copy() if params else {}
@@ -91,7 +147,7 @@ class UserRequestAbstract:
                 "Using None as filter value confuses Bitrix. "
                 "Try using an empty string, 'null' or 'false'.",
                 UserWarning,
-                stacklevel=get_warning_stack_level(TOP_MOST_LIBRARY_MODULES),
+                stacklevel=warning_stack_level(),
             )
 
         return p
@@ -133,7 +189,10 @@ class UserRequestAbstract:
 
     async def run(self):
         response = await self.srh.single_request(self.method, self.params)
-        return ServerResponseParser(response).extract_results()
+        return self.parser(response).extract_results()
+
+    def parser(self, response: dict) -> ServerResponseParser:
+        return ServerResponseParser(response, result_key=self.info.result_key)
 
 
 class GetAllUserRequest(UserRequestAbstract):
@@ -144,25 +203,25 @@ class GetAllUserRequest(UserRequestAbstract):
     )
     @icontract.require(
         lambda self: not self.st_method.startswith("tasks.elapseditem."),
-        "get_all() shouldn't be used with 'tasks.elapseditem.*' method group. "
-        "Use call(raw=True) instead. Read more: "
+        "get_all() shouldn't be used with 'tasks.elapseditem.*' method group "
+        f"except '{ELAPSED_ITEMS_METHOD}'. Use call(raw=True) instead. Read more: "
         "https://github.com/leshchenko1979/fast_bitrix24/issues/199",
     )
     def check_special_limitations(self):
-        if not self.st_method.endswith(ALL_ENDINGS):
+        if self.info.returns_list is False:
             warnings.warn(
-                "get_all() should be used only with methods that end with "
-                f"the following: {ALL_ENDINGS}. You are using '{self.st_method}'. "
+                "get_all() should be used only with methods that return lists "
+                f"(see the method registry). You are using '{self.st_method}'. "
                 "Use get_by_ID() or call() instead.",
                 UserWarning,
-                stacklevel=get_warning_stack_level(TOP_MOST_LIBRARY_MODULES),
+                stacklevel=warning_stack_level(),
             )
 
         if self.st_params and "LIMIT" in self.st_params:
             warnings.warn(
                 "Bitrix servers don't seem to support the 'LIMIT' parameter.",
                 UserWarning,
-                stacklevel=get_warning_stack_level(TOP_MOST_LIBRARY_MODULES),
+                stacklevel=warning_stack_level(),
             )
 
         if (
@@ -175,7 +234,7 @@ class GetAllUserRequest(UserRequestAbstract):
                 "You are selecting all fields and no filter. Beware that this is time-consuming and "
                 "may lead to penalties from the Bitrix server.",
                 UserWarning,
-                stacklevel=get_warning_stack_level(TOP_MOST_LIBRARY_MODULES),
+                stacklevel=warning_stack_level(),
             )
 
         return True
@@ -183,12 +242,24 @@ class GetAllUserRequest(UserRequestAbstract):
     async def run(self):
         self.add_order_parameter()
 
-        await self.make_first_request()
+        # страницы, которые не успели получить до истечения срока операции
+        self.missing = []
+
+        try:
+            await self.make_first_request()
+        except DeadlineExceeded:
+            self.missing = [{"start": 0}]
+            warn_partial_results(self.missing)
+            return PartialList([], self.missing)
 
         if self.first_response.more_results_expected():
             await self.make_remaining_requests()
             self.dedup_results()
 
+        if self.missing:
+            warn_partial_results(self.missing)
+            return PartialList(self.results, self.missing)
+
         return self.results
 
     def add_order_parameter(self):
@@ -196,16 +267,7 @@ class GetAllUserRequest(UserRequestAbstract):
         # будет рандомная и сущности будут повторяться на разных страницах
 
         # ряд методов не признают параметра "order", для таких ничего не делаем
-        EXCLUDED_METHODS = {
-            "crm.address.list",
-            "documentgenerator.template.list",
-            "userfieldconfig.list",
-            "voximplant.statistic.get",
-            "crm.deal.userfield.list",
-            "task.elapseditem.getlist"
-        }
-
-        if self.st_method in EXCLUDED_METHODS:
+        if not self.info.supports_order:
             return
 
         order_clause = {"order": {"ID": "ASC"}}
@@ -217,29 +279,139 @@ class GetAllUserRequest(UserRequestAbstract):
             self.params = order_clause
 
     async def make_first_request(self):
-        self.first_response = ServerResponseParser(
+        self.first_response = self.parser(
             await self.srh.single_request(self.method, self.params)
         )
         self.total = self.first_response.total
         self.results = self.first_response.extract_results()
 
+    async def iter_pages(self, max_pending_batches: int = None):
+        """Отдает результаты по мере получения: сначала первую страницу,
+        затем результаты каждого батча, без повторов.
+
+        Если метод возвращает не список, то отдается одна "страница"
+        с этим результатом."""
+
+        self.add_order_parameter()
+        await self.make_first_request()
+
+        if not isinstance(self.results, list):
+            yield [self.results]
+            return
+
+        # для отсева повторов хранятся только хэши полученных сущностей
+        seen = set()
+        yield self.unseen(self.results, seen)
+
+        if not self.first_response.more_results_expected():
+            return
+
+        handler = MultipleServerRequestHandler(
+            self.bitrix,
+            method=self.method,
+            item_list=self.remaining_item_list(),
+            mute=True,
+            max_tasks=max_pending_batches,
+        )
+
+        async for response in handler.iter_responses():
+            page = self.unseen(self.parser(response).extract_results(), seen)
+            if page:
+                yield page
+
+    @staticmethod
+    def unseen(results: list, seen: set) -> list:
+        """Сущности из `results`, хэшей которых нет в `seen`.
+        Хэши отданных сущностей добавляются в `seen`."""
+
+        page = []
+        for item in results:
+            key = hashlib.blake2b(pickle.dumps(item), digest_size=16).digest()
+            if key not in seen:
+                seen.add(key)
+                page.append(item)
+
+        return page
+
+    async def fetch_pages(self, page_params: dict) -> dict:
+        """Запрашивает страницы `{ключ: параметры}` и возвращает
+        `{ключ: (сущности, total)}`.
+
+        Страницы, не полученные до истечения срока операции,
+        в результат не попадают."""
+
+        return {
+            key: (records, total)
+            async for key, records, total in self.iter_fetched_pages(page_params)
+        }
+
+    async def iter_fetched_pages(self, page_params: dict):
+        """Как `fetch_pages()`, но отдает тройки (ключ, сущности, total)
+        по мере получения батчей."""
+
+        if not page_params:
+            return
+
+        labels = {f"page{i:010}": key for i, key in enumerate(page_params)}
+
+        handler = MultipleServerRequestHandlerPreserveIDs(
+            self.bitrix,
+            self.method,
+            [
+                ChainMap({"__page": label}, page_params[key])
+                for label, key in labels.items()
+            ],
+            ID_field="__page",
+            get_by_ID=False,
+        )
+
+        try:
+            async for response in handler.iter_responses():
+                # ответы разбираются по меткам команд: кроме сущностей,
+                # нужен `total` каждой команды
+                parser = self.parser(response)
+                parser.raise_for_errors()
+                totals = parser.result.get("result_total") or {}
+
+                for label, result in (parser.result["result"] or {}).items():
+                    yield (
+                        labels[label],
+                        parser.extract_from_single_response(result),
+                        totals.get(label),
+                    )
+
+        except DeadlineExceeded:
+            pass
+
+    def remaining_item_list(self) -> list:
+        return [
+            ChainMap({"start": start}, self.params)
+            for start in range(len(self.results), self.total, self.info.page_size)
+        ]
+
     @icontract.require(lambda self: isinstance(self.results, list))
     async def make_remaining_requests(self):
-        item_list = list(
-            ChainMap({"start": start}, self.params)
-            for start in range(len(self.results), self.total, BITRIX_PAGE_SIZE)
-        )
+        item_list = self.remaining_item_list()
 
         expected_remaining = self.total - len(self.results)
 
-        remaining_results = await MultipleServerRequestHandler(
+        handler = MultipleServerRequestHandler(
             self.bitrix,
             method=self.method,
             item_list=item_list,
             real_len=self.total,
             real_start=len(self.results),
             mute=self.mute,
-        ).run()
+        )
+        remaining_results = await handler.run()
+
+        self.missing = [{"start": item["start"]} for item in handler.missing]
+        if self.missing:
+            # получены не все страницы, и предупреждения о нехватке
+            # результатов ниже только запутают
+            if remaining_results:
+                self.results.extend(remaining_results)
+            return
 
         # More conservative validation to avoid false positives
         if not remaining_results and expected_remaining > 0:
@@ -252,7 +424,7 @@ class GetAllUserRequest(UserRequestAbstract):
                     f"rate limiting, or data changes during pagination. "
                     f"If this is unexpected, try reducing batch_size or request_pool_size.",
                     RuntimeWarning,
-                    stacklevel=get_warning_stack_level(TOP_MOST_LIBRARY_MODULES),
+                    stacklevel=warning_stack_level(),
                 )
         elif isinstance(remaining_results, list) and len(remaining_results) < expected_remaining:
             # Only warn for severe discrepancies (> 50% missing) on large datasets
@@ -265,7 +437,7 @@ class GetAllUserRequest(UserRequestAbstract):
                     f"Missing {shortage} items. This may indicate batch request failures, "
                     f"data changes during pagination, or permission restrictions.",
                     RuntimeWarning,
-                    stacklevel=get_warning_stack_level(TOP_MOST_LIBRARY_MODULES),
+                    stacklevel=warning_stack_level(),
                 )
 
         if remaining_results:
@@ -282,14 +454,972 @@ class GetAllUserRequest(UserRequestAbstract):
             else []
         )
 
-        if len(self.results) != self.total:
+        if len(self.results) != self.total and not self.missing:
             warnings.warn(
                 f"Number of results returned ({len(self.results)}) "
                 f"doesn't equal 'total' from the server reply ({self.total})",
                 RuntimeWarning,
-                stacklevel=get_warning_stack_level(TOP_MOST_LIBRARY_MODULES),
+                stacklevel=warning_stack_level(),
+            )
+
+
+class GetAllElapsedItemsUserRequest(GetAllUserRequest):
+    """`get_all()` для метода `tasks.elapseditem.getlist`.
+
+    Метод принимает параметры `ORDER`, `FILTER`, `SELECT` и `PARAMS`
+    и перебирает страницы не по `start`, а по `PARAMS[NAV_PARAMS]`
+    (`nPageSize`, `iNumPage`). Первая страница запрашивается отдельно,
+    остальные - батчами параллельно: если сервер сообщил `total`,
+    то все сразу, иначе - волнами, пока не встретится неполная страница
+    или страница из одних повторов (номера после последней страницы
+    сервер может заменять последней)."""
+
+    @icontract.require(
+        lambda self: not (
+            self.st_params
+            and isinstance(self.st_params.get("PARAMS"), dict)
+            and "NAV_PARAMS" in self.st_params["PARAMS"]
+        ),
+        "get_all(): 'NAV_PARAMS' for tasks.elapseditem.getlist are set automatically",
+    )
+    def check_special_limitations(self):
+        return True
+
+    def add_order_parameter(self):
+        # без сортировки записи повторяются на разных страницах
+        if not (self.st_params and "ORDER" in self.st_params):
+            self.params["ORDER"] = {"ID": "asc"}
+
+    def page_params(self, page: int) -> dict:
+        params_key = next(
+            (key for key in self.params if key.upper().strip() == "PARAMS"), "PARAMS"
+        )
+
+        return {
+            **self.params,
+            params_key: {
+                **self.params.get(params_key, {}),
+                "NAV_PARAMS": {"nPageSize": self.info.page_size, "iNumPage": page},
+            },
+        }
+
+    async def run(self) -> list:
+        results = []
+
+        # страницы, которые запрошены, но еще не получены
+        self.pending_pages = {1}
+
+        try:
+            async for page in self.iter_pages():
+                results.extend(page)
+
+        except DeadlineExceeded:
+            missing = [{"iNumPage": page} for page in sorted(self.pending_pages)]
+            warn_partial_results(missing)
+            return PartialList(results, missing)
+
+        return results
+
+    async def iter_pages(self, max_pending_batches: int = None):
+        """Отдает записи по мере получения страниц, без повторов."""
+
+        self.add_order_parameter()
+        self.pending_pages = {1}
+
+        first_response = self.parser(
+            await self.srh.single_request(self.method, self.page_params(1))
+        )
+        records = first_response.extract_results()
+        self.pending_pages.clear()
+
+        seen = set()
+        yield self.unseen(records, seen)
+
+        total = first_response.total
+        next_page = 2
+        more_pages = len(records) >= self.info.page_size
+
+        # без `total` волны растут вдвое, пока не займут все слоты запросов:
+        # лишних страниц после последней запрашивается не больше,
+        # чем уже получено
+        wave = self.bitrix.batch_size
+
+        while more_pages:
+            if total:
+                pages = range(next_page, math.ceil(total / self.info.page_size) + 1)
+                more_pages = False
+            else:
+                pages = range(next_page, next_page + wave)
+                wave = min(
+                    wave * 2,
+                    self.bitrix.batch_size * max(int(self.srh.mcr_cur_limit), 1),
+                )
+
+            self.pending_pages.update(pages)
+
+            async for page, records in self.iter_page_records(
+                pages, max_pending_batches
+            ):
+                self.pending_pages.discard(page)
+
+                new_records = self.unseen(records, seen)
+                if len(records) < self.info.page_size or not new_records:
+                    more_pages = False
+
+                if new_records:
+                    yield new_records
+
+            next_page = pages.stop
+
+    async def iter_page_records(self, pages: range, max_pending_batches: int = None):
+        """Отдает пары (номер страницы, записи) по мере получения."""
+
+        labels = {f"page{page:010}": page for page in pages}
+
+        handler = MultipleServerRequestHandlerPreserveIDs(
+            self.bitrix,
+            self.method,
+            [
+                ChainMap({"__page": label}, self.page_params(page))
+                for label, page in labels.items()
+            ],
+            ID_field="__page",
+            get_by_ID=False,
+            max_tasks=max_pending_batches,
+        )
+
+        async for response in handler.iter_responses():
+            parser = self.parser(response)
+            parser.raise_for_errors()
+
+            for label, result in (parser.result["result"] or {}).items():
+                yield labels[label], parser.extract_from_single_response(result)
+
+
+class GetAllBySelectGroupsUserRequest(GetAllUserRequest):
+    """`get_all()`, в котором широкий `select` делится на группы полей.
+
+    Каждая группа запрашивается отдельным `get_all()` с тем же фильтром
+    и сортировкой по ID, все группы - одновременно, через общие батчи.
+    Результаты групп объединяются по ID. Поля распределяются по группам
+    так, чтобы группы были примерно равны по времени обработки на сервере,
+    измеренному на предыдущих запросах.
+
+    Группы листаются независимо друг от друга, поэтому, если сущности
+    добавляются или удаляются во время запроса, страницы разных групп
+    могут сдвинуться друг относительно друга. Сущность, которую вернули
+    не все группы, содержит поля только вернувших ее групп."""
+
+    @beartype
+    def __init__(
+        self,
+        bitrix,
+        method: str,
+        params: Union[Dict[str, Any], None],
+        select_groups: int,
+        mute=False,
+    ):
+        self.select_groups = select_groups
+        super().__init__(bitrix, method, params, mute)
+
+    @icontract.require(
+        lambda self: self.select_groups >= 1,
+        "get_all(): 'select_groups' should be a positive number",
+    )
+    def check_special_limitations(self):
+        return super().check_special_limitations()
+
+    async def run(self):
+        self.select_key = next(
+            (key for key in self.params if key.upper().strip() == "SELECT"), None
+        )
+
+        groups = self.partition(await self.selected_fields())
+        if len(groups) < 2:
+            return await super().run()
+
+        requests = [
+            GetAllUserRequest(
+                self.bitrix,
+                self.method,
+                {**self.params, self.select_key: [self.info.id_field, *group]},
+                mute=True,
+            )
+            for group in groups
+        ]
+
+        async with TaskGroup() as task_group:
+            results = await asyncio.gather(
+                *(task_group.create_task(request.run()) for request in requests)
+            )
+
+        self.record_field_costs(requests, groups)
+
+        return self.joined(results, self.info.id_field)
+
+    async def selected_fields(self) -> list:
+        """Поля из `select`, где `*` и `UF_*` заменены полями сущности
+        (пустой список, если `select` нельзя разделить)."""
+
+        if (
+            self.select_groups < 2
+            or self.select_key is None
+            or not self.st_method.endswith(".list")
+        ):
+            return []
+
+        select = list(self.params[self.select_key])
+
+        if "*" in select or "UF_*" in select:
+            # методу `.fields` передаются параметры, задающие сущность
+            # (например, `entityTypeId` у `crm.item.list`)
+            fields_method = self.method.strip()[: -len(".list")] + ".fields"
+            response = await self.srh.single_request(
+                fields_method,
+                {
+                    key: value
+                    for key, value in self.params.items()
+                    if key.upper().strip() not in ("SELECT", "FILTER", "ORDER")
+                },
+            )
+            described = ServerResponseParser(
+                response,
+                result_key=self.srh.method_registry.get(fields_method).result_key,
+            ).extract_results()
+            if not isinstance(described, dict):
+                return []
+
+        fields = []
+        for field in select:
+            if field == "*":
+                # множественные поля (телефоны, почта) `*` не выбирает
+                fields.extend(
+                    name
+                    for name, info in described.items()
+                    if not is_user_field(name, info)
+                    and not (
+                        isinstance(info, dict) and info.get("type") == "crm_multifield"
+                    )
+                )
+            elif field == "UF_*":
+                fields.extend(
+                    name
+                    for name, info in described.items()
+                    if is_user_field(name, info)
+                )
+            else:
+                fields.append(field)
+
+        # ID запрашивается в каждой группе
+        return [
+            field for field in dict.fromkeys(fields) if field != self.info.id_field
+        ]
+
+    def partition(self, fields: list) -> list:
+        """Распределяет `fields` по `self.select_groups` группам,
+        примерно равным по измеренному времени обработки полей."""
+
+        if not fields:
+            return []
+
+        measured = {
+            field: self.srh.field_costs.cost(self.st_method, field) for field in fields
+        }
+        known = [cost for cost in measured.values() if cost is not None]
+
+        # поля, время которых еще не измерялось, считаются средними
+        default = sum(known) / len(known) if known else 1.0
+        costs = {
+            field: default if cost is None else cost for field, cost in measured.items()
+        }
+
+        groups = [[] for _ in range(min(self.select_groups, len(fields)))]
+        totals = [0.0] * len(groups)
+
+        # самые дорогие поля распределяются первыми, каждое - в самую легкую группу
+        for field in sorted(fields, key=costs.get, reverse=True):
+            lightest = totals.index(min(totals))
+            groups[lightest].append(field)
+            totals[lightest] += costs[field]
+
+        return groups
+
+    def record_field_costs(self, requests: list, groups: list):
+        # время обработки первой страницы каждой группы - это время
+        # ее полей на одних и тех же сущностях
+        for request, group in zip(requests, groups):
+            first_response = getattr(request, "first_response", None)
+            if first_response is None:
+                continue
+
+            time = first_response.response.get("time") or {}
+            seconds = time.get("processing") or time.get("duration")
+            if seconds:
+                self.srh.field_costs.add(self.st_method, group, seconds)
+
+    @staticmethod
+    def joined(results: list, id_field: str) -> list:
+        """Объединяет результаты групп по ID сущностей."""
+
+        records = {}
+        for result in results:
+            for record in result:
+                records.setdefault(str(record[id_field]), {}).update(record)
+
+        joined = list(records.values())
+
+        # группы получают одни и те же страницы, поэтому неполученные
+        # страницы разных групп объединяются без повторов
+        missing = []
+        for result in results:
+            for page in getattr(result, "missing", ()):
+                if page not in missing:
+                    missing.append(page)
+
+        if missing:
+            return PartialList(joined, missing)
+
+        return joined
+
+
+class GetAllAnyUserRequest(GetAllUserRequest):
+    """Сущности, подходящие хотя бы под один из фильтров `filters`
+    (фильтры Битрикс24 не позволяют задать "ИЛИ" по разным полям).
+
+    Каждый фильтр запрашивается отдельным `get_all()`, все - одновременно,
+    через общие батчи. Результаты объединяются без повторов по мере
+    завершения запросов. Фильтры, охват которых доказуемо покрыт
+    другими фильтрами, не запрашиваются.
+
+    Результат фильтра объединяется с остальными только после получения
+    всех его страниц, поэтому до завершения запросов в памяти могут быть
+    и повторы - сущности, подходящие под несколько фильтров."""
+
+    @beartype
+    def __init__(
+        self,
+        bitrix,
+        method: str,
+        filters: Iterable[Dict[str, Any]],
+        params: Union[Dict[str, Any], None] = None,
+        mute=False,
+    ):
+        self.filters = list(filters)
+        super().__init__(bitrix, method, params, mute)
+
+    @icontract.require(
+        lambda self: self.filters, "get_all_any(): 'filters' can't be empty"
+    )
+    @icontract.require(
+        lambda self: not (self.st_params and "FILTER" in self.st_params)
+        or all(
+            set(self.st_params["FILTER"]).isdisjoint(sub_filter)
+            for sub_filter in self.filters
+        ),
+        "get_all_any(): 'filters' shouldn't repeat conditions of the 'params' filter",
+    )
+    def check_special_limitations(self):
+        return super().check_special_limitations()
+
+    async def run(self) -> list:
+        filter_key = next(
+            (key for key in self.params if key.upper().strip() == "FILTER"), "filter"
+        )
+        base_filter = self.params.get(filter_key, {})
+
+        self.add_ID_to_select()
+
+        records = {}
+        missing = []
+
+        async with TaskGroup() as task_group:
+            tasks = {
+                task_group.create_task(
+                    GetAllUserRequest(
+                        self.bitrix,
+                        self.method,
+                        {**self.params, filter_key: {**base_filter, **sub_filter}},
+                        mute=True,
+                    ).run()
+                ): sub_filter
+                for sub_filter in self.necessary_filters()
+            }
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for task in done:
+                    result = task.result()
+                    self.merge(records, result)
+                    missing.extend(
+                        {"filter": tasks[task], **page}
+                        for page in getattr(result, "missing", ())
+                    )
+
+        results = list(records.values())
+
+        if missing:
+            return PartialList(results, missing)
+
+        return results
+
+    def necessary_filters(self) -> list:
+        """Фильтры, охват которых не покрыт другими фильтрами.
+
+        Из одинаковых фильтров остается первый."""
+
+        necessary = []
+
+        for i, narrow in enumerate(self.filters):
+            covered = any(
+                filter_covers(broad, narrow)
+                and (j < i or not filter_covers(narrow, broad))
+                for j, broad in enumerate(self.filters)
+                if j != i
+            )
+
+            if covered:
+                logger.debug(
+                    "Filter is covered by others, skipping: {'filter': %s}", narrow
+                )
+            else:
+                necessary.append(narrow)
+
+        return necessary
+
+    def add_ID_to_select(self):
+        # повторы отсеиваются по ID, поэтому он должен быть в результатах
+        select_key = next(
+            (key for key in self.params if key.upper().strip() == "SELECT"), None
+        )
+        if select_key is None:
+            return
+
+        select = list(self.params[select_key])
+        if "*" not in select and self.info.id_field not in select:
+            self.params[select_key] = [*select, self.info.id_field]
+
+    def merge(self, records: dict, results: list):
+        """Добавляет в `records` сущности из `results`, которых там еще нет."""
+
+        for record in results:
+            ID = record.get(self.info.id_field)
+            key = (
+                str(ID)
+                if ID is not None
+                else hashlib.blake2b(pickle.dumps(record), digest_size=16).digest()
+            )
+            records.setdefault(key, record)
+
+
+class GetAllByDateRangeUserRequest(GetAllUserRequest):
+    """`get_all()`, разбивающий диапазон значений поля-даты на окна.
+
+    Нужен для методов, которые нельзя надежно перебирать постранично,
+    потому что они не принимают сортировку по ID: в небольшом окне
+    страниц мало, и все окна запрашиваются одновременно. Окно, в которое
+    попало больше `window_pages` страниц, делится на части, пока это
+    возможно (окна короче секунды не делятся)."""
+
+    @beartype
+    def __init__(
+        self,
+        bitrix,
+        method: str,
+        field: str,
+        date_from: Union[datetime.date, str],
+        date_to: Union[datetime.date, str],
+        params: Union[Dict[str, Any], None] = None,
+        window_pages: int = 2,
+        mute=False,
+    ):
+        self.field = field.strip()
+        self.date_from = as_datetime(date_from)
+        self.date_to = as_datetime(date_to)
+        self.window_pages = window_pages
+        super().__init__(bitrix, method, params, mute)
+
+    @icontract.require(
+        lambda self: self.date_from < self.date_to,
+        "get_all_by_date_range(): 'date_from' should be earlier than 'date_to'",
+    )
+    @icontract.require(
+        lambda self: self.window_pages >= 1,
+        "get_all_by_date_range(): 'window_pages' should be a positive number",
+    )
+    @icontract.require(
+        lambda self: not (self.st_params and "FILTER" in self.st_params)
+        or all(
+            re.sub(r"^[=!<>@%]+", "", key).upper() != self.field.upper()
+            for key in self.st_params["FILTER"]
+        ),
+        "get_all_by_date_range(): 'params' filter shouldn't contain the date field",
+    )
+    def check_special_limitations(self):
+        return super().check_special_limitations()
+
+    async def run(self) -> list:
+        self.add_order_parameter()
+
+        self.filter_key = next(
+            (key for key in self.params if key.upper().strip() == "FILTER"), "filter"
+        )
+
+        capacity = self.window_pages * self.info.page_size
+        seen = set()
+        results = []
+        missing = []
+
+        # окна, первые страницы которых нужно запросить,
+        # и остальные страницы окон, которые делить не нужно
+        windows = [(self.date_from, self.date_to)]
+        remaining = {}
+
+        while windows or remaining:
+            first_pages = {
+                (window, 0): self.window_params(window, 0) for window in windows
+            }
+            pages = await self.fetch_pages({**first_pages, **remaining})
+
+            for key in remaining:
+                if key in pages:
+                    results.extend(self.unseen(pages[key][0], seen))
+                else:
+                    missing.append(self.window_page(*key))
+
+            next_windows = []
+            remaining = {}
+
+            for window in windows:
+                if (window, 0) not in pages:
+                    missing.append(self.window_page(window, 0))
+                    continue
+
+                records, total = pages[(window, 0)]
+
+                if total and total > capacity:
+                    parts = self.split(window, math.ceil(total / capacity))
+                    if len(parts) > 1:
+                        logger.debug(
+                            "Splitting a date window: {'window': %s, 'total': %s}",
+                            window,
+                            total,
+                        )
+                        next_windows.extend(parts)
+                        continue
+
+                results.extend(self.unseen(records, seen))
+
+                for start in range(len(records), total or 0, self.info.page_size):
+                    remaining[(window, start)] = self.window_params(window, start)
+
+            windows = next_windows
+
+        if missing:
+            warn_partial_results(missing)
+            return PartialList(results, missing)
+
+        return results
+
+    def window_params(self, window: tuple, start: int) -> dict:
+        date_from, date_to = window
+        user_filter = self.params.get(self.filter_key, {})
+
+        return {
+            **self.params,
+            "start": start,
+            self.filter_key: {
+                **user_filter,
+                f">={self.field}": date_from.isoformat(),
+                f"<{self.field}": date_to.isoformat(),
+            },
+        }
+
+    @staticmethod
+    def window_page(window: tuple, start: int) -> dict:
+        date_from, date_to = window
+        return {
+            "from": date_from.isoformat(),
+            "to": date_to.isoformat(),
+            "start": start,
+        }
+
+    @staticmethod
+    def split(window: tuple, parts: int) -> list:
+        """Делит окно на `parts` равных частей с границами
+        по целым секундам."""
+
+        date_from, date_to = window
+        step = (date_to - date_from) / parts
+
+        bounds = sorted(
+            {
+                date_from,
+                date_to,
+                *(
+                    (date_from + step * i).replace(microsecond=0)
+                    for i in range(1, parts)
+                ),
+            }
+        )
+        bounds = [bound for bound in bounds if date_from <= bound <= date_to]
+
+        return list(zip(bounds, bounds[1:]))
+
+
+class GetByFilterInUserRequest(GetAllUserRequest):
+    @beartype
+    def __init__(
+        self,
+        bitrix,
+        method: str,
+        field: str,
+        values: Iterable,
+        params: Union[Dict[str, Any], None] = None,
+        group_by_value: bool = False,
+        mute=False,
+    ):
+        self.field = field.strip()
+
+        # повторяющиеся значения запрашиваются один раз
+        self.values = list(dict.fromkeys(values))
+
+        self.group_by_value = group_by_value
+        super().__init__(bitrix, method, params, mute)
+
+    @icontract.require(
+        lambda self: self.values, "get_by_filter_in(): 'values' can't be empty"
+    )
+    @icontract.require(
+        lambda self: not (
+            self.st_params
+            and "FILTER" in self.st_params
+            and self.field in self.st_params["FILTER"]
+        ),
+        "get_by_filter_in(): 'params' filter shouldn't contain 'field'",
+    )
+    def check_special_limitations(self):
+        return super().check_special_limitations()
+
+    async def run(self) -> Union[list, dict]:
+        self.add_order_parameter()
+
+        self.filter_key = next(
+            (key for key in self.params if key.upper().strip() == "FILTER"), "filter"
+        )
+
+        if self.group_by_value:
+            self.add_field_to_select()
+
+        chunks = list(chunked(self.values, BITRIX_PAGE_SIZE))
+
+        # первые страницы всех частей списка значений
+        pages = await self.fetch_pages(
+            {(i, 0): self.chunk_params(chunk, 0) for i, chunk in enumerate(chunks)}
+        )
+
+        # остальные страницы тех частей, которым не хватило одной
+        remaining = {
+            (i, start): self.chunk_params(chunks[i], start)
+            for (i, _), (records, total) in pages.items()
+            if total and total > len(records)
+            for start in range(len(records), total, self.info.page_size)
+        }
+        pages.update(await self.fetch_pages(remaining))
+
+        # части, не все страницы которых получены до истечения срока
+        incomplete = {i for i in range(len(chunks)) if (i, 0) not in pages}
+        incomplete.update(i for i, start in remaining if (i, start) not in pages)
+
+        results = self.unseen(
+            [record for key in sorted(pages) for record in pages[key][0]], set()
+        )
+
+        if self.group_by_value:
+            results = self.grouped(results)
+
+        if incomplete:
+            missing = [value for i in sorted(incomplete) for value in chunks[i]]
+            warn_partial_results(missing)
+            return make_partial(results, missing)
+
+        return results
+
+    def chunk_params(self, values: list, start: int) -> dict:
+        user_filter = self.params.get(self.filter_key, {})
+
+        return {
+            **self.params,
+            "start": start,
+            self.filter_key: {**user_filter, self.field: values},
+        }
+
+    def field_name(self) -> str:
+        # название поля без оператора фильтра ("@OWNER_ID" -> "OWNER_ID")
+        return re.sub(r"^[=!<>@%]+", "", self.field)
+
+    def add_field_to_select(self):
+        # для раскладки по значениям поле должно быть в результатах
+        select_key = next(
+            (key for key in self.params if key.upper().strip() == "SELECT"), None
+        )
+        if select_key is None:
+            return
+
+        select = list(self.params[select_key])
+        if "*" not in select and self.field_name() not in select:
+            self.params[select_key] = [*select, self.field_name()]
+
+    def grouped(self, results: list) -> dict:
+        """Раскладывает сущности по значениям из `self.values`."""
+
+        name = self.field_name()
+        groups = {value: [] for value in self.values}
+        by_str = {str(value): value for value in self.values}
+
+        for record in results:
+            key = next((key for key in record if key.upper() == name.upper()), None)
+            if key is None:
+                raise ValueError(
+                    f"get_by_filter_in(): results of {self.method} "
+                    f"don't contain field '{name}' to group them by"
+                )
+
+            record_values = record[key]
+            if not isinstance(record_values, list):
+                record_values = [record_values]
+
+            for value in record_values:
+                if str(value) in by_str:
+                    groups[by_str[str(value)]].append(record)
+
+        return groups
+
+
+class GetAllExpandedUserRequest(GetAllUserRequest):
+    """`get_all()`, дополняющий сущности связанными сущностями.
+
+    `expand` - словарь {поле с ID связанной сущности: ветка методов},
+    например `{"COMPANY_ID": "crm.company", "ASSIGNED_BY_ID": "user"}`.
+
+    По мере получения страниц основного списка ID из полей `expand`
+    собираются, без повторов, и по заполнении страницы ID запрашиваются
+    через `get_by_ID()` одновременно с остальными страницами списка.
+    Каждая связанная сущность запрашивается один раз за вызов, сколько бы
+    сущностей на нее ни ссылалось."""
+
+    @beartype
+    def __init__(
+        self,
+        bitrix,
+        method: str,
+        params: Union[Dict[str, Any], None],
+        expand: Dict[str, str],
+        mute=False,
+    ):
+        self.expand = {
+            field.strip(): branch.lower().strip() for field, branch in expand.items()
+        }
+        super().__init__(bitrix, method, params, mute)
+
+    @icontract.require(lambda self: self.expand, "get_all(): 'expand' can't be empty")
+    def check_special_limitations(self):
+        return super().check_special_limitations()
+
+    async def run(self) -> list:
+        self.add_order_parameter()
+        self.add_expand_fields_to_select()
+
+        # {ветка методов: {ID: связанная сущность}}
+        self.entities = {branch: {} for branch in self.expand.values()}
+
+        # {ветка методов: ID, которые уже запрошены или ждут запроса}
+        self.requested = {branch: set() for branch in self.expand.values()}
+        self.queued = {branch: [] for branch in self.expand.values()}
+
+        self.missing = []
+
+        async with TaskGroup() as self.lookups:
+            self.lookup_tasks = []
+            results = await self.fetch_records()
+
+            for branch in self.queued:
+                self.flush_lookups(branch, partial=True)
+
+            # ошибки запросов связанных сущностей поднимаются здесь
+            await asyncio.gather(*self.lookup_tasks)
+
+        for record in results:
+            self.attach_entities(record)
+
+        if self.missing:
+            warn_partial_results(self.missing)
+            return PartialList(results, self.missing)
+
+        return results
+
+    async def fetch_records(self) -> list:
+        """Получает все страницы основного списка, запуская запросы
+        связанных сущностей по мере получения страниц."""
+
+        try:
+            await self.make_first_request()
+        except DeadlineExceeded:
+            self.missing.append({"start": 0})
+            return []
+
+        if not isinstance(self.results, list):
+            raise TypeError(
+                f"get_all(expand=...): {self.method} should return a list of entities"
             )
 
+        self.queue_lookups(self.results)
+        pages = {0: self.results}
+
+        starts = range(len(self.results), self.total or 0, self.info.page_size)
+        async for start, records, _ in self.iter_fetched_pages(
+            {start: ChainMap({"start": start}, self.params) for start in starts}
+        ):
+            pages[start] = records
+            self.queue_lookups(records)
+
+        self.missing.extend({"start": start} for start in starts if start not in pages)
+
+        return self.unseen(
+            [record for key in sorted(pages) for record in pages[key]], set()
+        )
+
+    def add_expand_fields_to_select(self):
+        # ID связанных сущностей должны быть в результатах
+        select_key = next(
+            (key for key in self.params if key.upper().strip() == "SELECT"), None
+        )
+        if select_key is None:
+            return
+
+        select = list(self.params[select_key])
+        if "*" not in select:
+            self.params[select_key] = [
+                *select,
+                *(field for field in self.expand if field not in select),
+            ]
+
+    def queue_lookups(self, records: list):
+        """Ставит в очередь запросов ID связанных сущностей из `records`,
+        которые еще не запрашивались."""
+
+        for field, branch in self.expand.items():
+            requested = self.requested[branch]
+
+            for record in records:
+                for ID in self.related_IDs(record, field):
+                    if ID not in requested:
+                        requested.add(ID)
+                        self.queued[branch].append(ID)
+
+            self.flush_lookups(branch)
+
+    def flush_lookups(self, branch: str, partial: bool = False):
+        """Запускает запросы полных страниц ID из очереди `branch`,
+        а если `partial` - то и оставшихся в ней ID."""
+
+        queue = self.queued[branch]
+        size = self.srh.method_registry.get(f"{branch}.get").page_size
+
+        while len(queue) >= size or (partial and queue):
+            IDs, queue[:] = queue[:size], queue[size:]
+            self.lookup_tasks.append(self.lookups.create_task(self.lookup(branch, IDs)))
+
+    async def lookup(self, branch: str, IDs: list):
+        # `.list` запрашивается с `full_select` из реестра методов
+        # и возвращает те же поля, что и `.get`, включая множественные
+        results = await GetByIDUserRequest(
+            self.bitrix, f"{branch}.get", None, IDs, "ID", mute=True, strategy="list"
+        ).run()
+
+        for ID, entity in results.items():
+            # методы вроде `user.get` возвращают список из одной сущности
+            if isinstance(entity, list):
+                entity = entity[0] if entity else None
+            self.entities[branch][str(ID)] = entity
+
+        self.missing.extend(
+            {"expand": branch, "ID": ID} for ID in getattr(results, "missing", ())
+        )
+
+    @staticmethod
+    def related_IDs(record: dict, field: str) -> list:
+        """ID связанных сущностей в поле `field` записи `record`
+        (пустые значения и `0` означают отсутствие связи)."""
+
+        value = record.get(field)
+        values = value if isinstance(value, (list, tuple)) else [value]
+
+        return [str(ID) for ID in values if ID not in (None, "", 0, "0")]
+
+    def attach_entities(self, record: dict):
+        for field, branch in self.expand.items():
+            entities = self.entities[branch]
+            related = [entities.get(ID) for ID in self.related_IDs(record, field)]
+
+            if isinstance(record.get(field), (list, tuple)):
+                record[expanded_key(field)] = [
+                    entity for entity in related if entity is not None
+                ]
+            else:
+                record[expanded_key(field)] = related[0] if related else None
+
+
+def is_user_field(name: str, info) -> bool:
+    """Пользовательское ли поле `name` с описанием `info` из метода `.fields`
+    (`crm.item.fields` называет их в camelCase, например `ufCrm5Amount`,
+    а название вида `UF_CRM_5_AMOUNT` дает в `upperName`)."""
+
+    upper_name = info.get("upperName") if isinstance(info, dict) else None
+    return name.upper().startswith("UF_") or str(upper_name or "").startswith("UF_")
+
+
+def expanded_key(field: str) -> str:
+    """Ключ, под которым в сущность добавляются связанные сущности поля
+    `field`: "COMPANY_ID" -> "COMPANY", "CONTACT_IDS" -> "CONTACTS",
+    "companyId" -> "company", прочие поля - с окончанием "_EXPANDED"."""
+
+    key, found = re.subn(
+        r"(?:_ID(S?)|(?<=[a-z])Id(s?))$",
+        lambda match: "".join(filter(None, match.groups())),
+        field,
+    )
+    return key if found and key else f"{field}_EXPANDED"
+
+
+def get_all_request(
+    bitrix,
+    method: str,
+    params: dict = None,
+    select_groups: int = None,
+    expand: dict = None,
+) -> GetAllUserRequest:
+    """Запрос для `get_all()` и `iter_all()`, подходящий для метода `method`."""
+
+    if expand is not None and select_groups:
+        raise ValueError("get_all(): 'expand' can't be used with 'select_groups'")
+
+    if isinstance(method, str) and method.lower().strip() == ELAPSED_ITEMS_METHOD:
+        if expand is not None:
+            raise ValueError(f"get_all(): 'expand' can't be used with {method}")
+        return GetAllElapsedItemsUserRequest(bitrix, method, params)
+
+    if expand is not None:
+        return GetAllExpandedUserRequest(bitrix, method, params, expand)
+
+    if select_groups:
+        return GetAllBySelectGroupsUserRequest(bitrix, method, params, select_groups)
+
+    return GetAllUserRequest(bitrix, method, params)
+
 
 class GetByIDUserRequest(UserRequestAbstract):
     @beartype
@@ -300,18 +1430,26 @@ class GetByIDUserRequest(UserRequestAbstract):
         params: Union[Dict[str, Any], None],
         ID_list: Union[Iterable[Union[int, str]], None],
         ID_field_name: str,
+        mute=False,
+        strategy: str = "get",
     ):
         self.ID_list = ID_list
         self.ID_field_name = ID_field_name.strip()
-        super().__init__(bitrix, method, params)
+        self.strategy = strategy
+        super().__init__(bitrix, method, params, mute)
 
     @icontract.require(lambda self: self.ID_list, "get_by_ID(): ID_list can't be empty")
+    @icontract.require(
+        lambda self: self.strategy in GET_BY_ID_STRATEGIES,
+        f"get_by_ID(): 'strategy' should be one of {GET_BY_ID_STRATEGIES}",
+    )
     @icontract.require(
         lambda self: not (self.st_params and "ID" in self.st_params.keys()),
         "get_by_ID() doesn't support parameter 'ID' within the 'params' argument",
     )
     @icontract.require(
         lambda self: not self.bitrix.verbose
+        or self.mute
         or not self.ID_list
         or "__len__" in dir(self.ID_list),
         "get_by_ID(): 'ID_list' should be a Sequence "
@@ -321,23 +1459,126 @@ class GetByIDUserRequest(UserRequestAbstract):
         return True
 
     async def run(self) -> dict:
+        list_method = self.list_method()
+        if list_method:
+            return await self.run_via_list(list_method)
+
         self.prepare_item_list()
 
-        return await MultipleServerRequestHandlerPreserveIDs(
+        handler = MultipleServerRequestHandlerPreserveIDs(
             self.bitrix,
             self.method,
             self.item_list,
             ID_field=self.ID_field_name,
             get_by_ID=True,
-        ).run()
+        )
+        results = await handler.run()
+
+        if handler.missing:
+            missing = [item[self.ID_field_name] for item in handler.missing]
+            warn_partial_results(missing)
+            return make_partial(results, missing)
+
+        return results
+
+    def list_method(self) -> Union[str, None]:
+        """Метод `.list`, которым нужно получать сущности,
+        или `None`, если их нужно получать методом `self.method`."""
+
+        if self.strategy != "list":
+            return None
+
+        list_method = self.st_method[: -len(".get")] + ".list"
+        if (
+            not self.st_method.endswith(".get")
+            or not self.srh.method_registry.get(list_method).supports_id_filter
+            or self.ID_field_name != "ID"
+        ):
+            logger.debug(
+                "Can't filter list by ID, falling back to .get: {'method': %s}",
+                self.method,
+            )
+            return None
+
+        return list_method
+
+    async def run_via_list(self, list_method: str) -> dict:
+        """Получает сущности методом `list_method` с фильтром `@ID`
+        по странице ID на команду и раскладывает их по ID
+        так же, как при получении методом `.get`.
+
+        ID, сущности которых не найдены, в результат не попадают."""
+
+        # повторяющиеся ID запрашиваются один раз
+        IDs = list(dict.fromkeys(self.ID_list))
+
+        filter_key = next(
+            (key for key in self.params if key.upper().strip() == "FILTER"), "filter"
+        )
+        user_filter = self.params.get(filter_key, {})
+
+        list_info = self.srh.method_registry.get(list_method)
+
+        # без `select` методы `.list` возвращают не все поля, в отличие от `.get`
+        base_params = dict(self.params)
+        if list_info.supports_start_minus_one:
+            base_params["start"] = -1
+        if not (self.st_params and "SELECT" in self.st_params):
+            base_params["select"] = list(list_info.full_select)
+
+        item_list = [
+            {**base_params, filter_key: {**user_filter, "@ID": chunk}}
+            for chunk in chunked(IDs, list_info.page_size)
+        ]
+
+        handler = MultipleServerRequestHandler(
+            self.bitrix,
+            method=list_method,
+            item_list=item_list,
+            real_len=len(IDs),
+            mute=self.mute,
+        )
+        records = await handler.run() or []
+
+        # ключи результата - ID в том виде, в каком они переданы, как у `.get`
+        found = {str(record[list_info.id_field]): record for record in records}
+        results = {ID: found[str(ID)] for ID in IDs if str(ID) in found}
+
+        if handler.missing:
+            missing = [ID for item in handler.missing for ID in item[filter_key]["@ID"]]
+            warn_partial_results(missing)
+            return make_partial(results, missing)
+
+        return results
+
+    async def iter_pages(self, max_pending_batches: int = None):
+        """Отдает пары (ID, результат) по мере получения,
+        списками по батчам."""
+
+        handler = MultipleServerRequestHandlerPreserveIDs(
+            self.bitrix,
+            self.method,
+            map(self.ID_item, self.ID_list),
+            ID_field=self.ID_field_name,
+            get_by_ID=True,
+            max_tasks=max_pending_batches,
+        )
+
+        async for response in handler.iter_responses():
+            # ответы берутся по меткам команд как есть: `extract_results()`
+            # разворачивает ответ на батч из одной команды, теряя ID
+            parser = ServerResponseParser(response)
+            parser.raise_for_errors()
+            yield list(parser.result["result"].items())
 
     def prepare_item_list(self):
+        self.item_list = [self.ID_item(ID) for ID in self.ID_list]
+
+    def ID_item(self, ID):
         if self.params:
-            self.item_list = [
-                ChainMap({self.ID_field_name: ID}, self.params) for ID in self.ID_list
-            ]
-        else:
-            self.item_list = [{self.ID_field_name: ID} for ID in self.ID_list]
+            return ChainMap({self.ID_field_name: ID}, self.params)
+
+        return {self.ID_field_name: ID}
 
 
 class CallUserRequest(GetByIDUserRequest):
@@ -355,12 +1596,12 @@ class CallUserRequest(GetByIDUserRequest):
         "if a progress bar is to be displayed",
     )
     def check_special_limitations(self):
-        if self.st_method.endswith(GET_ALL_ENDINGS):
+        if self.info.returns_list:
             warnings.warn(
-                "It's better to use get_all() with methods that end with "
-                f"the following: {GET_ALL_ENDINGS}. You are using '{self.st_method}'.",
+                "It's better to use get_all() with methods that return lists "
+                f"(see the method registry). You are using '{self.st_method}'.",
                 UserWarning,
-                stacklevel=get_warning_stack_level(TOP_MOST_LIBRARY_MODULES),
+                stacklevel=warning_stack_level(),
             )
 
     async def run(self):
@@ -371,13 +1612,26 @@ class CallUserRequest(GetByIDUserRequest):
 
         self.prepare_item_list()
 
-        raw_results = await MultipleServerRequestHandlerPreserveIDs(
+        handler = MultipleServerRequestHandlerPreserveIDs(
             self.bitrix,
             self.method,
             self.item_list,
             ID_field=self.ID_field_name,
             get_by_ID=False,
-        ).run()
+        )
+        raw_results = await handler.run()
+
+        if handler.missing:
+            if is_single_item:
+                raise DeadlineExceeded(f"Deadline exceeded while calling {self.method}")
+
+            # исходные элементы без служебного ключа "__order"
+            missing = [item.maps[0] for item in handler.missing]
+            warn_partial_results(missing)
+            return PartialTuple(
+                raw_results.values() if isinstance(raw_results, dict) else (),
+                missing,
+            )
 
         if isinstance(raw_results, dict) and not is_single_item:
             return tuple(raw_results.values())
@@ -437,7 +1691,7 @@ class ListAndGetUserRequest:
             "now that exceeding Bitrix request rate limitations gets users "
             "heavily penalised. Use 'get_all()' instead.",
             DeprecationWarning,
-            stacklevel=get_warning_stack_level(TOP_MOST_LIBRARY_MODULES),
+            stacklevel=warning_stack_level(),
         )
 
     @icontract.require(
@@ -473,3 +1727,147 @@ class ListAndGetUserRequest:
                 ID_list=ID_list,
             ).run()
         )
+
+
+class FindDuplicatesUserRequest(UserRequestAbstract):
+    """Поиск дубликатов методом `crm.duplicate.findbycomm` по списку
+    телефонов или адресов e-mail.
+
+    Значения нормализуются, повторы отбрасываются, и значения
+    запрашиваются частями по `FINDBYCOMM_MAX_VALUES`. Метод не сообщает,
+    какое из значений части совпало с найденными сущностями, поэтому
+    значения частей, по которым что-то найдено, запрашиваются повторно
+    по одному. Большинство частей обычно ничего не находит, и их значения
+    проверяются одной командой на часть."""
+
+    @beartype
+    def __init__(
+        self,
+        bitrix,
+        comm_type: str,
+        values: Iterable,
+        entity_type: Union[str, None] = None,
+        negative_cache: Union[NegativeCache, None] = None,
+        mute=False,
+    ):
+        self.comm_type = comm_type.upper().strip()
+        self.entity_type = entity_type.upper().strip() if entity_type else None
+        self.values = list(values)
+        self.negative_cache = negative_cache
+        super().__init__(bitrix, FINDBYCOMM_METHOD, None, mute)
+
+    @icontract.require(
+        lambda self: self.comm_type in COMMUNICATION_TYPES,
+        f"find_duplicates(): 'comm_type' should be one of {COMMUNICATION_TYPES}",
+    )
+    @icontract.require(
+        lambda self: self.values, "find_duplicates(): 'values' can't be empty"
+    )
+    def check_special_limitations(self):
+        return True
+
+    async def run(self) -> dict:
+        normalized = {
+            value: normalize_communication(self.comm_type, value)
+            for value in self.values
+        }
+
+        # {нормализованное значение: {тип сущности: [ID]}}
+        found = {}
+
+        to_check = []
+        cache = self.negative_cache
+        for value in dict.fromkeys(normalized.values()):
+            if not value or (cache is not None and self.cache_key(value) in cache):
+                found[value] = {}
+            else:
+                to_check.append(value)
+
+        chunks = list(chunked(to_check, FINDBYCOMM_MAX_VALUES))
+        responses = await self.fetch(dict(enumerate(chunks)))
+
+        missing, ambiguous = [], []
+        for i, chunk in enumerate(chunks):
+            if i not in responses:
+                missing.extend(chunk)
+            elif not responses[i]:
+                found.update((value, {}) for value in chunk)
+            elif len(chunk) == 1:
+                found[chunk[0]] = responses[i]
+            else:
+                ambiguous.extend(chunk)
+
+        responses = await self.fetch({value: [value] for value in ambiguous})
+        for value in ambiguous:
+            if value in responses:
+                found[value] = responses[value]
+            else:
+                missing.append(value)
+
+        if cache is not None:
+            for value in to_check:
+                if value in found and not found[value]:
+                    cache.add(self.cache_key(value))
+
+        results = {
+            value: found[norm] for value, norm in normalized.items() if norm in found
+        }
+
+        if missing:
+            missing_set = set(missing)
+            missing = [
+                value for value, norm in normalized.items() if norm in missing_set
+            ]
+            warn_partial_results(missing)
+            return make_partial(results, missing)
+
+        return results
+
+    def cache_key(self, value: str) -> tuple:
+        return self.comm_type, self.entity_type, value
+
+    async def fetch(self, value_chunks: dict) -> dict:
+        """Ищет дубликаты по частям значений `{ключ: [значения]}`
+        и возвращает `{ключ: {тип сущности: [ID]}}`.
+
+        Части, не проверенные до истечения срока операции,
+        в результат не попадают."""
+
+        if not value_chunks:
+            return {}
+
+        labels = {f"chunk{i:010}": key for i, key in enumerate(value_chunks)}
+
+        params = {"type": self.comm_type}
+        if self.entity_type:
+            params["entity_type"] = self.entity_type
+
+        handler = MultipleServerRequestHandlerPreserveIDs(
+            self.bitrix,
+            self.method,
+            [
+                {"__chunk": label, **params, "values": value_chunks[key]}
+                for label, key in labels.items()
+            ],
+            ID_field="__chunk",
+            get_by_ID=False,
+        )
+
+        responses = {}
+        try:
+            async for response in handler.iter_responses():
+                parser = ServerResponseParser(response)
+                parser.raise_for_errors()
+
+                # ответ - `{тип сущности: [ID]}` или пустой список
+                for label, result in (parser.result["result"] or {}).items():
+                    responses[labels[label]] = {
+                        entity_type: IDs
+                        for entity_type, IDs in (result or {}).items()
+                        if IDs
+                    }
+
+        except DeadlineExceeded:
+            pass
+
+        return responses
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 from typing import List, Union
 from urllib.parse import quote, urlparse
@@ -36,6 +37,58 @@ def http_build_query(params, convention="%s"):
     return output
 
 
+def method_matches(method: str, pattern: str) -> bool:
+    """Проверяет, подходит ли `method` под `pattern`.
+
+    Шаблон - либо точное название метода, либо префикс,
+    заканчивающийся на `*` (например, `tasks.*`)."""
+
+    method, pattern = method.lower(), pattern.lower().strip()
+
+    if pattern.endswith("*"):
+        return method.startswith(pattern[:-1])
+
+    return method == pattern
+
+
+class LoopBoundEvent:
+    """`asyncio.Event`, создаваемое в том цикле событий, где оно используется.
+
+    До Python 3.10 `asyncio.Event` привязывается к циклу событий потока,
+    в котором создано, и ожидание его в другом цикле (например, в цикле
+    синхронного клиента `Bitrix`, работающем в отдельном потоке)
+    заканчивается ошибкой "attached to a different loop". Поэтому событие
+    создается при первом использовании, а в новом цикле событий -
+    создается заново в исходном состоянии."""
+
+    def __init__(self, is_set: bool = False):
+        self.initially_set = is_set
+        self.loop = None
+        self.event = None
+
+    def _event(self) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.event = asyncio.Event()
+            if self.initially_set:
+                self.event.set()
+
+        return self.event
+
+    def is_set(self) -> bool:
+        return self._event().is_set()
+
+    def set(self):
+        self._event().set()
+
+    def clear(self):
+        self._event().clear()
+
+    async def wait(self):
+        return await self._event().wait()
+
+
 def get_warning_stack_level(module_filenames: Union[str, List[str]]) -> int:
     """Calculate the stack level for warnings issued from a library.
 
@@ -37,3 +37,668 @@ class TestAsync:
         assert len(result) == 3
         assert result[0] == result[1] == result[2]
         assert all(len(r) >= 100 for r in result)
+
+
+@pytest.mark.asyncio
+async def test_iter_by_ID_streams_results():
+    from tests.test_scheduler import EchoSRH
+
+    bx = BitrixAsync("https://google.com/path", verbose=False, batch_size=2)
+    bx.srh.single_request = EchoSRH().single_request
+
+    results = {}
+    async for ID, result in bx.iter_by_ID("crm.deal.get", range(1, 6)):
+        results[str(ID)] = result
+
+    assert sorted(results) == ["1", "2", "3", "4", "5"]
+    assert results["3"].startswith("crm.deal.get?ID=3")
+
+
+@pytest.mark.asyncio
+async def test_get_by_ID_list_strategy():
+    from urllib.parse import parse_qsl, unquote
+
+    from tests.test_scheduler import EchoSRH
+
+    class ListSRH(EchoSRH):
+        """Отвечает на команды `.list` сущностями с ID из фильтра `@ID`,
+        кроме ID 7."""
+
+        async def single_request(self, method, params=None):
+            response = await super().single_request(method, params)
+            results = response["result"]["result"]
+            for label, url in results.items():
+                query = parse_qsl(url.split("?", 1)[1])
+                IDs = [v for k, v in query if unquote(k).startswith("filter[@ID]")]
+                results[label] = [{"ID": ID} for ID in IDs if ID != "7"]
+            return response
+
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    srh = ListSRH()
+    bx.srh.single_request = srh.single_request
+
+    IDs = list(range(1, 121)) + [1, 2]
+    results = await bx.get_by_ID("crm.deal.get", IDs, strategy="list")
+
+    # 120 уникальных ID - это 3 команды в одном батче вместо 120 команд
+    commands = [url for b in srh.batches for url in b["cmd"].values()]
+    assert len(commands) == 3
+    assert all(url.startswith("crm.deal.list?") for url in commands)
+    assert "select[1]=UF_%2A" in commands[0]
+
+    assert len(results) == 119
+    assert 7 not in results
+    assert results[120] == {"ID": "120"}
+
+    # для методов без подходящего `.list` используется `.get`
+    srh.batches.clear()
+    await bx.get_by_ID("tasks.task.get", [1, 2], "taskId", strategy="list")
+    commands = [url for b in srh.batches for url in b["cmd"].values()]
+    assert commands[0].startswith("tasks.task.get?taskId=1")
+
+
+class ContactsSRH:
+    """Отвечает на команды `crm.contact.get` и `crm.contact.list` так же,
+    как сервер: `.list` возвращает множественные поля, только если они
+    явно указаны в `select`."""
+
+    MULTIFIELDS = ("PHONE", "EMAIL", "WEB", "IM")
+
+    def __init__(self, contacts: dict):
+        self.contacts = contacts
+        self.commands = []
+
+    @classmethod
+    def selected(cls, contact: dict, select: list) -> dict:
+        return {
+            field: value
+            for field, value in contact.items()
+            if field in select
+            or ("*" in select and field not in cls.MULTIFIELDS)
+            and (not field.startswith("UF_") or "UF_*" in select)
+        }
+
+    def answer(self, url):
+        from urllib.parse import parse_qsl, unquote
+
+        method, _, query = url.partition("?")
+        query = [(unquote(k), v) for k, v in parse_qsl(query)]
+
+        if method == "crm.contact.get":
+            return self.contacts.get(dict(query)["ID"])
+
+        select = [v for k, v in query if k.startswith("select[")] or ["*"]
+        IDs = [v for k, v in query if k.startswith("filter[@ID]")]
+        return [
+            self.selected(self.contacts[ID], select)
+            for ID in IDs
+            if ID in self.contacts
+        ]
+
+    async def single_request(self, method, params=None):
+        self.commands.extend(params["cmd"].values())
+        await sleep(0)
+        return {
+            "result": {
+                "result": {
+                    label: self.answer(url) for label, url in params["cmd"].items()
+                },
+                "result_error": [],
+            }
+        }
+
+
+@pytest.mark.asyncio
+async def test_get_by_ID_list_strategy_returns_multifields():
+    contacts = {
+        str(ID): {
+            "ID": str(ID),
+            "NAME": f"Contact {ID}",
+            "UF_CRM_SOURCE": "web",
+            "PHONE": [{"ID": "1", "VALUE": "+7999123456", "VALUE_TYPE": "WORK"}],
+            "EMAIL": [{"ID": "2", "VALUE": "a@b.ru", "VALUE_TYPE": "WORK"}],
+            "WEB": [],
+            "IM": [],
+        }
+        for ID in range(1, 4)
+    }
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    bx.srh.single_request = ContactsSRH(contacts).single_request
+
+    via_get = await bx.get_by_ID("crm.contact.get", [1, 2, 3])
+    via_list = await bx.get_by_ID("crm.contact.get", [1, 2, 3], strategy="list")
+
+    assert via_get == {ID: contacts[str(ID)] for ID in [1, 2, 3]}
+    assert via_list == via_get
+
+
+@pytest.mark.asyncio
+async def test_get_by_filter_in_pages_each_chunk():
+    from urllib.parse import parse_qsl, unquote
+
+    from tests.test_scheduler import EchoSRH
+
+    class OwnerSRH(EchoSRH):
+        """Отвечает на команды `crm.activity.list` страницами дел:
+        у владельца 1 их 120, у остальных - по одному."""
+
+        async def single_request(self, method, params=None):
+            response = await super().single_request(method, params)
+            batch = response["result"]
+            for label, url in batch["result"].items():
+                query = [(unquote(k), v) for k, v in parse_qsl(url.split("?", 1)[1])]
+                owners = [v for k, v in query if k.startswith("filter[OWNER_ID]")]
+                start = int(dict(query)["start"])
+                records = [
+                    {"ID": f"{owner}-{i}", "OWNER_ID": owner}
+                    for owner in owners
+                    for i in range(120 if owner == "1" else 1)
+                ]
+                batch["result"][label] = records[start : start + 50]
+                batch["result_total"][label] = len(records)
+            return response
+
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    srh = OwnerSRH()
+    bx.srh.single_request = srh.single_request
+
+    values = list(range(1, 61)) + [1]
+    results = await bx.get_by_filter_in(
+        "crm.activity.list",
+        "OWNER_ID",
+        values,
+        {"filter": {"OWNER_TYPE_ID": 2}},
+        group_by_value=True,
+    )
+
+    # две части значений: первая (169 дел) - на 4 страницах, вторая - на одной
+    commands = [url for b in srh.batches for url in b["cmd"].values()]
+    assert len(commands) == 5
+    assert all("filter[OWNER_TYPE_ID]=2" in url for url in commands)
+
+    assert list(results) == list(range(1, 61))
+    assert len(results[1]) == 120
+    assert results[60] == [{"ID": "60-0", "OWNER_ID": "60"}]
+
+    flat = await bx.get_by_filter_in("crm.activity.list", "OWNER_ID", values)
+    assert len(flat) == 179
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:You are selecting all fields")
+async def test_get_all_select_groups_join_by_ID():
+    from urllib.parse import parse_qsl, unquote
+
+    from tests.test_scheduler import EchoSRH
+
+    FIELDS = ["ID", "TITLE", "STAGE_ID", "UF_A", "UF_B"]
+
+    def page(params, start):
+        records = [
+            {field: f"{field}{i}" if field != "ID" else str(i) for field in params}
+            for i in range(1, 61)
+        ]
+        return records[start : start + 50]
+
+    class DealSRH(EchoSRH):
+        """Отвечает на `crm.deal.fields` и `crm.deal.list` 60 сделками
+        с полями из `select`."""
+
+        selects = []
+
+        async def single_request(self, method, params=None):
+            if method == "crm.deal.fields":
+                return {"result": {field: {"type": "string"} for field in FIELDS}}
+
+            if method == "crm.deal.list":
+                self.selects.append(params["select"])
+                return {
+                    "result": page(params["select"], 0),
+                    "total": 60,
+                    "time": {"processing": len(params["select"])},
+                }
+
+            response = await super().single_request(method, params)
+            for label, url in response["result"]["result"].items():
+                query = [(unquote(k), v) for k, v in parse_qsl(url.split("?", 1)[1])]
+                select = [v for k, v in query if k.startswith("select")]
+                start = int(dict(query)["start"])
+                response["result"]["result"][label] = page(select, start)
+            return response
+
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    srh = DealSRH()
+    bx.srh.single_request = srh.single_request
+
+    # UF_A измерено как самое дорогое поле
+    bx.srh.field_costs.add("crm.deal.list", ["UF_A"], 10)
+    bx.srh.field_costs.add("crm.deal.list", ["TITLE", "STAGE_ID", "UF_B"], 3)
+
+    deals = await bx.get_all(
+        "crm.deal.list", {"select": ["*", "UF_*"]}, select_groups=2
+    )
+
+    assert sorted(map(sorted, srh.selects)) == [
+        ["ID", "STAGE_ID", "TITLE", "UF_B"],
+        ["ID", "UF_A"],
+    ]
+
+    assert len(deals) == 60
+    deal = next(deal for deal in deals if deal["ID"] == "60")
+    assert deal == {
+        "ID": "60",
+        "TITLE": "TITLE60",
+        "STAGE_ID": "STAGE_ID60",
+        "UF_A": "UF_A60",
+        "UF_B": "UF_B60",
+    }
+
+    # время первых страниц групп учтено в стоимости полей
+    assert bx.srh.field_costs.cost("crm.deal.list", "UF_A") < 10
+
+
+class ItemsSRH:
+    """Отвечает на `crm.item.fields` и `crm.item.list` 60 элементами
+    смарт-процесса с полями из `select`. Если задан `skip`, то группа
+    полей, содержащая поле `skip`, не получает последний элемент, как
+    будто он был удален, пока листалась эта группа."""
+
+    FIELDS = {
+        "id": {"type": "integer"},
+        "title": {"type": "string"},
+        "stageId": {"type": "crm_status"},
+        "ufCrm5Amount": {"type": "double", "upperName": "UF_CRM_5_AMOUNT"},
+        "ufCrm5Note": {"type": "string", "upperName": "UF_CRM_5_NOTE"},
+    }
+
+    def __init__(self, skip: str = None):
+        self.skip = skip
+        self.fields_params = []
+        self.selects = []
+
+    def page(self, select, start):
+        records = [
+            {field: f"{field}{i}" if field != "id" else i for field in select}
+            for i in range(1, 61)
+        ]
+        if self.skip in select:
+            records.pop()
+        return {"items": records[start : start + 50]}
+
+    async def single_request(self, method, params=None):
+        from urllib.parse import parse_qsl, unquote
+
+        if method == "crm.item.fields":
+            self.fields_params.append(params)
+            if params.get("entityTypeId") != 128:
+                return {"error": "NOT_FOUND"}
+            return {"result": {"fields": self.FIELDS}}
+
+        if method == "crm.item.list":
+            self.selects.append(params["select"])
+            return {
+                "result": self.page(params["select"], 0),
+                "total": 60,
+                "time": {},
+            }
+
+        results = {}
+        for label, url in params["cmd"].items():
+            query = [(unquote(k), v) for k, v in parse_qsl(url.split("?", 1)[1])]
+            select = [v for k, v in query if k.startswith("select")]
+            results[label] = self.page(select, int(dict(query)["start"]))
+
+        await sleep(0)
+        return {"result": {"result": results, "result_error": []}, "time": {}}
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:You are selecting all fields")
+async def test_get_all_select_groups_for_smart_process_items():
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    srh = ItemsSRH()
+    bx.srh.single_request = srh.single_request
+
+    items = await bx.get_all(
+        "crm.item.list",
+        {"entityTypeId": 128, "select": ["*", "UF_*"], "filter": {">id": 0}},
+        select_groups=2,
+    )
+
+    # `crm.item.fields` получил тип сущности, но не фильтр
+    assert srh.fields_params == [{"entityTypeId": 128}]
+    # поля поделены на две группы, `id` запрошен в каждой
+    assert sorted(field for select in srh.selects for field in select) == sorted(
+        ["id", *ItemsSRH.FIELDS]
+    )
+
+    items = {item["id"]: item for item in items}
+    assert len(items) == 60
+    assert items[60] == {
+        "id": 60,
+        "title": "title60",
+        "stageId": "stageId60",
+        "ufCrm5Amount": "ufCrm5Amount60",
+        "ufCrm5Note": "ufCrm5Note60",
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.filterwarnings("ignore:You are selecting all fields")
+async def test_get_all_select_groups_keeps_entities_missing_from_a_group():
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    srh = ItemsSRH(skip="ufCrm5Note")
+    bx.srh.single_request = srh.single_request
+
+    with pytest.warns(RuntimeWarning, match="doesn't equal 'total'"):
+        items = await bx.get_all(
+            "crm.item.list",
+            {"entityTypeId": 128, "select": ["title", "ufCrm5Note"]},
+            select_groups=2,
+        )
+
+    # группа с `ufCrm5Note` не получила элемент 60:
+    # у него есть только поля другой группы
+    items = {item["id"]: item for item in items}
+    assert len(items) == 60
+    assert items[60] == {"id": 60, "title": "title60"}
+    assert items[59] == {"id": 59, "title": "title59", "ufCrm5Note": "ufCrm5Note59"}
+
+
+@pytest.mark.asyncio
+async def test_get_all_any_merges_and_skips_covered_filters():
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    filters = []
+
+    deals = {
+        "CLOSED": [{"ID": "1"}, {"ID": "2"}],
+        "OPPORTUNITY": [{"ID": "2"}, {"ID": "3"}],
+    }
+
+    async def single_request(method, params=None):
+        filters.append(params["filter"])
+        field = "CLOSED" if "CLOSED" in params["filter"] else "OPPORTUNITY"
+        return {"result": deals[field], "total": 2}
+
+    bx.srh.single_request = single_request
+
+    results = await bx.get_all_any(
+        "crm.deal.list",
+        [
+            {"CLOSED": "Y"},
+            {">OPPORTUNITY": 100000},
+            {"CLOSED": "Y", "STAGE_ID": "WON"},
+            {">OPPORTUNITY": 100000},
+        ],
+        {"filter": {"CATEGORY_ID": 1}, "select": ["TITLE"]},
+    )
+
+    assert sorted(deal["ID"] for deal in results) == ["1", "2", "3"]
+
+    # покрытые другими фильтры и повторы не запрашиваются
+    assert len(filters) == 2
+    assert {"CATEGORY_ID": 1, "CLOSED": "Y"} in filters
+    assert {"CATEGORY_ID": 1, ">OPPORTUNITY": 100000} in filters
+
+
+@pytest.mark.asyncio
+async def test_get_all_by_date_range_splits_overflowing_windows():
+    from datetime import datetime, timedelta
+    from urllib.parse import parse_qsl
+
+    from tests.test_scheduler import EchoSRH
+
+    first = datetime(2024, 1, 1)
+    calls = [
+        {"ID": str(i), "CALL_START_DATE": (first + timedelta(hours=i)).isoformat()}
+        for i in range(300)
+    ]
+
+    class CallsSRH(EchoSRH):
+        """Отвечает на команды `voximplant.statistic.get` звонками из окна."""
+
+        async def single_request(self, method, params=None):
+            response = await super().single_request(method, params)
+            batch = response["result"]
+            for label, url in batch["result"].items():
+                query = dict(parse_qsl(url.split("?", 1)[1]))
+                window = [
+                    call
+                    for call in calls
+                    if query["FILTER[>=CALL_START_DATE]"]
+                    <= call["CALL_START_DATE"]
+                    < query["FILTER[<CALL_START_DATE]"]
+                ]
+                start = int(query["start"])
+                batch["result"][label] = window[start : start + 50]
+                batch["result_total"][label] = len(window)
+            return response
+
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    srh = CallsSRH()
+    bx.srh.single_request = srh.single_request
+
+    results = await bx.get_all_by_date_range(
+        "voximplant.statistic.get",
+        "CALL_START_DATE",
+        first,
+        "2024-02-01",
+        {"FILTER": {"CALL_TYPE": 1}},
+    )
+
+    assert sorted(int(call["ID"]) for call in results) == list(range(300))
+
+    # окно из 300 звонков делится на 3 окна, а первое из них, в которое
+    # попали 248 звонков, - еще на 3
+    assert len(srh.batches) == 4
+    commands = [url for b in srh.batches for url in b["cmd"].values()]
+    assert all("FILTER[CALL_TYPE]=1" in url for url in commands)
+    assert not any("order" in url for url in commands)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("report_total", [True, False])
+async def test_elapsed_items_paged_by_nav_params(report_total):
+    from urllib.parse import parse_qsl
+
+    from tests.test_scheduler import EchoSRH
+
+    items = [{"ID": str(i), "TASK_ID": "1"} for i in range(1, 231)]
+
+    def page(number):
+        # номера после последней страницы сервер заменяет последней
+        number = min(number, 5)
+        return items[(number - 1) * 50 : number * 50]
+
+    class ElapsedSRH(EchoSRH):
+        async def single_request(self, method, params=None):
+            if method == "tasks.elapseditem.getlist":
+                self.first_params = params
+                response = {"result": page(1)}
+                if report_total:
+                    response["total"] = len(items)
+                return response
+
+            response = await super().single_request(method, params)
+            for label, url in response["result"]["result"].items():
+                query = dict(parse_qsl(url.split("?", 1)[1]))
+                number = int(query["PARAMS[NAV_PARAMS][iNumPage]"])
+                response["result"]["result"][label] = page(number)
+            return response
+
+    bx = BitrixAsync("https://google.com/path", verbose=False, batch_size=2)
+    srh = ElapsedSRH()
+    bx.srh.single_request = srh.single_request
+
+    results = await bx.get_all(
+        "tasks.elapseditem.getlist", {"FILTER": {"TASK_ID": 1}}
+    )
+
+    assert sorted(int(item["ID"]) for item in results) == list(range(1, 231))
+    assert srh.first_params["ORDER"] == {"ID": "asc"}
+    assert srh.first_params["PARAMS"] == {
+        "NAV_PARAMS": {"nPageSize": 50, "iNumPage": 1}
+    }
+
+    # без `total` страницы запрашиваются волнами по 2, 4, ... страницы
+    commands = [url for b in srh.batches for url in b["cmd"].values()]
+    assert len(commands) == (4 if report_total else 6)
+
+    srh.batches.clear()
+    streamed = [item async for item in bx.iter_all("tasks.elapseditem.getlist")]
+    assert len(streamed) == 230
+
+
+@pytest.mark.asyncio
+async def test_get_all_expand_fetches_each_related_entity_once():
+    from urllib.parse import parse_qsl, unquote
+
+    deals = [
+        {
+            "ID": str(i),
+            "COMPANY_ID": "0" if i % 10 == 0 else str(i % 3 + 1),
+            "ASSIGNED_BY_ID": str(i % 2 + 1),
+        }
+        for i in range(1, 121)
+    ]
+    commands = []
+
+    def answer(url):
+        method, _, query = url.partition("?")
+        query = [(unquote(k), v) for k, v in parse_qsl(query)]
+
+        if method == "crm.deal.list":
+            start = int(dict(query)["start"])
+            return deals[start : start + 50]
+        if method == "crm.company.list":
+            IDs = [v for k, v in query if k.startswith("filter[@ID]")]
+            return [{"ID": ID, "TITLE": f"Company {ID}"} for ID in IDs]
+        if method == "user.get":
+            return [{"ID": dict(query)["ID"]}]
+
+    async def single_request(method, params=None):
+        if method != "batch":
+            return {"result": deals[:50], "total": len(deals)}
+
+        commands.extend(params["cmd"].values())
+        await sleep(0)
+        return {
+            "result": {
+                "result": {
+                    label: answer(url) for label, url in params["cmd"].items()
+                },
+                "result_error": [],
+                "result_total": {label: len(deals) for label in params["cmd"]},
+            }
+        }
+
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    bx.srh.single_request = single_request
+
+    results = await bx.get_all(
+        "crm.deal.list",
+        {"select": ["TITLE"]},
+        expand={"COMPANY_ID": "crm.company", "ASSIGNED_BY_ID": "user"},
+    )
+
+    assert [deal["ID"] for deal in results] == [str(i) for i in range(1, 121)]
+    assert results[0]["COMPANY"] == {"ID": "2", "TITLE": "Company 2"}
+    assert results[9]["COMPANY"] is None
+    assert results[0]["ASSIGNED_BY"] == {"ID": "2"}
+
+    # каждая компания и каждый пользователь запрашиваются один раз
+    lookups = [url for url in commands if not url.startswith("crm.deal.list")]
+    assert len([url for url in lookups if url.startswith("crm.company.list")]) == 1
+    users = sorted(url for url in lookups if url.startswith("user.get"))
+    assert [url.rstrip("&") for url in users] == ["user.get?ID=1", "user.get?ID=2"]
+
+
+@pytest.mark.asyncio
+async def test_get_all_expand_returns_full_contacts():
+    deals = [{"ID": str(i), "CONTACT_ID": str(i % 2 + 1)} for i in range(1, 5)]
+    contacts = {
+        str(ID): {
+            "ID": str(ID),
+            "NAME": f"Contact {ID}",
+            "PHONE": [{"ID": str(ID), "VALUE": f"+7999000000{ID}"}],
+            "EMAIL": [],
+        }
+        for ID in (1, 2)
+    }
+
+    class DealsSRH(ContactsSRH):
+        def answer(self, url):
+            if url.startswith("crm.deal.list"):
+                return deals
+            return super().answer(url)
+
+        async def single_request(self, method, params=None):
+            if method != "batch":
+                return {"result": deals, "total": len(deals)}
+            return await super().single_request(method, params)
+
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    srh = DealsSRH(contacts)
+    bx.srh.single_request = srh.single_request
+
+    results = await bx.get_all("crm.deal.list", expand={"CONTACT_ID": "crm.contact"})
+
+    assert [deal["CONTACT"] for deal in results] == [
+        contacts[deal["CONTACT_ID"]] for deal in deals
+    ]
+    assert results[0]["CONTACT"]["PHONE"][0]["VALUE"] == "+79990000002"
+
+
+@pytest.mark.asyncio
+async def test_find_duplicates_rechecks_only_chunks_with_hits():
+    from urllib.parse import parse_qsl, unquote
+
+    from fast_bitrix24.duplicates import NegativeCache
+
+    crm = {"79991234567": {"CONTACT": [5]}, "79990000040": {"LEAD": [7, 8]}}
+    commands = []
+
+    def answer(url):
+        query = [(unquote(k), v) for k, v in parse_qsl(url.split("?", 1)[1])]
+        hits = {}
+        for key, value in query:
+            if key.startswith("values["):
+                for entity_type, IDs in crm.get(value, {}).items():
+                    hits.setdefault(entity_type, []).extend(IDs)
+        return hits or []
+
+    async def single_request(method, params=None):
+        commands.extend(params["cmd"].values())
+        await sleep(0)
+        return {
+            "result": {
+                "result": {label: answer(url) for label, url in params["cmd"].items()},
+                "result_error": [],
+            }
+        }
+
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    bx.srh.single_request = single_request
+
+    phones = ["+7 (999) 123-45-67", "7999-123-45-67", ""] + [
+        f"7999000{i:04}" for i in range(1, 44)
+    ]
+    cache = NegativeCache()
+
+    results = await bx.find_duplicates("phone", phones, negative_cache=cache)
+
+    # 44 разных телефона - 3 части, по одному перепроверяются
+    # только телефоны частей с совпадениями (20 и 4 телефона)
+    assert len(commands) == 3 + 20 + 4
+    assert results["+7 (999) 123-45-67"] == {"CONTACT": [5]}
+    assert results["7999-123-45-67"] == {"CONTACT": [5]}
+    assert results["79990000040"] == {"LEAD": [7, 8]}
+    assert results[""] == {}
+    assert results["79990000001"] == {}
+    assert len(results) == len(phones)
+    assert len(cache) == 42
+
+    # телефоны без совпадений повторно не проверяются
+    commands.clear()
+    await bx.find_duplicates("PHONE", phones, negative_cache=cache)
+    assert len(commands) == 1 + 2
@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+from fast_bitrix24.autotune import (
+    CEILING_EXPIRY,
+    MAX_REQUESTS_PER_SECOND,
+    PROBE_AFTER_SATURATED_SUCCESSES,
+    RateLimitAutotuner,
+)
+from fast_bitrix24.throttle import LeakyBucketThrottler
+
+
+@pytest.fixture
+def frozen_time(monkeypatch):
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+
+
+def fill(throttler, requests):
+    for _ in range(requests):
+        throttler.add_request_record()
+
+
+def test_probes_higher_limits_while_saturated(tmp_path, frozen_time):
+    throttler = LeakyBucketThrottler(50, 2.0)
+    tuner = RateLimitAutotuner(throttler, "portal", str(tmp_path / "limits.json"))
+
+    fill(throttler, 50)
+    for _ in range(PROBE_AFTER_SATURATED_SUCCESSES):
+        tuner.on_success()
+
+    assert throttler.pool_size == 63
+    assert throttler.requests_per_second == 2.5
+
+    # запросы в корзине сохраняются при смене лимитов
+    assert throttler.level() == pytest.approx(50)
+
+
+def test_refusal_before_pool_is_full_shrinks_pool(tmp_path, frozen_time):
+    throttler = LeakyBucketThrottler(250, 5.0)
+    tuner = RateLimitAutotuner(throttler, "portal", str(tmp_path / "limits.json"))
+
+    fill(throttler, 60)
+    tuner.on_rate_limited()
+
+    assert throttler.pool_size == 200
+    assert throttler.requests_per_second == 5.0
+    assert tuner.pool_size_ceiling == 250
+
+
+def test_refusal_with_full_pool_slows_down(tmp_path, frozen_time):
+    throttler = LeakyBucketThrottler(50, 2.0)
+    tuner = RateLimitAutotuner(throttler, "portal", str(tmp_path / "limits.json"))
+
+    fill(throttler, 50)
+    tuner.on_rate_limited()
+
+    assert throttler.pool_size == 50
+    assert throttler.requests_per_second == pytest.approx(1.6)
+
+    # больше не пробуем скорость, на которой получили отказ
+    for _ in range(PROBE_AFTER_SATURATED_SUCCESSES):
+        tuner.on_success()
+    assert throttler.requests_per_second == pytest.approx(1.6)
+
+
+def test_learned_limits_are_reused_by_next_run(tmp_path, frozen_time):
+    limits_file = str(tmp_path / "limits.json")
+
+    throttler = LeakyBucketThrottler(50, 2.0)
+    tuner = RateLimitAutotuner(throttler, "portal", limits_file)
+    tuner.set_limits(250, 5.0)
+
+    next_run = LeakyBucketThrottler(50, 2.0)
+    RateLimitAutotuner(next_run, "portal", limits_file)
+    assert (next_run.pool_size, next_run.requests_per_second) == (250, 5.0)
+
+    other_portal = LeakyBucketThrottler(50, 2.0)
+    RateLimitAutotuner(other_portal, "other_portal", limits_file)
+    assert (other_portal.pool_size, other_portal.requests_per_second) == (50, 2.0)
+
+
+def test_burst_of_refusals_backs_off_once(tmp_path):
+    throttler = LeakyBucketThrottler(50, 2.0)
+    tuner = RateLimitAutotuner(throttler, "portal", str(tmp_path / "limits.json"))
+
+    fill(throttler, 50)
+    sent_at = time.monotonic()
+
+    # все запросы всплеска отправлены до первого отказа
+    for _ in range(20):
+        tuner.on_rate_limited(sent_at)
+
+    assert throttler.requests_per_second == pytest.approx(1.6)
+    assert tuner.requests_per_second_ceiling == 2.0
+
+    # запрос, отправленный уже с новыми лимитами, снова снижает их
+    tuner.on_rate_limited(time.monotonic())
+    assert throttler.requests_per_second == pytest.approx(1.28)
+
+
+def test_refused_limits_are_probed_again_after_expiry(tmp_path, monkeypatch):
+    limits_file = str(tmp_path / "limits.json")
+    throttler = LeakyBucketThrottler(50, 2.0)
+    tuner = RateLimitAutotuner(throttler, "portal", limits_file)
+
+    fill(throttler, 50)
+    tuner.on_rate_limited()
+    assert tuner.requests_per_second_ceiling == 2.0
+
+    later = time.time() + CEILING_EXPIRY + 1
+    monkeypatch.setattr(time, "time", lambda: later)
+
+    next_run = RateLimitAutotuner(LeakyBucketThrottler(50, 2.0), "portal", limits_file)
+    assert next_run.requests_per_second_ceiling == MAX_REQUESTS_PER_SECOND
@@ -0,0 +1,217 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from fast_bitrix24.backends import UNLOCK_SCRIPT, FileLockBackend, RedisBackend
+from fast_bitrix24.throttle import LeakyBucketThrottler, SlidingWindowThrottler
+
+
+class RedisStandIn:
+    """Минимальный сервер, понимающий протокол Redis, команды GET, SET, DEL
+    и EVAL скрипта снятия блокировки."""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+
+    async def handle(self, reader, writer):
+        while True:
+            try:
+                header = await reader.readuntil(b"\r\n")
+            except asyncio.IncompleteReadError:
+                break
+
+            args = []
+            for _ in range(int(header[1:-2])):
+                length = int((await reader.readuntil(b"\r\n"))[1:-2])
+                args.append((await reader.readexactly(length + 2))[:-2])
+
+            writer.write(self.execute(*args))
+            await writer.drain()
+
+        writer.close()
+
+    def execute(self, command, *args):
+        command = command.decode().upper()
+        self.commands.append(command)
+
+        if command == "GET":
+            value = self.data.get(args[0])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+        if command == "SET":
+            options = {arg.upper() for arg in args[2:]}
+            if b"NX" in options and args[0] in self.data:
+                return b"$-1\r\n"
+            self.data[args[0]] = args[1]
+            return b"+OK\r\n"
+
+        if command == "DEL":
+            return b":%d\r\n" % int(self.data.pop(args[0], None) is not None)
+
+        if command == "EVAL" and args[0] == UNLOCK_SCRIPT.encode():
+            key, token = args[2], args[3]
+            if self.data.get(key) != token:
+                return b":0\r\n"
+            del self.data[key]
+            return b":1\r\n"
+
+        return b"-ERR unknown command\r\n"
+
+
+@pytest_asyncio.fixture
+async def redis_stand_in():
+    stand_in = RedisStandIn()
+    server = await asyncio.start_server(stand_in.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    try:
+        yield stand_in, f"redis://127.0.0.1:{port}/0"
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def fill_and_measure(throttler_a, throttler_b):
+    # первый "процесс" выбирает весь пул
+    for _ in range(3):
+        assert await throttler_a._update_state(throttler_a._reserve) == 0
+
+    # второй "процесс" это видит и вынужден ждать
+    return await throttler_b._update_state(throttler_b._reserve)
+
+
+@pytest.mark.asyncio
+async def test_file_lock_backend_shares_leaky_bucket(tmp_path):
+    path = str(tmp_path / "state.json")
+
+    throttler_a = LeakyBucketThrottler(3, 2.0, FileLockBackend(path), "portal")
+    throttler_b = LeakyBucketThrottler(3, 2.0, FileLockBackend(path), "portal")
+    stranger = LeakyBucketThrottler(3, 2.0, FileLockBackend(path), "other_portal")
+
+    assert await fill_and_measure(throttler_a, throttler_b) == pytest.approx(
+        0.5, abs=0.05
+    )
+    assert await stranger._update_state(stranger._reserve) == 0
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_shares_leaky_bucket(redis_stand_in):
+    stand_in, url = redis_stand_in
+
+    throttler_a = LeakyBucketThrottler(3, 2.0, RedisBackend(url), "portal")
+    throttler_b = LeakyBucketThrottler(3, 2.0, RedisBackend(url), "portal")
+
+    assert await fill_and_measure(throttler_a, throttler_b) == pytest.approx(
+        0.5, abs=0.05
+    )
+
+    # после каждой транзакции блокировка снимается
+    assert list(stand_in.data) == [b"fast_bitrix24:portal"]
+    assert stand_in.commands.count("EVAL") == 4
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_shares_sliding_window(redis_stand_in):
+    _, url = redis_stand_in
+
+    throttler_a = SlidingWindowThrottler(10, 600, RedisBackend(url), "method")
+    throttler_b = SlidingWindowThrottler(10, 600, RedisBackend(url), "method")
+
+    async with throttler_a.acquire():
+        throttler_a.add_request_record(6)
+
+    async with throttler_b.acquire():
+        throttler_b.add_request_record(5)
+
+    # оба процесса видят общий бюджет и вынуждены ждать
+    await throttler_a._sync()
+    assert throttler_a._calculate_needed_sleep_time() > 590
+    assert throttler_b._calculate_needed_sleep_time() > 590
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_drops_connection_of_cancelled_command(redis_stand_in):
+    stand_in, url = redis_stand_in
+    stand_in.data[b"k"] = b"value-of-k"
+    backend = RedisBackend(url)
+
+    # команда отменена после отправки, но до получения ответа
+    command = asyncio.ensure_future(backend.command("GET", "k"))
+    while not stand_in.commands:
+        await asyncio.sleep(0)
+    command.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await command
+
+    # ответ на отмененную команду не достается следующей
+    assert await backend.command("GET", "missing") is None
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_keeps_lock_taken_over_by_another_client(redis_stand_in):
+    stand_in, url = redis_stand_in
+    backend = RedisBackend(url)
+
+    async with backend.transaction("portal"):
+        # блокировка истекла и ее захватил другой клиент
+        stand_in.data[b"fast_bitrix24:portal:lock"] = b"someone-else"
+
+    assert stand_in.data[b"fast_bitrix24:portal:lock"] == b"someone-else"
+    await backend.close()
+
+
+@pytest.mark.asyncio
+async def test_requests_made_without_acquire_reach_shared_bucket(tmp_path):
+    path = str(tmp_path / "state.json")
+
+    throttler_a = LeakyBucketThrottler(3, 2.0, FileLockBackend(path), "portal")
+    throttler_b = LeakyBucketThrottler(3, 2.0, FileLockBackend(path), "portal")
+
+    # запросы, отправленные в обход троттлера, учитываются
+    # при следующем обращении к общему состоянию
+    for _ in range(3):
+        throttler_a.add_request_record()
+    assert await throttler_a._update_state(throttler_a._reserve) == pytest.approx(
+        0.5, abs=0.05
+    )
+    assert await throttler_b._update_state(throttler_b._reserve) == pytest.approx(
+        1, abs=0.05
+    )
+
+
+@pytest.mark.asyncio
+async def test_file_lock_backend_does_not_block_event_loop(tmp_path, monkeypatch):
+    import time
+
+    backend = FileLockBackend(str(tmp_path / "state.json"))
+    read = backend._read
+
+    def slow_read():
+        time.sleep(0.1)
+        return read()
+
+    monkeypatch.setattr(backend, "_read", slow_read)
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticking = asyncio.ensure_future(ticker())
+    try:
+        async with backend.transaction("portal") as state:
+            state["x"] = 1
+    finally:
+        ticking.cancel()
+
+    # пока файл читался в другом потоке, цикл событий продолжал работать
+    assert ticks >= 5
+
+    async with backend.transaction("portal") as state:
+        assert state == {"x": 1}
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+
+from fast_bitrix24.circuit import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreakerPolicy,
+    CircuitOpenError,
+)
+from fast_bitrix24.retry import RetryPolicy
+from fast_bitrix24.scheduler import BatchScheduler
+from fast_bitrix24.srh import RateLimitError, ServerError, ServerRequestHandler
+
+
+def test_breaker_opens_after_threshold_and_probes_after_cooldown():
+    breaker = CircuitBreakerPolicy(failure_threshold=3, cooldown=0.1).create_breaker(
+        "crm.deal.list"
+    )
+
+    for _ in range(3):
+        breaker.before_request()
+        breaker.record_failure()
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    time.sleep(0.1)
+    assert breaker.state == HALF_OPEN
+
+    # пропускается только один пробный запрос
+    breaker.before_request()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_reopens_circuit():
+    breaker = CircuitBreakerPolicy(failure_threshold=1, cooldown=0.05).create_breaker(
+        "crm.deal.list"
+    )
+    breaker.record_failure()
+    time.sleep(0.05)
+
+    breaker.before_request()
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+
+
+def test_successes_reset_failure_count():
+    breaker = CircuitBreakerPolicy(failure_threshold=2).create_breaker("crm.deal.list")
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CLOSED
+
+
+def make_handler(**policy_kwargs):
+    return ServerRequestHandler(
+        "https://google.com/path",
+        None,
+        False,
+        50,
+        2,
+        480,
+        None,
+        retry_policy=RetryPolicy(base_delay=0, rate_limit_delay=0),
+        circuit_breaker=CircuitBreakerPolicy(**policy_kwargs),
+    )
+
+
+@pytest.mark.asyncio
+async def test_failing_method_fails_fast_without_slowing_others():
+    handler = make_handler(failure_threshold=3)
+    handler.request_attempt = AsyncMock(side_effect=ServerError("down"))
+
+    with pytest.raises(CircuitOpenError):
+        await handler.single_request("tasks.task.list")
+
+    # цепь разомкнулась после трех неудач, а не после всех попыток
+    assert handler.request_attempt.await_count == 3
+
+    with pytest.raises(CircuitOpenError):
+        await handler.single_request("tasks.task.list")
+    assert handler.request_attempt.await_count == 3
+
+    # остальные методы работают с прежним количеством одновременных запросов
+    handler.request_attempt.side_effect = None
+    handler.request_attempt.return_value = {"result": 1}
+    assert await handler.single_request("crm.deal.list") == {"result": 1}
+    assert handler.mcr_cur_limit == handler.mcr_max
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_refusals_do_not_open_circuit():
+    handler = make_handler(failure_threshold=2)
+    handler.request_attempt = AsyncMock(
+        side_effect=[RateLimitError("Too many requests")] * 3 + [{"result": 1}]
+    )
+
+    assert await handler.single_request("crm.deal.list") == {"result": 1}
+    assert handler.circuit_state("crm.deal.list") == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_batch_command_errors_count_against_their_method():
+    handler = make_handler(failure_threshold=1)
+    handler.request_attempt = AsyncMock(
+        return_value={
+            "result": {
+                "result": {"cmd1": [1]},
+                "result_error": {"cmd0": {"error": "Field UF_BROKEN not found"}},
+            }
+        }
+    )
+
+    await handler.single_request(
+        "batch",
+        {"halt": 0, "cmd": {"cmd0": "crm.deal.list?start=0", "cmd1": "crm.lead.list"}},
+    )
+
+    assert handler.circuit_state("crm.deal.list") == OPEN
+    assert handler.circuit_state("crm.lead.list") == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_scheduler_fails_open_methods_and_sends_one_probe():
+    handler = make_handler(failure_threshold=1, cooldown=0.05)
+    scheduler = BatchScheduler(handler, batch_size=50)
+    sent = []
+
+    async def request_attempt(method, params=None):
+        sent.append(list(params["cmd"].values()))
+        await asyncio.sleep(0.05)
+        return {"result": {"result": {label: 1 for label in params["cmd"]}}}
+
+    handler.request_attempt = request_attempt
+    handler.circuit_breaker("crm.deal.get").record_failure()
+
+    deal = asyncio.ensure_future(
+        scheduler.submit({"halt": 0, "cmd": {"a": "crm.deal.get?ID=1"}})
+    )
+    lead = asyncio.ensure_future(
+        scheduler.submit({"halt": 0, "cmd": {"a": "crm.lead.get?ID=1"}})
+    )
+
+    assert (await lead)["result"]["result"] == {"a": 1}
+    with pytest.raises(CircuitOpenError):
+        await deal
+
+    # после паузы уходит одна пробная команда, остальные ждут ее результата
+    await asyncio.sleep(0.05)
+    sent.clear()
+    deals = await asyncio.gather(
+        *(
+            scheduler.submit({"halt": 0, "cmd": {"a": f"crm.deal.get?ID={i}"}})
+            for i in range(3)
+        )
+    )
+
+    assert len(deals) == 3
+    assert sent[0] == ["crm.deal.get?ID=0"]
+    assert handler.circuit_state("crm.deal.get") == CLOSED
@@ -0,0 +1,24 @@
+import time
+
+from fast_bitrix24.duplicates import NegativeCache, normalize_communication
+
+
+def test_normalize_communication():
+    assert normalize_communication("PHONE", "+7 (999) 123-45-67") == "79991234567"
+    assert normalize_communication("PHONE", "нет") == ""
+    assert normalize_communication("EMAIL", " Info@Example.COM ") == "info@example.com"
+    assert normalize_communication("EMAIL", None) == ""
+
+
+def test_negative_cache_expires_and_evicts_oldest():
+    cache = NegativeCache(ttl=0.05, max_size=2)
+
+    cache.add("a")
+    cache.add("b")
+    cache.add("c")
+    assert "a" not in cache
+    assert "b" in cache and "c" in cache
+
+    time.sleep(0.05)
+    assert "b" not in cache
+    assert len(cache) == 1
@@ -5,6 +5,7 @@ import aiohttp.client_exceptions as exc
 import pytest
 
 from fast_bitrix24 import Bitrix
+from fast_bitrix24.retry import RetryPolicy
 
 
 @pytest.mark.skipif(sys.version_info < (3, 8), reason="requires python3.8 or higher")
@@ -18,6 +19,9 @@ async def test_retries(exception):
 
     srh.request_attempt = AsyncMock(spec=srh.request_attempt, side_effect=exception)
 
+    # паузы между попытками здесь не важны
+    srh.retry_policy = RetryPolicy(base_delay=0)
+
     # должна исчерпать все попытки и выдать RuntimeError
     with pytest.raises(RuntimeError):
         await srh.single_request("abc")
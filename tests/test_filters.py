@@ -0,0 +1,40 @@
+import pytest
+
+from fast_bitrix24.filters import filter_covers
+
+
+@pytest.mark.parametrize(
+    "broad, narrow",
+    [
+        ({}, {"CLOSED": "Y"}),
+        ({"CLOSED": "Y"}, {"CLOSED": "Y", ">ID": 5}),
+        ({">ID": 5}, {">ID": 7}),
+        ({">=ID": 5}, {">ID": 5}),
+        ({">ID": 5}, {">=ID": 6}),
+        ({"<=OPPORTUNITY": 100}, {"=OPPORTUNITY": "50"}),
+        ({"@STAGE_ID": ["NEW", "WON"]}, {"STAGE_ID": "WON"}),
+        ({"STAGE_ID": ["NEW", "WON", "LOSE"]}, {"@STAGE_ID": ["NEW", "WON"]}),
+        ({"<ID": 10}, {"@ID": [1, 2, 3]}),
+        ({"%TITLE": "test"}, {"%TITLE": "test", "CLOSED": "N"}),
+    ],
+)
+def test_filter_covers(broad, narrow):
+    assert filter_covers(broad, narrow)
+
+
+@pytest.mark.parametrize(
+    "broad, narrow",
+    [
+        ({"CLOSED": "Y"}, {}),
+        ({"CLOSED": "Y"}, {"CLOSED": "N"}),
+        ({">ID": 7}, {">ID": 5}),
+        ({">ID": 5}, {">=ID": 5}),
+        ({">ID": 5}, {"<ID": 10}),
+        ({"@STAGE_ID": ["NEW"]}, {"@STAGE_ID": ["NEW", "WON"]}),
+        ({">DATE_CREATE": "2024-01-01"}, {">DATE_CREATE": "2024-06-01"}),
+        ({"%TITLE": "test"}, {"%TITLE": "testing"}),
+        ({"!CLOSED": "Y"}, {"CLOSED": "N"}),
+    ],
+)
+def test_filter_does_not_cover(broad, narrow):
+    assert not filter_covers(broad, narrow)
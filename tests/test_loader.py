@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from fast_bitrix24 import Bitrix, BitrixAsync
+from fast_bitrix24.server_response import ErrorInServerResponseException
+
+
+class ContactSRH:
+    """Отвечает на команды `crm.contact.get` контактами,
+    а на ID 13 - ошибкой."""
+
+    def __init__(self):
+        self.batches = []
+
+    async def single_request(self, method, params=None):
+        self.batches.append(list(params["cmd"].values()))
+        await asyncio.sleep(0)
+
+        results, errors = {}, {}
+        for label, url in params["cmd"].items():
+            label = str(label)
+            if label == "13":
+                errors[label] = {"error": "Not found"}
+            else:
+                results[label] = {"ID": label, "url": url}
+
+        return {"result": {"result": results, "result_error": errors}}
+
+
+def make_client(client_cls=BitrixAsync):
+    bx = client_cls("https://google.com/path", verbose=False)
+    srh = ContactSRH()
+    bx.srh.single_request = srh.single_request
+    return bx, srh
+
+
+@pytest.mark.asyncio
+async def test_loads_in_one_tick_share_a_batch():
+    bx, srh = make_client()
+    loader = bx.loader("crm.contact.get")
+
+    results = await asyncio.gather(*(loader.load(ID) for ID in [1, 2, 3, 2, 1]))
+
+    assert [result["ID"] for result in results] == ["1", "2", "3", "2", "1"]
+    assert len(srh.batches) == 1
+    assert sorted(url.rstrip("&") for url in srh.batches[0]) == [
+        f"crm.contact.get?ID={ID}" for ID in (1, 2, 3)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_errors_are_resolved_per_ID():
+    bx, srh = make_client()
+    loader = bx.loader("crm.contact.get")
+
+    found, missing = await asyncio.gather(
+        loader.load(12), loader.load(13), return_exceptions=True
+    )
+
+    assert found["ID"] == "12"
+    assert isinstance(missing, ErrorInServerResponseException)
+    assert len(srh.batches) == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_and_linger():
+    bx, srh = make_client()
+    loader = bx.loader("crm.contact.get", cache=True, linger=0.02)
+
+    async def load_later(ID):
+        await asyncio.sleep(0.005)
+        return await loader.load(ID)
+
+    await asyncio.gather(loader.load(1), load_later(2))
+    assert len(srh.batches) == 1
+
+    # полученные сущности берутся из кэша
+    assert (await loader.load(1))["ID"] == "1"
+    assert len(srh.batches) == 1
+
+    loader.clear(1)
+    await loader.load(1)
+    assert len(srh.batches) == 2
+
+    # без кэша каждый вызов после получения результата идет на сервер
+    uncached = bx.loader("crm.contact.get")
+    await uncached.load(1)
+    await uncached.load(1)
+    assert len(srh.batches) == 4
+
+
+def test_sync_loader_coalesces_calls_from_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    bx, srh = make_client(Bitrix)
+    loader = bx.loader("crm.contact.get", linger=0.05)
+
+    try:
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(loader.load, [1, 2, 3, 4]))
+    finally:
+        bx.close()
+
+    assert [result["ID"] for result in results] == ["1", "2", "3", "4"]
+    assert len(srh.batches) == 1
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from fast_bitrix24 import BitrixPool
+from fast_bitrix24.pool import FairConcurrencyLimiter
+
+
+@pytest.mark.asyncio
+async def test_fair_limiter_serves_portals_round_robin():
+    limiter = FairConcurrencyLimiter(1)
+    order = []
+
+    async def request(tenant):
+        async with limiter.acquire(tenant):
+            order.append(tenant)
+            await asyncio.sleep(0)
+
+    # портал "a" поставил в очередь много запросов раньше портала "b"
+    await asyncio.gather(
+        *[request("a") for _ in range(4)], *[request("b") for _ in range(2)]
+    )
+
+    assert order == ["a", "a", "b", "a", "b", "a"]
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_fair_limiter_cancelled_waiter_frees_its_place():
+    limiter = FairConcurrencyLimiter(1)
+
+    async with limiter.acquire("a"):
+        waiter = asyncio.ensure_future(limiter.acquire("b").__aenter__())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    assert not limiter.waiters
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_pool_shares_session_and_evicts_least_recently_used():
+    async with BitrixPool(max_portals=2, verbose=False) as pool:
+        a = pool.get("https://a.bitrix24.ru/rest/1/x/")
+        b = pool.get("https://b.bitrix24.ru/rest/1/x/")
+
+        assert a.srh.session is b.srh.session
+        assert a.srh.leaky_bucket_throttler is not b.srh.leaky_bucket_throttler
+        assert a.srh.concurrency_limiter is pool.limiter
+
+        # "a" использован позже "b", поэтому вытесняется "b"
+        assert pool.get("https://a.bitrix24.ru/rest/1/x/") is a
+        pool.get("https://c.bitrix24.ru/rest/1/x/")
+
+        assert list(pool.clients) == [
+            "https://a.bitrix24.ru/rest/1/x/",
+            "https://c.bitrix24.ru/rest/1/x/",
+        ]
+
+    assert a.srh.session.closed
+
+
+@pytest.mark.asyncio
+async def test_pool_fan_out():
+    webhooks = ["https://a.bitrix24.ru/rest/1/x/", "https://b.bitrix24.ru/rest/1/x/"]
+
+    async def portal_host(client):
+        if "b." in client.srh.webhook:
+            raise ValueError("portal is down")
+        return client.srh.throttler_key_prefix
+
+    async with BitrixPool(verbose=False) as pool:
+        results = await pool.fan_out(portal_host, webhooks)
+
+    assert results[webhooks[0]] == "a.bitrix24.ru"
+    assert isinstance(results[webhooks[1]], ValueError)
+
+
+@pytest.mark.asyncio
+async def test_portal_waiting_on_its_bucket_does_not_hold_shared_slots():
+    async with BitrixPool(max_concurrent_requests=1, verbose=False) as pool:
+        slow = pool.get("https://slow.bitrix24.ru/rest/1/x/")
+        fast = pool.get("https://fast.bitrix24.ru/rest/1/x/")
+
+        # leaky bucket медленного портала переполнен
+        slow.srh.leaky_bucket_throttler.set_limits(1, 1)
+        async with slow.srh.send_slot():
+            pass
+        waiting = asyncio.ensure_future(slow.srh.send_slot().__aenter__())
+        await asyncio.sleep(0)
+
+        async def send():
+            async with fast.srh.send_slot():
+                pass
+
+        await asyncio.wait_for(send(), 0.1)
+
+        waiting.cancel()
+
+
+@pytest.mark.asyncio
+async def test_pool_does_not_evict_clients_in_use():
+    async with BitrixPool(max_portals=1, verbose=False) as pool:
+        async with pool.use("https://a.bitrix24.ru/rest/1/x/") as a:
+            # клиент "a" занят, поэтому пул временно превышает max_portals,
+            # а только что созданный клиент не вытесняется
+            b = pool.get("https://b.bitrix24.ru/rest/1/x/")
+            assert list(pool.clients.values()) == [a, b]
+
+        pool.get("https://c.bitrix24.ru/rest/1/x/")
+        assert list(pool.clients) == ["https://c.bitrix24.ru/rest/1/x/"]
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from fast_bitrix24.registry import MethodRegistry, default_registry
+from fast_bitrix24.scheduler import BatchScheduler
+from fast_bitrix24.server_response import ServerResponseParser
+from fast_bitrix24.srh import ServerRequestHandler
+
+
+def test_specific_patterns_refine_general_ones():
+    registry = MethodRegistry(
+        {
+            "*.list": {"returns_list": True, "read_only": True},
+            "crm.*.list": {"page_size": 20},
+            "crm.item.list": {"result_key": "items"},
+        }
+    )
+
+    info = registry.get(" CRM.Item.List ")
+    assert info.returns_list and info.read_only
+    assert info.page_size == 20
+    assert info.result_key == "items"
+
+    other = registry.get("tasks.task.get")
+    assert other.returns_list is False
+    assert other.page_size == 50
+
+
+def test_default_registry():
+    assert default_registry.get("tasks.task.list").id_field == "id"
+    assert default_registry.get("crm.deal.list").supports_id_filter
+    assert not default_registry.get("crm.deal.add").read_only
+    assert default_registry.get("crm.deal.get").returns_list is None
+    assert default_registry.get("crm.deal.list").full_select == ("*", "UF_*")
+    assert "PHONE" in default_registry.get("crm.contact.list").full_select
+
+    for method in ("task.elapseditem.getlist", "tasks.elapseditem.getlist"):
+        assert not default_registry.get(method).supports_order
+
+
+def test_register_updates_info_and_rejects_unknown_fields():
+    registry = default_registry.copy()
+    assert registry.get("crm.deal.list").cost == 1
+
+    registry.register("crm.deal.*", cost=3)
+    assert registry.get("crm.deal.list").cost == 3
+    assert default_registry.get("crm.deal.list").cost == 1
+
+    with pytest.raises(TypeError):
+        registry.register("crm.deal.list", pagesize=10)
+
+
+def test_result_key_unwraps_batch_results():
+    response = {
+        "result": {
+            "result": {
+                "cmd0": {"productRows": [{"id": 1}, {"id": 2}]},
+                "cmd1": {"productRows": [{"id": 3}]},
+            },
+            "result_error": [],
+        }
+    }
+
+    results = ServerResponseParser(response, result_key="productRows")
+    assert results.extract_results() == [{"id": 1}, {"id": 2}, {"id": 3}]
+
+    single = {"result": {"productRows": [{"id": 1}], "extra": 1}}
+    results = ServerResponseParser(single, result_key="productRows")
+    assert results.extract_results() == [{"id": 1}]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_limits_batch_by_command_cost():
+    registry = MethodRegistry({"catalog.product.list": {"cost": 2}})
+    handler = ServerRequestHandler(
+        "https://google.com/path",
+        None,
+        False,
+        50,
+        2,
+        480,
+        None,
+        method_registry=registry,
+    )
+    scheduler = BatchScheduler(handler, batch_size=4)
+    sent = []
+
+    async def request_attempt(method, params=None):
+        sent.append(list(params["cmd"].values()))
+        return {"result": {"result": {label: 1 for label in params["cmd"]}}}
+
+    handler.request_attempt = request_attempt
+
+    await asyncio.gather(
+        *(
+            scheduler.submit({"halt": 0, "cmd": {"a": f"catalog.product.list?{i}"}})
+            for i in range(3)
+        ),
+        scheduler.submit({"halt": 0, "cmd": {"a": "crm.deal.list"}}),
+    )
+
+    assert [len(batch) for batch in sent] == [2, 2]
@@ -0,0 +1,100 @@
+import time
+from email.utils import formatdate
+from unittest.mock import AsyncMock
+
+import pytest
+
+from fast_bitrix24.retry import (
+    CONNECTION_ERROR,
+    RATE_LIMIT,
+    RetryBudget,
+    RetryBudgetExhausted,
+    RetryPolicy,
+    parse_retry_after,
+)
+from fast_bitrix24.srh import RateLimitError, ServerError, ServerRequestHandler
+
+
+def test_delays_are_jittered_and_capped():
+    policy = RetryPolicy(base_delay=1, max_delay=8)
+
+    delays = [policy.delay(CONNECTION_ERROR, 10) for _ in range(200)]
+
+    assert all(0 <= delay <= 8 for delay in delays)
+    # одновременно упавшие запросы не повторяются одной волной
+    assert len(set(delays)) > 100
+
+
+def test_retry_after_is_respected():
+    policy = RetryPolicy(rate_limit_delay=1)
+
+    assert policy.delay(RATE_LIMIT, 1, retry_after=5) >= 5
+    assert parse_retry_after("7") == 7
+    assert parse_retry_after(formatdate(time.time() + 60, usegmt=True)) > 50
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_budget_caps_retries_at_share_of_traffic():
+    budget = RetryBudget(ratio=0.25, burst=2)
+
+    assert budget.try_withdraw()
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+
+    # бюджет восстанавливается только вместе с новыми запросами
+    for _ in range(4):
+        budget.on_request()
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+
+
+def make_failing_handler(error, **policy_kwargs):
+    handler = ServerRequestHandler(
+        "https://google.com/path",
+        None,
+        False,
+        50,
+        2,
+        480,
+        None,
+        retry_policy=RetryPolicy(base_delay=0, rate_limit_delay=0, **policy_kwargs),
+    )
+    handler.request_attempt = AsyncMock(side_effect=error)
+    return handler
+
+
+@pytest.mark.asyncio
+async def test_server_errors_stop_when_budget_is_exhausted():
+    handler = make_failing_handler(ServerError("down"), budget_burst=3)
+
+    with pytest.raises(RetryBudgetExhausted):
+        await handler.single_request("crm.deal.get")
+
+    # первая попытка и три повтора из бюджета
+    assert handler.request_attempt.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_retries_do_not_use_budget():
+    handler = make_failing_handler(
+        RateLimitError("Too many requests"), budget_burst=0, max_attempts=5
+    )
+
+    with pytest.raises(RuntimeError, match="exhausted"):
+        await handler.single_request("crm.deal.get")
+
+    assert handler.request_attempt.await_count == 5
+
+
+@pytest.mark.asyncio
+async def test_retry_waits_for_retry_after():
+    handler = make_failing_handler(None)
+    handler.request_attempt.side_effect = [
+        RateLimitError("Too many requests", retry_after=0.2),
+        {"result": 1},
+    ]
+
+    started = time.monotonic()
+    assert await handler.single_request("crm.deal.get") == {"result": 1}
+    assert time.monotonic() - started >= 0.2
@@ -0,0 +1,260 @@
+import asyncio
+import collections
+
+import pytest
+
+from fast_bitrix24.scheduler import BatchScheduler
+from fast_bitrix24.srh import ServerRequestHandler
+
+
+class EchoSRH(ServerRequestHandler):
+    """Отвечает на каждую команду батча ее же URL."""
+
+    def __init__(self):
+        super().__init__("https://google.com/path", None, True, 50, 2, 480, None)
+        self.batches = []
+
+    async def single_request(self, method, params=None):
+        self.batches.append(params)
+        await asyncio.sleep(0)
+        return {
+            "result": {
+                "result": {label: url for label, url in params["cmd"].items()},
+                "result_error": [],
+                "result_total": {label: 1 for label in params["cmd"]},
+            },
+            "time": {},
+        }
+
+
+def batch(*urls):
+    return {"halt": 0, "cmd": {f"cmd{i}": url for i, url in enumerate(urls)}}
+
+
+@pytest.mark.asyncio
+async def test_commands_of_different_requests_share_a_batch():
+    srh = EchoSRH()
+    scheduler = BatchScheduler(srh, batch_size=50)
+
+    deals, leads = await asyncio.gather(
+        scheduler.submit(batch("crm.deal.get?ID=1", "crm.deal.get?ID=2")),
+        scheduler.submit(batch("crm.lead.get?ID=1")),
+    )
+
+    assert len(srh.batches) == 1
+    assert len(srh.batches[0]["cmd"]) == 3
+
+    # каждый запрос получает ответ под своими метками
+    assert deals["result"]["result"] == {
+        "cmd0": "crm.deal.get?ID=1",
+        "cmd1": "crm.deal.get?ID=2",
+    }
+    assert deals["result"]["result_total"] == {"cmd0": 1, "cmd1": 1}
+    assert leads["result"]["result"] == {"cmd0": "crm.lead.get?ID=1"}
+
+
+@pytest.mark.asyncio
+async def test_single_request_batch_is_sent_as_is():
+    srh = EchoSRH()
+    scheduler = BatchScheduler(srh, batch_size=50)
+
+    request = batch("crm.deal.get?ID=1", "crm.deal.get?ID=2")
+    response = await scheduler.submit(request)
+
+    assert srh.batches == [request]
+    assert response["result"]["result"] == request["cmd"]
+
+
+@pytest.mark.asyncio
+async def test_throttled_method_does_not_hold_up_others():
+    srh = EchoSRH()
+    scheduler = BatchScheduler(srh, batch_size=50)
+
+    # бюджет времени отработки crm.deal.list исчерпан
+    srh.method_throttlers["crm.deal.list"] = srh.create_method_throttler(
+        "crm.deal.list"
+    )
+    srh.method_throttlers["crm.deal.list"].add_request_record(480)
+
+    deals = asyncio.ensure_future(scheduler.submit(batch("crm.deal.list?start=50")))
+    leads = asyncio.ensure_future(scheduler.submit(batch("crm.lead.list?start=50")))
+
+    response = await asyncio.wait_for(leads, 1)
+
+    assert response["result"]["result"] == {"cmd0": "crm.lead.list?start=50"}
+    assert [list(b["cmd"].values()) for b in srh.batches] == [
+        ["crm.lead.list?start=50"]
+    ]
+    assert not deals.done()
+
+    # отмененный запрос не оставляет команд в очереди
+    deals.cancel()
+    await asyncio.sleep(0)
+    scheduler.next_batch()
+    assert not scheduler.has_pending()
+
+
+@pytest.mark.asyncio
+async def test_batches_are_split_by_batch_size():
+    srh = EchoSRH()
+    scheduler = BatchScheduler(srh, batch_size=2)
+
+    responses = await asyncio.gather(
+        *(scheduler.submit(batch(f"crm.deal.get?ID={i}")) for i in range(5))
+    )
+
+    assert [len(b["cmd"]) for b in srh.batches] == [2, 2, 1]
+    assert [r["result"]["result"]["cmd0"] for r in responses] == [
+        f"crm.deal.get?ID={i}" for i in range(5)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_crash_fails_pending_requests():
+    srh = EchoSRH()
+    scheduler = BatchScheduler(srh, batch_size=50)
+
+    def broken(*args):
+        raise ValueError("broken budget")
+
+    srh.method_ready = broken
+
+    with pytest.raises(ValueError, match="broken budget"):
+        await asyncio.wait_for(scheduler.submit(batch("crm.deal.get?ID=1")), 1)
+
+    assert not scheduler.has_pending()
+
+
+@pytest.mark.asyncio
+async def test_client_requests_go_through_scheduler():
+    from fast_bitrix24 import BitrixAsync
+
+    bx = BitrixAsync("https://google.com/path", verbose=False)
+    echo = EchoSRH()
+    bx.srh.single_request = echo.single_request
+
+    deals, leads = await asyncio.gather(
+        bx.get_by_ID("crm.deal.get", [1, 2]),
+        bx.get_by_ID("crm.lead.get", [3, 4]),
+    )
+
+    # команды обоих запросов ушли на сервер одним батчем
+    assert len(echo.batches) == 1
+    assert sorted(deals) == ["1", "2"]
+    assert deals["2"].startswith("crm.deal.get?ID=2")
+    assert sorted(leads) == ["3", "4"]
+
+
+@pytest.mark.asyncio
+async def test_expired_deadline_returns_partial_results():
+    from fast_bitrix24 import BitrixAsync
+    from fast_bitrix24.partial import PartialDict
+
+    bx = BitrixAsync("https://google.com/path", verbose=False, batch_size=2)
+    echo = EchoSRH()
+
+    async def single_request(method, params=None):
+        # сервер "завис" на батче с последними ID
+        if "ID=3" in next(iter(params["cmd"].values())):
+            await asyncio.sleep(10)
+        return await echo.single_request(method, params)
+
+    bx.srh.single_request = single_request
+
+    with pytest.warns(RuntimeWarning, match="partial results"):
+        results = await bx.get_by_ID("crm.deal.get", [1, 2, 3, 4], timeout=0.2)
+
+    assert isinstance(results, PartialDict)
+    assert sorted(map(str, results)) == ["1", "2"]
+    assert results.missing == [3, 4]
+
+
+def hanging_client(failing_ID=None):
+    """Клиент, у которого запросы к `failing_ID` падают, а остальные висят.
+    Возвращает клиента и список отмененных запросов."""
+
+    from fast_bitrix24 import BitrixAsync
+
+    bx = BitrixAsync("https://google.com/path", verbose=False, batch_size=1)
+    cancelled = []
+
+    async def single_request(method, params=None):
+        url = next(iter(params["cmd"].values()))
+        if failing_ID is not None and url.startswith(f"crm.deal.get?ID={failing_ID}&"):
+            raise ValueError("broken batch")
+
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(url)
+            raise
+
+    bx.srh.single_request = single_request
+    return bx, cancelled
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_cancels_outstanding_batches():
+    bx, cancelled = hanging_client(failing_ID=1)
+
+    with pytest.raises(ValueError, match="broken batch"):
+        await asyncio.wait_for(bx.get_by_ID("crm.deal.get", [1, 2, 3, 4]), 1)
+
+    await asyncio.sleep(0)
+
+    # остальные батчи отменены, а не ждут ответа в фоне
+    assert len(cancelled) == 3
+    assert not bx.srh.batch_scheduler.sending
+    assert bx.srh.active_runs == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_cancels_its_batches():
+    bx, cancelled = hanging_client()
+
+    task = asyncio.ensure_future(bx.get_by_ID("crm.deal.get", [1, 2, 3]))
+    await asyncio.sleep(0.05)
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0)
+
+    assert len(cancelled) == 3
+    assert not bx.srh.batch_scheduler.sending
+    assert bx.srh.active_runs == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_mode_applies_only_within_its_context():
+    from fast_bitrix24 import BitrixAsync
+
+    bx = BitrixAsync("https://google.com/path", verbose=False, batch_size=2)
+    echo = EchoSRH()
+    running = collections.Counter()
+    peak = collections.Counter()
+
+    async def single_request(method, params=None):
+        entity = next(iter(params["cmd"].values())).split(".")[1]
+        running[entity] += 1
+        peak[entity] = max(peak[entity], running[entity])
+        await asyncio.sleep(0.02)
+        running[entity] -= 1
+        return await echo.single_request(method, params)
+
+    bx.srh.single_request = single_request
+
+    async def export():
+        with bx.slow(1):
+            return await bx.get_by_ID("crm.deal.get", [1, 2, 3, 4, 5, 6])
+
+    deals, leads = await asyncio.gather(
+        export(), bx.get_by_ID("crm.lead.get", [1, 2, 3, 4, 5, 6])
+    )
+
+    assert len(deals) == len(leads) == 6
+    assert peak["deal"] == 1
+    assert peak["lead"] > 1
+
+    # общие лимиты клиента не менялись
+    assert bx.srh.mcr_max == bx.srh.mcr_cur_limit == 50
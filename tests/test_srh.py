@@ -1,7 +1,18 @@
+import asyncio
 import contextlib
+import json
+import time
 import pytest
 from unittest.mock import AsyncMock, Mock
-from fast_bitrix24.srh import ServerRequestHandler
+from fast_bitrix24.srh import (
+    MIN_ATTEMPT_TIMEOUT,
+    DeadlineExceeded,
+    RateLimitError,
+    ServerError,
+    ServerRequestHandler,
+    critical_requests,
+    deadline_scope,
+)
 import aiohttp
 
 
@@ -60,3 +71,398 @@ async def test_request_attempt_returns_error_response_without_time():
     result = await handler.request_attempt("method", {"param": "value"})
 
     assert result == error_payload
+
+
+def test_state_survives_restart(tmp_path):
+    state_file = str(tmp_path / "state.json")
+
+    def make_handler():
+        return ServerRequestHandler(
+            "https://portal.bitrix24.ru/rest/1/secret/",
+            None,
+            True,
+            5,
+            1,
+            480,
+            None,
+            state_file=state_file,
+        )
+
+    handler = make_handler()
+    for _ in range(5):
+        handler.leaky_bucket_throttler.add_request_record()
+    handler.method_throttlers["crm.deal.list"] = handler.create_method_throttler(
+        "crm.deal.list"
+    )
+    handler.method_throttlers["crm.deal.list"].add_request_record(100)
+    handler.successive_results = -2
+    handler.mcr_cur_limit = 5
+    handler.save_state()
+
+    restarted = make_handler()
+
+    # новый процесс не начинает с пустого пула
+    assert restarted.leaky_bucket_throttler._reserve(
+        restarted.leaky_bucket_throttler._state, time.monotonic()
+    ) == pytest.approx(1, abs=0.1)
+    assert [
+        record.duration
+        for record in restarted.method_throttlers["crm.deal.list"]._request_history
+    ] == [100]
+    assert restarted.successive_results == -2
+    assert restarted.mcr_cur_limit == 5
+
+
+@pytest.mark.asyncio
+async def test_state_is_saved_after_last_run_with_user_session(tmp_path):
+    state_file = tmp_path / "state.json"
+    handler = ServerRequestHandler(
+        "https://portal.bitrix24.ru/rest/1/secret/",
+        None,
+        True,
+        5,
+        1,
+        480,
+        AsyncMock(),
+        state_file=str(state_file),
+    )
+
+    async def run():
+        return True
+
+    await handler.run_async(run())
+
+    assert "portal.bitrix24.ru" in json.loads(state_file.read_text())
+
+
+@pytest.mark.asyncio
+async def test_query_limit_exceeded_in_response_body():
+    mock_response = Mock(spec=aiohttp.ClientResponse)
+    mock_response.status = 503
+    mock_response.json.return_value = {
+        "error": "QUERY_LIMIT_EXCEEDED",
+        "error_description": "Too many requests",
+    }
+
+    @contextlib.asynccontextmanager
+    async def mock_post(url, json, ssl):
+        yield mock_response
+
+    mock_session = AsyncMock()
+    mock_session.post = mock_post
+
+    handler = ServerRequestHandler(
+        "https://google.com/webhook", None, True, 50, 2, 480, mock_session
+    )
+
+    with pytest.raises(RateLimitError):
+        await handler.request_attempt("method", {"param": "value"})
+
+
+def test_autotune_is_rejected_with_shared_backend(tmp_path):
+    from fast_bitrix24.backends import FileLockBackend
+
+    with pytest.raises(ValueError, match="autotune_rate_limits"):
+        ServerRequestHandler(
+            "https://portal.bitrix24.ru/rest/1/secret/",
+            None,
+            True,
+            50,
+            2,
+            480,
+            None,
+            throttler_backend=FileLockBackend(str(tmp_path / "state.json")),
+            autotune_rate_limits=True,
+        )
+
+
+def make_handler_with_response(response_json, status=200, **kwargs):
+    mock_response = Mock(spec=aiohttp.ClientResponse)
+    mock_response.status = status
+    mock_response.headers = {}
+    mock_response.json.return_value = response_json
+    if status >= 400:
+        mock_response.raise_for_status.side_effect = aiohttp.ClientResponseError(
+            Mock(), (), status=status
+        )
+
+    @contextlib.asynccontextmanager
+    async def mock_post(url, json, ssl):
+        yield mock_response
+
+    mock_session = AsyncMock()
+    mock_session.post = mock_post
+
+    return ServerRequestHandler(
+        "https://google.com/webhook", None, True, 50, 2, 480, mock_session, **kwargs
+    )
+
+
+@pytest.mark.asyncio
+async def test_batch_time_is_accounted_per_command_method():
+    batch_response = {
+        "result": {
+            "result": {"a": {}, "b": {}},
+            "result_error": [],
+            "result_time": {
+                "a": {"duration": 0.01, "operating": 1.5},
+                "b": {"duration": 0.02, "operating": 2.5},
+            },
+        },
+        "time": {"operating": 10},
+    }
+    handler = make_handler_with_response(batch_response)
+
+    await handler.request_attempt(
+        "batch",
+        {"halt": 0, "cmd": {"a": "crm.deal.get?ID=1", "b": "Tasks.Task.Get?taskId=1"}},
+    )
+
+    assert "batch" not in handler.method_throttlers
+    assert [
+        r.duration for r in handler.method_throttlers["crm.deal.get"]._request_history
+    ] == [1.5]
+    assert [
+        r.duration for r in handler.method_throttlers["tasks.task.get"]._request_history
+    ] == [2.5]
+
+
+@pytest.mark.asyncio
+async def test_only_limit_errors_are_rate_limits():
+    handler = make_handler_with_response(
+        {"error": "INTERNAL_SERVER_ERROR"}, status=503, autotune_rate_limits=True
+    )
+    handler.rate_limits_autotuner.on_rate_limited = Mock()
+
+    with pytest.raises(ServerError) as error:
+        await handler.request_attempt("crm.deal.get", {"ID": 1})
+
+    assert not isinstance(error.value, RateLimitError)
+    handler.rate_limits_autotuner.on_rate_limited.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_operation_time_limit_blocks_method_until_reset():
+    handler = make_handler_with_response(
+        {
+            "error": "OPERATION_TIME_LIMIT",
+            "error_description": "Method is blocked due to operation time limit.",
+            "time": {"operating_reset_at": time.time() + 30},
+        },
+        status=503,
+    )
+
+    with pytest.raises(RateLimitError) as error:
+        await handler.request_attempt("crm.deal.list", {})
+
+    assert 29 < error.value.retry_after <= 30
+    assert 29 < handler.method_wait_time("crm.deal.list") <= 30
+    assert handler.method_wait_time("crm.deal.get") == 0
+
+
+@pytest.mark.asyncio
+async def test_operating_reset_at_releases_running_time():
+    handler = make_handler_with_response(
+        {
+            "result": {},
+            "time": {"operating": 480, "operating_reset_at": time.time() + 5},
+        }
+    )
+
+    await handler.request_attempt("crm.deal.list", {})
+
+    # бюджет метода исчерпан, но сервер освободит его через 5 секунд,
+    # а не через 10 минут
+    assert 4 < handler.method_wait_time("crm.deal.list") <= 5
+
+
+@pytest.mark.asyncio
+async def test_operation_time_limit_in_batch_blocks_command_method():
+    handler = make_handler_with_response(
+        {
+            "result": {
+                "result": {"b": {}},
+                "result_error": {
+                    "a": {
+                        "error": "OPERATION_TIME_LIMIT",
+                        "error_description": "Method is blocked",
+                    }
+                },
+                "result_time": {
+                    "a": {"operating": 0, "operating_reset_at": time.time() + 20},
+                    "b": {"operating": 1},
+                },
+            }
+        }
+    )
+
+    await handler.request_attempt(
+        "batch",
+        {"halt": 0, "cmd": {"a": "crm.deal.list", "b": "crm.contact.get?ID=1"}},
+    )
+
+    assert 19 < handler.method_wait_time("crm.deal.list") <= 20
+    assert handler.method_wait_time("crm.contact.get") == 0
+
+
+@pytest.mark.asyncio
+async def test_method_concurrency_limits():
+    handler = make_handler_with_response(
+        {"result": {}}, method_concurrency_limits={"tasks.*": 1}
+    )
+    running = []
+    max_running = {"tasks": 0, "crm": 0}
+
+    async def request(method):
+        async with handler.acquire(method):
+            running.append(method)
+            group = method.split(".")[0]
+            max_running[group] = max(
+                max_running[group], sum(m.startswith(group) for m in running)
+            )
+            await asyncio.sleep(0.01)
+            running.remove(method)
+
+    await asyncio.gather(
+        *(request(m) for m in ["tasks.task.get", "tasks.task.list"] * 2),
+        *(request("crm.deal.get") for _ in range(3)),
+    )
+
+    assert max_running == {"tasks": 1, "crm": 3}
+
+
+@pytest.mark.asyncio
+async def test_capped_method_does_not_hold_global_slots():
+    handler = make_handler_with_response(
+        {"result": {}}, method_concurrency_limits={"tasks.*": 1}
+    )
+    handler.mcr_cur_limit = handler.mcr_max = 5
+
+    async def request(method):
+        async with handler.acquire(method):
+            await asyncio.sleep(0.05)
+
+    tasks = [asyncio.ensure_future(request("tasks.task.get")) for _ in range(10)]
+    await asyncio.sleep(0)
+
+    # запросы, ждущие своей очереди к tasks.*, не занимают общие слоты
+    started = time.monotonic()
+    await request("crm.deal.get")
+    assert time.monotonic() - started < 0.1
+
+    await asyncio.gather(*tasks)
+
+
+def test_operating_time_reserve_is_left_for_critical_requests(monkeypatch):
+    handler = make_handler_with_response(
+        {"result": {}}, operating_time_reserve={"crm.*": 0.1, "crm.deal.list": 0.5}
+    )
+
+    assert handler.reserved_share("crm.deal.list") == 0.5
+    assert handler.reserved_share("crm.lead.list") == 0.1
+    assert handler.reserved_share("tasks.task.list") == 0
+
+    handler.method_throttlers["crm.deal.list"] = handler.create_method_throttler(
+        "crm.deal.list"
+    )
+    handler.method_throttlers["crm.deal.list"].add_request_record(300)
+
+    throttler = handler.method_throttlers["crm.deal.list"]
+    assert throttler._calculate_needed_sleep_time(
+        handler.reserved_share("crm.deal.list")
+    ) > 0
+
+    token = critical_requests.set(True)
+    try:
+        assert throttler._calculate_needed_sleep_time(
+            handler.reserved_share("crm.deal.list")
+        ) == 0
+    finally:
+        critical_requests.reset(token)
+
+
+@pytest.mark.asyncio
+async def test_slow_read_is_hedged():
+    responses = {"calls": 0}
+
+    @contextlib.asynccontextmanager
+    async def mock_post(url, json, ssl, **kwargs):
+        responses["calls"] += 1
+        # первый запрос "завис" на медленном сервере
+        if responses["calls"] == 1:
+            await asyncio.sleep(10)
+
+        response = Mock(spec=aiohttp.ClientResponse)
+        response.status = 200
+        response.json.return_value = {
+            "result": responses["calls"],
+            "time": {"operating": 2},
+        }
+        yield response
+
+    mock_session = AsyncMock()
+    mock_session.post = mock_post
+
+    handler = ServerRequestHandler(
+        "https://google.com/webhook",
+        None,
+        True,
+        50,
+        2,
+        480,
+        mock_session,
+        hedge_requests=True,
+    )
+    for _ in range(20):
+        handler.latency_tracker.add("crm.deal.get", 0.01)
+
+    started = time.monotonic()
+    result = await handler.single_request("crm.deal.get", {"ID": 1})
+
+    assert time.monotonic() - started < 1
+    assert result == {"result": 2, "time": {"operating": 2}}
+
+    # стоимость отмененного, но отправленного запроса учтена
+    assert [
+        r.duration for r in handler.method_throttlers["crm.deal.get"]._request_history
+    ] == [2, 2]
+
+
+@pytest.mark.asyncio
+async def test_writes_are_not_hedged():
+    handler = make_handler_with_response({"result": 1}, hedge_requests=True)
+    for _ in range(20):
+        handler.latency_tracker.add("crm.deal.add", 0.01)
+
+    assert not handler.is_idempotent("crm.deal.add")
+    assert not handler.is_idempotent(
+        "batch", {"cmd": {"a": "crm.deal.get?ID=1", "b": "crm.deal.add?x=1"}}
+    )
+    assert handler.is_idempotent("batch", {"cmd": {"a": "crm.deal.get?ID=1"}})
+
+
+@pytest.mark.asyncio
+async def test_deadline_bounds_throttler_sleep():
+    handler = make_handler_with_response({"result": 1})
+    handler.leaky_bucket_throttler.set_limits(1, 0.1)
+    await handler.single_request("crm.deal.get", {"ID": 1})
+
+    started = time.monotonic()
+    with deadline_scope(timeout=0.1):
+        with pytest.raises(DeadlineExceeded):
+            await handler.single_request("crm.deal.get", {"ID": 2})
+
+    assert time.monotonic() - started < 1
+
+
+def test_attempt_timeout_adapts_to_latency():
+    handler = make_handler_with_response({"result": 1})
+    assert handler.attempt_timeout("crm.deal.get") is None
+
+    for latency in [1] * 19 + [20]:
+        handler.latency_tracker.add("crm.deal.get", latency)
+    assert handler.attempt_timeout("crm.deal.get") == 60
+
+    for _ in range(200):
+        handler.latency_tracker.add("crm.deal.get", 0.5)
+    assert handler.attempt_timeout("crm.deal.get") == MIN_ATTEMPT_TIMEOUT
@@ -1,7 +1,11 @@
+import asyncio
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import pytest
 
+from fast_bitrix24.srh import critical_requests
+
 
 @pytest.mark.skipif(
     not os.getenv("FAST_BITRIX24_TEST_WEBHOOK"),
@@ -253,3 +257,216 @@ class TestErrors:
             b.call("_", {"select": ["*"]})
 
         b.call("_", [1, {"a": 2}], raw=True)
+
+
+class TestBackgroundLoop:
+    @staticmethod
+    def stub_requests(b):
+        calls = []
+
+        async def request_attempt(method, params=None):
+            calls.append(
+                (
+                    asyncio.get_running_loop(),
+                    b.srh.session,
+                    critical_requests.get(),
+                )
+            )
+            await asyncio.sleep(0.01)
+            return {
+                "result": {
+                    "result": {
+                        label: int(url.split("ID=")[1].split("&")[0])
+                        for label, url in params["cmd"].items()
+                    },
+                    "result_error": [],
+                },
+                "time": {},
+            }
+
+        b.srh.request_attempt = request_attempt
+        return calls
+
+    def test_calls_share_loop_and_session(self, bx_dummy):
+        b = bx_dummy
+        calls = self.stub_requests(b)
+
+        assert b.call("crm.lead.get", {"ID": 1}) == 1
+        assert b.call("crm.lead.get", {"ID": 2}) == 2
+
+        (loop1, session1, _), (loop2, session2, _) = calls
+        assert loop1 is loop2
+        assert session1 is session2 and not session1.closed
+
+        b.close()
+        assert session1.closed
+        assert loop1.is_closed()
+
+    def test_threads_share_client(self, bx_dummy):
+        b = bx_dummy
+        calls = self.stub_requests(b)
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(
+                executor.map(lambda i: b.call("crm.lead.get", {"ID": i}), range(16))
+            )
+
+        assert results == list(range(16))
+        assert len({loop for loop, _, _ in calls}) == 1
+        b.close()
+
+    def test_submit_returns_concurrent_future(self, bx_dummy):
+        b = bx_dummy
+        self.stub_requests(b)
+
+        futures = [b.submit(b.call, "crm.lead.get", {"ID": i}) for i in range(3)]
+
+        assert all(isinstance(future, Future) for future in futures)
+        assert [future.result(timeout=5) for future in futures] == [0, 1, 2]
+
+        with pytest.raises(ValueError):
+            b.submit(print, "crm.lead.get")
+
+        b.close()
+
+    def test_context_is_passed_to_loop(self, bx_dummy):
+        b = bx_dummy
+        calls = self.stub_requests(b)
+
+        with b.critical():
+            b.call("crm.lead.get", {"ID": 1})
+        b.call("crm.lead.get", {"ID": 2})
+
+        assert [critical for _, _, critical in calls] == [True, False]
+        b.close()
+
+
+    def test_capped_concurrent_submits(self):
+        # события ожидания слотов создаются в потоке, создающем клиента,
+        # а ждут их в цикле событий потока клиента
+        import contextlib
+        from unittest.mock import Mock
+
+        from fast_bitrix24 import Bitrix
+
+        running = []
+        max_running = [0]
+
+        class Session:
+            closed = False
+
+            @contextlib.asynccontextmanager
+            async def post(self, url, json, ssl, **kwargs):
+                running.append(url)
+                max_running[0] = max(max_running[0], len(running))
+                await asyncio.sleep(0.02)
+                running.remove(url)
+
+                response = Mock(status=200, headers={})
+
+                async def response_json(**kwargs):
+                    return {"result": json["ID"], "time": {"operating": 0}}
+
+                response.json = response_json
+                yield response
+
+            async def close(self):
+                self.closed = True
+
+        b = Bitrix(
+            "https://google.com/path",
+            verbose=False,
+            method_concurrency_limits={"crm.*": 1},
+        )
+        b.srh.session = Session()
+        b.srh.mcr_max = b.srh.mcr_cur_limit = 1
+
+        futures = [
+            b.submit(b.call, "crm.lead.get", {"ID": i}, raw=True) for i in range(4)
+        ]
+
+        try:
+            results = [future.result(timeout=5) for future in futures]
+        finally:
+            b.close()
+
+        assert [result["result"] for result in results] == [0, 1, 2, 3]
+        assert max_running[0] == 1
+
+
+class TestIterators:
+    TOTAL = 500
+
+    @classmethod
+    def stub_list(cls, b):
+        """Сервер со списком из `TOTAL` лидов, страницы которого
+        пересекаются на одного лида."""
+
+        sent = []
+
+        def page(start):
+            first = max(start - 1, 0)
+            return [{"ID": i} for i in range(first, min(start + 50, cls.TOTAL))]
+
+        async def request_attempt(method, params=None):
+            await asyncio.sleep(0.01)
+
+            if method != "batch":
+                return {"result": page(0), "total": cls.TOTAL, "next": 50, "time": {}}
+
+            sent.append(params)
+            starts = {
+                label: int(url.split("start=")[1].split("&")[0])
+                for label, url in params["cmd"].items()
+            }
+            return {
+                "result": {
+                    "result": {label: page(start) for label, start in starts.items()},
+                    "result_error": [],
+                    "result_total": {label: cls.TOTAL for label in starts},
+                },
+                "time": {},
+            }
+
+        b.srh.request_attempt = request_attempt
+        return sent
+
+    def test_iter_all_yields_each_item_once(self):
+        from fast_bitrix24 import Bitrix
+
+        with Bitrix("https://google.com/path", verbose=False, batch_size=2) as b:
+            self.stub_list(b)
+            items = list(b.iter_all("crm.lead.list"))
+
+        assert sorted(item["ID"] for item in items) == list(range(self.TOTAL))
+
+    def test_slow_consumer_holds_back_requests(self):
+        import time
+
+        from fast_bitrix24 import Bitrix
+
+        with Bitrix("https://google.com/path", verbose=False, batch_size=1) as b:
+            sent = self.stub_list(b)
+            items = b.iter_all("crm.lead.list", buffer_size=1)
+
+            next(items)
+            time.sleep(0.3)
+
+            # страниц 9, но впрок запрошены не все
+            assert len(sent) < 9
+
+            items.close()
+            sent_when_closed = len(sent)
+            time.sleep(0.1)
+            assert len(sent) == sent_when_closed
+
+    def test_iter_by_ID_yields_pairs(self, bx_dummy):
+        b = bx_dummy
+        TestBackgroundLoop.stub_requests(b)
+
+        pairs = b.iter_by_ID("crm.lead.get", (i for i in range(1, 6)))
+
+        assert {str(ID): result for ID, result in pairs} == {
+            str(i): i for i in range(1, 6)
+        }
+        b.close()
@@ -13,7 +13,8 @@ from fast_bitrix24.throttle import LeakyBucketThrottler, SlidingWindowThrottler
     "pool_size, requests_per_second, requests_made, sleep_time, test_id",
     [
         (5, 1.0, 3, 0, "acquire_happy_no_wait"),
-        (5, 1.0, 8, 1, "acquire_happy_path_wait"),
+        (5, 1.0, 5, 1, "acquire_happy_path_wait"),
+        (5, 1.0, 8, 4, "acquire_reserved_queue_wait"),
     ],
 )
 async def test_leaky_bucket(
@@ -47,6 +48,54 @@ async def test_leaky_bucket(
     assert sum(sleep_log) == sleep_time
 
 
+@pytest.mark.asyncio
+async def test_leaky_bucket_concurrent_callers_do_not_stampede(monkeypatch):
+    start_time = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: start_time)
+
+    sleep_log = []
+
+    async def fake_sleep(duration):
+        sleep_log.append(duration)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+
+    throttler = LeakyBucketThrottler(3, 2.0)
+
+    async def request():
+        async with throttler.acquire():
+            pass
+
+    await asyncio.gather(*(request() for _ in range(7)))
+
+    # первые 3 запроса проходят сразу, остальные - строго по очереди
+    assert sorted(sleep_log) == [0, 0, 0, 0.5, 1.0, 1.5, 2.0]
+
+
+@pytest.mark.asyncio
+async def test_leaky_bucket_refund_on_cancel(monkeypatch):
+    start_time = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: start_time)
+
+    throttler = LeakyBucketThrottler(1, 1.0)
+    throttler.add_request_record()
+
+    async def request():
+        async with throttler.acquire():
+            pass
+
+    task = asyncio.ensure_future(request())
+    await asyncio.sleep(0)
+    assert throttler._state["empty_at"] == start_time + 2
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # место отмененного запроса освободилось
+    assert throttler._state["empty_at"] == start_time + 1
+
+
 @pytest.mark.parametrize(
     "max_request_running_time, measurement_period, requests, measurements",
     [